@@ -23,3 +23,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Twilio callbacks skip the middleware stack (whatsapp_chat/ingress.py)
+from whatsapp_chat.ingress import asgi_app  # noqa: E402
+application = asgi_app(application)
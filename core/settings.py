@@ -88,6 +88,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # concurrent writers (web, dispatch_outbox, process_inbound threads) wait up to 20s for the
+        # lock. Their transactions write before they read (shards.confirm, outbox.claim_due): one that
+        # reads first fails at once if another writer committed in between, instead of waiting.
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -166,3 +170,57 @@ OPENAI_TEMPERATURE = 0.2
 OPENAI_MAX_TOKENS = 512
 
 FORWARDING_DOMAIN=os.getenv("FORWARDING_DOMAIN") # your ngrok or other domain for webhook
+
+# Webhook admission control (whatsapp_chat/ratelimit.py)
+RATE_LIMIT_RATE = 0.2        # messages/sec per sender (12/min) ...
+RATE_LIMIT_BURST = 5         # ... with bursts of up to 5
+RATE_LIMIT_CACHE = None      # cache alias to share buckets across workers, e.g. "default"
+LLM_MAX_CONCURRENCY = 8      # concurrent LLM calls per process; beyond this requests queue fairly
+LLM_MAX_WAITING = 32         # queued requests beyond this get the canned "busy" reply
+
+# Token accounting (whatsapp_chat/usage.py)
+LLM_MAX_INPUT_TOKENS = 1500  # user text above this (local estimate) is trimmed before it is sent
+# LLM_PRICING = {"gpt-4o-mini": (0.15, 0.60)}  # USD per 1M (prompt, completion) tokens, overrides the built-in table
+
+# Tracing (whatsapp_chat/tracing.py) - OTLP/JSON spans for webhook, LLM, DB and Twilio stages
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")   # "file" -> TRACING_FILE, "otlp" -> collector
+TRACING_FILE = os.getenv("TRACING_FILE") or BASE_DIR / "traces.jsonl"
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+
+# `python manage.py bench_startup` fails above this (median cold import of settings + URLconf)
+STARTUP_IMPORT_BUDGET_MS = 600
+
+# Outbound outbox (whatsapp_chat/outbox.py) - run `python manage.py dispatch_outbox` alongside the web server
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE = 5.0    # seconds; 5, 10, 20, 40... (jittered) up to OUTBOX_BACKOFF_MAX
+OUTBOX_BACKOFF_MAX = 15 * 60.0
+
+# Admin changelist on large tables (whatsapp_chat/changelist.py)
+ADMIN_EXACT_COUNT_BELOW = 20_000           # below this the paginator still runs an exact COUNT(*)
+ADMIN_COUNT_CACHE_SECONDS = 60
+ADMIN_FILTER_CHOICES_CACHE_SECONDS = 600
+
+# Knowledge base for retrieval-augmented replies (whatsapp_chat/knowledge.py) - build with `python manage.py kb_ingest`
+KNOWLEDGE_ENABLED = True
+KNOWLEDGE_DIR = BASE_DIR / "knowledge_index"
+KNOWLEDGE_EMBEDDER = "whatsapp_chat.knowledge.HashingEmbedder"  # or "whatsapp_chat.knowledge.OpenAIEmbedder"
+KNOWLEDGE_TOP_K = 3                  # chunks injected into the system prompt ...
+KNOWLEDGE_MIN_SCORE = 0.2            # ... if at least this similar to the question
+KNOWLEDGE_MAX_CONTEXT_TOKENS = 600   # and never more than this (local estimate)
+
+# Compact ChatMessage storage (whatsapp_chat/compact.py) - after upgrading run `python manage.py compact_messages`
+CHATMESSAGE_COMPRESS_AFTER_DAYS = None   # e.g. 90: compact_messages zstd-compresses older long texts (needs zstandard)
+CHATMESSAGE_COMPRESS_MIN_BYTES = 512     # shorter texts aren't worth compressing
+CHATMESSAGE_BACKFILL_COMPLETE = False    # True once `compact_messages --check` reports 0: reads stop checking the legacy columns
+
+# Twilio callbacks (/webhook, /status) bypass DRF and the middleware stack (whatsapp_chat/ingress.py)
+TWILIO_LEAN_INGRESS = True
+
+# Sharded inbound processing (whatsapp_chat/shards.py) - run `python manage.py process_inbound` on each node
+INBOUND_SHARDED = False            # True: the webhook only queues; workers answer in order per conversation
+INBOUND_SLOTS = 256                # conversations hash to slots, slots are spread over the live workers
+INBOUND_WORKER_CONCURRENCY = 8     # conversations answered in parallel per worker process
+INBOUND_LEASE_SECONDS = 30.0       # a dead worker's messages are retried by the new owner after this
+SHARD_HEARTBEAT_SECONDS = 5.0
+SHARD_MEMBER_TTL = 15.0            # a worker silent for this long leaves the ring
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# Twilio callbacks skip the middleware stack (whatsapp_chat/ingress.py)
+from whatsapp_chat.ingress import wsgi_app  # noqa: E402
+application = wsgi_app(application)
+
+# gunicorn --preload: pull in the lazily imported provider SDKs before workers fork
+if os.getenv("WSGI_PRELOAD_PROVIDERS") == "1":
+    from whatsapp_chat.preload import preload
+    preload()
@@ -0,0 +1,15 @@
+# gunicorn.conf.py
+#   gunicorn core.wsgi -c gunicorn.conf.py
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+
+# Import Django + provider SDKs once in the master; workers share them copy-on-write
+preload_app = True
+os.environ.setdefault("WSGI_PRELOAD_PROVIDERS", "1")
+
+
+def post_fork(server, worker):
+    from whatsapp_chat.preload import reset_after_fork
+    reset_after_fork()
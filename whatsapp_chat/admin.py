@@ -1,16 +1,99 @@
 # whatsapp_chat/admin.py
 from django.contrib import admin
-from .models import ChatMessage
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Substr
+from .changelist import EstimatedCountPaginator, IndexedDatesQuerySet, LeanChangeList, cached_choices_filter
+from .models import ChatMessage, InboundMessage, OutboundMessage, ShardMember
+from . import compact, outbox, search
 
 
 @admin.register(ChatMessage)
 class ChatMessageAdmin(admin.ModelAdmin):
     list_display = (
-        "user_text","created_at", "from_phone", "to_phone",
+        "user_text_preview","created_at", "from_phone", "to_phone_ref",
         "message_sid", "outbound_message_sid",
-        "delivery_status", "latency_ms",
+        "delivery_status_ref", "latency_ms", "completion_tokens", "cost_usd",
+    )
+    # to_phone_ref (exact) and user_text / response_text (full-text index) are added in get_search_results
+    search_fields = ("from_phone", "=message_sid", "=outbound_message_sid")
+    list_filter = (
+        cached_choices_filter("delivery_status_ref", "delivery status"),
+        cached_choices_filter("sms_status_ref", "sms status"),
+        cached_choices_filter("model_name_ref", "model name"),
+        cached_choices_filter("finish_reason_ref", "finish reason"),
+        "created_at",
     )
-    search_fields = ("from_phone", "to_phone", "message_sid", "outbound_message_sid", "user_text", "response_text")
-    list_filter = ("delivery_status", "sms_status", "model_name", "created_at")
     readonly_fields = ("created_at",)
 
+    # Large-table mode: no COUNT(*) per page, no facet counts, narrow SELECT
+    date_hierarchy = "created_at"  # backed by the (created_at, id) index
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    list_only = (
+        "id", "created_at", "from_phone", "to_phone_ref", "message_sid", "outbound_message_sid",
+        "delivery_status_ref", "latency_ms", "completion_tokens", "cost_usd",
+    )
+    list_annotations = {
+        "user_text_short": Substr("user_text", 1, 81),  # one past the preview: tells if it was cut
+        "user_text_archived": ExpressionWrapper(Q(user_text_z__isnull=False), output_field=BooleanField()),
+    }
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return IndexedDatesQuerySet(model=qs.model, query=qs.query, using=qs._db)
+
+    def get_changelist(self, request, **kwargs):
+        return LeanChangeList
+
+    def get_readonly_fields(self, request, obj=None):
+        fields = super().get_readonly_fields(request, obj)
+        if obj is not None and compact.is_archived(obj):
+            fields = (*fields, "user_text", "response_text")  # compressed: see compact.CompressibleTextField
+        return fields
+
+    @admin.display(description="user text")
+    def user_text_preview(self, obj):
+        if getattr(obj, "user_text_archived", False):
+            return "(compressed)"
+        text = getattr(obj, "user_text_short", None)
+        if text is None:
+            text = obj.user_text or ""
+        return text[:80] + "…" if len(text) > 80 else text
+
+    def get_search_results(self, request, queryset, search_term):
+        qs, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            qs = (qs
+                  | queryset.filter(compact.value_q(ChatMessage, "to_phone_ref", search_term.strip(), queryset.db))
+                  | queryset.filter(search.matching_q(search_term, using=queryset.db)))
+        return qs, may_have_duplicates
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "to_phone", "status", "attempts", "next_attempt_at", "sid", "last_error_code")
+    list_filter = ("status", "last_error_code")
+    search_fields = ("to_phone", "=sid")
+    raw_id_fields = ("chat_message",)
+    readonly_fields = ("created_at", "updated_at")
+    actions = ["retry_dead"]
+
+    @admin.action(description="Retry selected dead-lettered messages")
+    def retry_dead(self, request, queryset):
+        n = outbox.requeue(queryset)
+        self.message_user(request, f"{n} message(s) requeued.")
+
+
+@admin.register(InboundMessage)
+class InboundMessageAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "conversation", "slot", "status", "attempts", "worker", "finished_at")
+    list_filter = ("status",)
+    search_fields = ("=conversation",)
+    raw_id_fields = ("chat_message",)
+    readonly_fields = ("created_at", "started_at", "finished_at")
+
+
+@admin.register(ShardMember)
+class ShardMemberAdmin(admin.ModelAdmin):
+    list_display = ("name", "heartbeat_at", "started_at")
@@ -0,0 +1,224 @@
+# whatsapp_chat/changelist.py
+"""
+Admin changelist helpers for very large tables.
+
+- EstimatedCountPaginator: planner/statistics based row counts instead of COUNT(*),
+  cached in the Django cache.
+- cached_choices_filter(): list_filter whose choices are cached, and for LookupFields
+  built from the Lookup table with index probes instead of a SELECT DISTINCT.
+- LookupFieldListFilter: the default list_filter for compact.LookupField columns.
+- LeanChangeList: loads only the columns shown in list_display.
+- IndexedDatesQuerySet: date_hierarchy drill-down via index probes instead of
+  SELECT DISTINCT over every row in the range.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.filters import AllValuesFieldListFilter, FieldListFilter
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, Max, Min, Q, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import compact
+
+COUNT_TTL = int(getattr(settings, "ADMIN_COUNT_CACHE_SECONDS", 60))
+CHOICES_TTL = int(getattr(settings, "ADMIN_FILTER_CHOICES_CACHE_SECONDS", 600))
+EXACT_COUNT_BELOW = int(getattr(settings, "ADMIN_EXACT_COUNT_BELOW", 20_000))
+
+
+def _table_estimate(qs):
+    """Row count of the whole table from DB statistics, or None if unavailable."""
+    connection = connections[qs.db]
+    table = qs.model._meta.db_table
+    with connection.cursor() as cur:
+        if connection.vendor == "postgresql":
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cur.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == "sqlite":
+            # MAX(rowid) is an O(log n) b-tree lookup; rows are rarely deleted here.
+            cur.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+            row = cur.fetchone()
+            return int(row[0] or 0)
+    return None
+
+
+def _plan_estimate(qs):
+    """Planner's row estimate for a filtered queryset (Postgres only)."""
+    connection = connections[qs.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = qs.order_by().values("pk").query.sql_with_params()
+    with connection.cursor() as cur:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose `count` avoids COUNT(*) on big tables:
+    unfiltered -> table statistics; filtered -> planner estimate (Postgres).
+    Small results (below EXACT_COUNT_BELOW) are counted exactly. Every count is
+    cached for COUNT_TTL seconds, keyed by the SQL.
+    """
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        sql, params = qs.query.sql_with_params()
+        key = "admin-count:" + hashlib.md5(f"{qs.db}:{sql}:{params}".encode()).hexdigest()
+        if (cached := cache.get(key)) is not None:
+            return cached
+
+        estimate = _table_estimate(qs) if not qs.query.where else _plan_estimate(qs)
+        if estimate is None or estimate < EXACT_COUNT_BELOW:
+            estimate = qs.count()
+        cache.set(key, estimate, COUNT_TTL)
+        return estimate
+
+
+def cached_choices_filter(field, title=None):
+    """
+    A list_filter for a low-cardinality column; its choices are cached, not queried per
+    request. On a LookupField they come from compact.lookup_choices() (index probes).
+    """
+
+    class CachedChoicesFilter(admin.SimpleListFilter):
+        parameter_name = field
+
+        def lookups(self, request, model_admin):
+            model = model_admin.model
+            key = f"admin-choices:{model._meta.label_lower}:{field}"
+            values = cache.get(key)
+            if values is None:
+                if isinstance(model._meta.get_field(field), compact.LookupField):
+                    values = compact.lookup_choices(model, field)
+                else:
+                    values = compact.distinct_values(model._default_manager.all(), field)
+                cache.set(key, values, CHOICES_TTL)
+            return [(v, v) for v in values]
+
+        def queryset(self, request, queryset):
+            if self.value():
+                return queryset.filter(compact.value_q(queryset.model, field, self.value(), queryset.db))
+            return queryset
+
+    CachedChoicesFilter.title = title or field.replace("_", " ")
+    CachedChoicesFilter.__name__ = f"{field.title().replace('_', '')}Filter"
+    return CachedChoicesFilter
+
+
+class LookupFieldListFilter(AllValuesFieldListFilter):
+    """AllValuesFieldListFilter whose filter and facet values are resolved to lookup ids."""
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.lookup_choices = compact.distinct_values(model_admin.get_queryset(request), field.name)
+
+    def _q(self, values):
+        return compact.value_q(self.field.model, self.field.name, values)
+
+    def queryset(self, request, queryset):
+        if values := self.used_parameters.get(self.lookup_kwarg):
+            queryset = queryset.filter(self._q(values))
+        if isnull := self.used_parameters.get(self.lookup_kwarg_isnull):
+            queryset = queryset.filter(**{self.lookup_kwarg_isnull: isnull[-1]})
+        return queryset
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return {
+            f"{i}__c": Count(pk_attname, filter=self._q([value]) if value is not None
+                             else Q((self.lookup_kwarg_isnull, True)))
+            for i, value in enumerate(self.lookup_choices)
+        }
+
+
+FieldListFilter.register(lambda f: isinstance(f, compact.LookupField), LookupFieldListFilter, take_priority=True)
+
+
+class LeanChangeList(ChangeList):
+    """
+    Fetch only `model_admin.list_only` columns (plus whatever list_annotations adds),
+    so wide TEXT/JSON columns never leave the database for the list page.
+    """
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        ma = self.model_admin
+        if getattr(ma, "list_only", None):
+            qs = qs.only(*ma.list_only)
+        if getattr(ma, "list_annotations", None):
+            qs = qs.annotate(**ma.list_annotations)
+        return qs
+
+
+class IndexedDatesQuerySet(QuerySet):
+    """
+    The admin date_hierarchy lists the years/months/days that have rows with
+    `qs.datetimes(field, "year"|"month"|"day")`, i.e. SELECT DISTINCT trunc(...) over
+    the whole range. With an index on the field it is far cheaper to probe each
+    candidate month/day with EXISTS (at most 12 or 31 index seeks), and to find the
+    years by skipping from one year's first row to the next's (a MIN seek per year
+    that has rows).
+    """
+
+    def aggregate(self, *args, **kwargs):
+        # date_hierarchy asks for aggregate(first=Min(f), last=Max(f)); SQLite only
+        # answers a lone MIN or MAX from the index, so split it into two index seeks.
+        if not args and len(kwargs) == 2 and {type(e) for e in kwargs.values()} == {Min, Max}:
+            fields = {e.source_expressions[0].name for e in kwargs.values()
+                      if not e.filter and hasattr(e.source_expressions[0], "name")}
+            if len(fields) == 1:
+                field = fields.pop()
+                values = self.order_by().values_list(field, flat=True)
+                return {
+                    alias: (values.order_by(field) if isinstance(e, Min) else values.order_by(f"-{field}")).first()
+                    for alias, e in kwargs.items()
+                }
+        return super().aggregate(*args, **kwargs)
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        if kind not in ("year", "month", "day") or not settings.USE_TZ:
+            return super().datetimes(field_name, kind, order, tzinfo)
+        tz = tzinfo or timezone.get_current_timezone()
+        buckets = self._years(field_name, tz) if kind == "year" else self._probe(field_name, kind, tz)
+        return buckets if order == "ASC" else buckets[::-1]
+
+    def _years(self, field_name, tz):
+        values = self.order_by(field_name).values_list(field_name, flat=True)
+        buckets, first = [], values.first()
+        while first is not None:
+            year = timezone.localtime(first, tz).year
+            buckets.append(timezone.make_aware(datetime(year, 1, 1), tz))
+            first = values.filter(**{f"{field_name}__gte": timezone.make_aware(datetime(year + 1, 1, 1), tz)}).first()
+        return buckets
+
+    def _probe(self, field_name, kind, tz):
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if not bounds["first"]:
+            return []
+        first, last = (timezone.localtime(bounds[k], tz) for k in ("first", "last"))
+
+        buckets = []
+        start = first.replace(day=1 if kind == "month" else first.day, hour=0, minute=0, second=0, microsecond=0)
+        while start <= last:
+            if kind == "day":
+                end = start + timedelta(days=1)
+            else:
+                end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+            # re-localize: bucket edges are wall-clock midnights, DST may shift the offset
+            end = timezone.make_aware(datetime(end.year, end.month, end.day), tz)
+            if self.filter(**{f"{field_name}__gte": start, f"{field_name}__lt": end}).exists():
+                buckets.append(start)
+            start = end
+        return buckets
@@ -0,0 +1,443 @@
+# whatsapp_chat/compact.py
+"""
+Compact storage for ChatMessage.
+
+- LookupField: short, highly repetitive strings (account SID, our WhatsApp number,
+  API version, model name, statuses) stored as a small-int id into the Lookup table.
+  It reads like a CharField and supports exact / in / isnull filters and values();
+  filters take ids, resolved up front with value_q() / lookup_id().
+- ChannelMetadata rows hold each distinct ChannelMetadata JSON once, keyed by its hash.
+- Optional zstd compression of long user/response texts on old rows
+  (CHATMESSAGE_COMPRESS_AFTER_DAYS). A message with a compressed text is archived:
+  its texts are read-only and stay in the full-text index (see search.py).
+
+The original wide columns stay in the table as "legacy" fields. New rows only
+fill the compact columns. `python manage.py compact_messages` moves old rows over
+in short batches while the app keeps serving. Reading a legacy attribute
+(cm.model_name, cm.channel_metadata, cm.user_text) returns the compact value when
+there is one, so existing readers keep working. Writers and filters use the
+*_ref fields; until CHATMESSAGE_BACKFILL_COMPLETE is set, value_q(), value_expr()
+and distinct_values() also match rows the backfill hasn't reached (ref NULL,
+value still in the legacy column).
+"""
+import hashlib
+import json
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.query_utils import DeferredAttribute
+
+COMPRESS_AFTER_DAYS = getattr(settings, "CHATMESSAGE_COMPRESS_AFTER_DAYS", None)  # None = never
+COMPRESS_MIN_BYTES = int(getattr(settings, "CHATMESSAGE_COMPRESS_MIN_BYTES", 512))
+ZSTD_LEVEL = int(getattr(settings, "CHATMESSAGE_ZSTD_LEVEL", 6))
+BACKFILL_COMPLETE = bool(getattr(settings, "CHATMESSAGE_BACKFILL_COMPLETE", False))
+
+MISSING_ID = -1  # filter value for strings that were never interned: matches no row
+_UNSET = object()
+
+
+# ---------- interning ----------
+class _InternTable:
+    """
+    key <-> (pk, value) cache in front of an intern table (Lookup, ChannelMetadata).
+    key -> pk entries are cached through transaction.on_commit: right away in autocommit,
+    at commit inside a transaction, never if it rolls back (the row may be gone).
+    """
+
+    def __init__(self, model_name, key_field, value_field, max_entries=None):
+        self.model_name, self.key_field, self.value_field = model_name, key_field, value_field
+        self.max_entries = max_entries
+        self._ids, self._values = {}, {}
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return apps.get_model("whatsapp_chat", self.model_name)
+
+    def _remember(self, ids, values=None):
+        with self._lock:
+            if self.max_entries and len(self._ids) + len(ids) > self.max_entries:
+                self._ids.clear()
+                self._values.clear()
+            self._ids.update(ids)
+            if values:
+                self._values.update(values)
+
+    def _remember_on_commit(self, using, ids):
+        transaction.on_commit(lambda: self._remember(ids), using=using)
+
+    def get(self, key, using=DEFAULT_DB_ALIAS):
+        """pk for `key`, or None. Never inserts."""
+        pk = self._ids.get(key)
+        if pk is None:
+            pk = (self.model.objects.using(using).filter(**{self.key_field: key})
+                  .values_list("pk", flat=True).first())
+            if pk is not None:
+                self._remember_on_commit(using, {key: pk})
+        return pk
+
+    def intern(self, key, value, using=DEFAULT_DB_ALIAS):
+        """pk for `key`, inserting (key, value) if needed."""
+        pk = self.get(key, using)
+        if pk is None:
+            obj, _ = self.model.objects.using(using).get_or_create(
+                **{self.key_field: key}, defaults={self.value_field: value})
+            pk = obj.pk
+            self._remember_on_commit(using, {key: pk})
+        return pk
+
+    def value(self, pk, using=DEFAULT_DB_ALIAS):
+        try:
+            return self._values[pk]
+        except KeyError:
+            pass
+        value = (self.model.objects.using(using).filter(pk=pk)
+                 .values_list(self.value_field, flat=True).first())
+        if value is not None:
+            # safe to cache right away: pks aren't reused, so a rolled back row's pk maps to nothing
+            self._remember({}, {pk: value})
+        return value
+
+
+lookups = _InternTable("Lookup", "value", "value")
+metadata = _InternTable("ChannelMetadata", "digest", "data", max_entries=10_000)
+
+
+def lookup_id(value, using=DEFAULT_DB_ALIAS):
+    """Id to filter a LookupField on; MISSING_ID (matches no row) if `value` was never stored."""
+    pk = lookups.get(str(value), using)
+    return MISSING_ID if pk is None else pk
+
+
+def _legacy_twin(model, name):
+    """The legacy field whose compact twin is the LookupField `name` (None if it has none)."""
+    field = model._meta.get_field(name)
+    if not isinstance(field, LookupField):
+        return None
+    return next((f for f in _legacy_fields(model) if f.compact == field.attname), None)
+
+
+def value_q(model, name, value, using=DEFAULT_DB_ALIAS):
+    """
+    Q(name=value), or name__in for a list/tuple/set. On a LookupField the strings are
+    resolved to ids here, before the filter is built, and until the backfill is
+    complete rows still holding the value in the legacy column match too.
+    """
+    many = isinstance(value, (list, tuple, set, frozenset))
+    lookup = f"{name}__in" if many else name
+    if not isinstance(model._meta.get_field(name), LookupField):
+        return models.Q(**{lookup: value})
+    q = models.Q(**{lookup: [lookup_id(v, using) for v in value] if many else lookup_id(value, using)})
+    legacy = _legacy_twin(model, name)
+    if legacy is not None and not BACKFILL_COMPLETE:
+        q |= models.Q(**{f"{name}__isnull": True, f"{legacy.name}__in" if many else legacy.name: value})
+    return q
+
+
+def value_expr(model, name):
+    """
+    Expression for values() / GROUP BY on `name`. Until the backfill is complete a
+    LookupField reads its Lookup value and falls back to the legacy column.
+    """
+    legacy = _legacy_twin(model, name)
+    if legacy is None or BACKFILL_COMPLETE:
+        return models.F(name)
+    interned = apps.get_model("whatsapp_chat", "Lookup").objects.filter(pk=models.OuterRef(name))
+    return Coalesce(models.Subquery(interned.values("value")[:1]), models.F(legacy.name),
+                    output_field=models.CharField())
+
+
+def distinct_values(qs, name, limit=100):
+    """Sorted distinct non-empty values of `name` in `qs` (list filter choices), legacy column included."""
+    values = set(qs.order_by().values_list(name, flat=True).distinct()[:limit])
+    legacy = _legacy_twin(qs.model, name)
+    if legacy is not None and not BACKFILL_COMPLETE:
+        values.update(qs.order_by().filter(**{f"{name}__isnull": True})
+                      .values_list(legacy.name, flat=True).distinct()[:limit])
+    return sorted(v for v in values if v)
+
+
+def lookup_choices(model, name, using=DEFAULT_DB_ALIAS, limit=100):
+    """
+    Sorted values of the LookupField `name` that some row holds (list filter choices):
+    the small Lookup table, each id kept by an EXISTS probe on `name`'s index, rather
+    than a DISTINCT over the whole column. A value only rows the backfill hasn't
+    reached hold shows up once compact_messages has interned it.
+    """
+    used = model._default_manager.using(using).filter(**{name: models.OuterRef("pk")})
+    values = (apps.get_model("whatsapp_chat", "Lookup").objects.using(using)
+              .filter(models.Exists(used)).order_by("value").values_list("value", flat=True)[:limit])
+    return [v for v in values if v]
+
+
+def metadata_digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def intern_metadata(data, using=DEFAULT_DB_ALIAS):
+    """ChannelMetadata pk for a JSON payload (None stays None)."""
+    if data is None:
+        return None
+    return metadata.intern(metadata_digest(data), data, using)
+
+
+# ---------- zstd ----------
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured("compressing message texts needs the 'zstandard' package")
+    return zstandard
+
+
+def zstd_available():
+    try:
+        _zstd()
+    except ImproperlyConfigured:
+        return False
+    return True
+
+
+def compress_text(text: str) -> bytes:
+    return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(text.encode("utf-8"))
+
+
+def decompress_text(blob) -> str:
+    return _zstd().ZstdDecompressor().decompress(bytes(blob)).decode("utf-8")
+
+
+# ---------- fields ----------
+class LookupField(models.Field):
+    """
+    A short, repetitive string stored as a small-int id into Lookup.
+    Only exact / in / isnull lookups make sense; ordering follows the id, not the text.
+    """
+    description = "Interned string (small-int id into Lookup)"
+
+    def get_internal_type(self):
+        return "SmallIntegerField"
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else lookups.value(value, connection.alias)
+
+    def to_python(self, value):
+        return value if value is None else str(value)
+
+    def get_prep_value(self, value):
+        # filters compare ids; resolving a string here would query the database while
+        # the filter is built, so query code does it up front (lookup_id / value_q)
+        value = super().get_prep_value(value)
+        if value is None or hasattr(value, "resolve_expression") or isinstance(value, int):
+            return value
+        raise TypeError(f"filter {self.name} on a lookup id: compact.value_q() or compact.lookup_id({value!r})")
+
+    def get_db_prep_save(self, value, connection):
+        if value is None or hasattr(value, "as_sql"):
+            return super().get_db_prep_save(value, connection)
+        return lookups.intern(str(value), str(value), connection.alias)
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in ("exact", "in", "isnull"):
+            return None
+        return super().get_lookup(lookup_name)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{"max_length": 128, **kwargs})
+
+
+class _CompactFirst(DeferredAttribute):
+    """
+    Legacy column attribute: the compact twin's value when it has one, else the column.
+    A data descriptor, so a loaded column can't shadow the twin. Assigning to it after
+    the instance is built (forms, cm.user_text = ...) makes the new value win.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = self.field.compact_value(instance)
+        return value if value is not None else super().__get__(instance, cls)
+
+    def __set__(self, instance, value):
+        data = instance.__dict__
+        if self.field.attname in data:  # not Model.__init__ / loading a deferred column
+            data[self.field.compact] = self.field.twin_for(instance, value)
+        data[self.field.attname] = value
+
+
+class _LegacyMixin:
+    """
+    Original wide column with a compact twin (`compact` = the twin's attname).
+    Deconstructs as the plain Django field, so swapping it in changes no schema;
+    on save the column is left empty whenever the twin holds the value.
+    """
+    descriptor_class = _CompactFirst
+    django_path = None
+
+    def __init__(self, *args, compact=None, **kwargs):
+        self.compact = compact
+        super().__init__(*args, **kwargs)
+
+    def _twin(self, instance):
+        raw = instance.__dict__.get(self.compact, _UNSET)
+        return getattr(instance, self.compact) if raw is _UNSET else raw  # deferred: load it
+
+    def compact_value(self, instance):
+        return self._twin(instance)
+
+    def twin_for(self, instance, value):
+        """Twin value after the legacy attribute is assigned `value` (None: keep it in the column)."""
+        return None
+
+    def pre_save(self, model_instance, add):
+        if self._twin(model_instance) is not None:
+            return None if self.null else ""
+        return super().pre_save(model_instance, add)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        # editable=False only hides the legacy column from forms; leaving it out keeps
+        # makemigrations from emitting an AlterField for every legacy field
+        kwargs.pop("editable", None)
+        return name, self.django_path, args, kwargs
+
+
+class LegacyCharField(_LegacyMixin, models.CharField):
+    django_path = "django.db.models.CharField"
+
+    def twin_for(self, instance, value):
+        return value or None
+
+
+class LegacyJSONField(_LegacyMixin, models.JSONField):
+    django_path = "django.db.models.JSONField"
+
+    def compact_value(self, instance):
+        pk = self._twin(instance)
+        return None if pk is None else metadata.value(pk, instance._state.db or DEFAULT_DB_ALIAS)
+
+
+class CompressibleTextField(_LegacyMixin, models.TextField):
+    """
+    Text column whose long, old values may live zstd-compressed in the `compact` BinaryField.
+    Once any text of a row is compressed the row is archived and its texts are read-only:
+    the full-text index keeps the words of a compressed text, but SQL can't decompress
+    it to take them out again.
+    """
+    django_path = "django.db.models.TextField"
+
+    def compact_value(self, instance):
+        blob = self._twin(instance)
+        return None if blob is None else decompress_text(blob)
+
+    def twin_for(self, instance, value):
+        blob = self._twin(instance)
+        current = instance.__dict__[self.attname] if blob is None else decompress_text(blob)
+        if value == current:
+            return blob  # e.g. a form posting the text back: stays as it is
+        if is_archived(instance):
+            raise ValueError(f"{instance._meta.label} {instance.pk} is archived (compressed): {self.name} is read-only")
+        return None
+
+
+def is_archived(instance):
+    """True when one of the instance's texts is stored compressed."""
+    return any(f._twin(instance) is not None
+               for f in instance._meta.concrete_fields if isinstance(f, CompressibleTextField))
+
+
+# ---------- online backfill ----------
+def _legacy_fields(model):
+    return [f for f in model._meta.concrete_fields if isinstance(f, _LegacyMixin)]
+
+
+def pending_q(model):
+    """Rows that still keep a value in a legacy lookup/metadata column."""
+    q = models.Q()
+    for f in _legacy_fields(model):
+        if isinstance(f, CompressibleTextField):
+            continue
+        if isinstance(f, LegacyJSONField):
+            q |= models.Q(**{f"{f.name}__isnull": False})
+        else:
+            q |= models.Q(**{f"{f.name}__gt": ""})
+    return q
+
+
+def compact_batch(model, below_pk, batch_size=1000, compress_before=None, using=DEFAULT_DB_ALIAS):
+    """
+    Move up to `batch_size` rows with pk < below_pk (newest first) to the compact columns,
+    in one short transaction. Returns (rows_scanned, rows_changed, lowest_pk_seen).
+    compress_before: also zstd long texts of rows created before this datetime.
+    """
+    fields = _legacy_fields(model)
+    lookup_fields = [f for f in fields if isinstance(f, LegacyCharField)]
+    json_fields = [f for f in fields if isinstance(f, LegacyJSONField)]
+    text_fields = [f for f in fields if isinstance(f, CompressibleTextField)] if compress_before else []
+
+    qs = model.objects.using(using).filter(pk__lt=below_pk).order_by("-pk")
+    if not text_fields:
+        qs = qs.defer(*(f.name for f in fields if isinstance(f, CompressibleTextField)))
+
+    with transaction.atomic(using=using):
+        rows = list(qs.select_for_update()[:batch_size])
+        if not rows:
+            return 0, 0, None
+        by_value = {}                              # (twin, value) -> [pk]: one UPDATE per distinct value
+        digests = {}                               # metadata digest -> pk, created in this transaction too
+        bulk_rows, blanked = [], []                # rows with new metadata/text twins / legacy columns to empty
+        texts = {f.name: [] for f in text_fields}  # text field -> [pk] compressed
+        for row in rows:
+            d, moved, packed = row.__dict__, False, False
+            for f in lookup_fields:
+                if d.get(f.attname):
+                    if d.get(f.compact) is None:
+                        by_value.setdefault((f.compact, d[f.attname]), []).append(row.pk)
+                    moved = True
+            for f in json_fields:
+                if d.get(f.attname) is not None:
+                    if d.get(f.compact) is None:
+                        digest = metadata_digest(d[f.attname])
+                        if digest not in digests:
+                            digests[digest] = metadata.intern(digest, d[f.attname], using)
+                        d[f.compact] = digests[digest]
+                        packed = True
+                    moved = True
+            for f in text_fields:
+                text = d.get(f.attname)
+                if text and row.created_at < compress_before and len(text.encode("utf-8")) >= COMPRESS_MIN_BYTES:
+                    d[f.compact] = compress_text(text)
+                    texts[f.name].append(row.pk)
+                    packed = True
+            if moved:
+                blanked.append(row.pk)
+            if packed:
+                bulk_rows.append(row)
+
+        base = model.objects.using(using)
+        for (twin, value), pks in by_value.items():
+            base.filter(pk__in=pks).update(**{twin: value})
+        if bulk_rows:
+            # one prepared UPDATE run per row; bulk_update's CASE WHEN is slower to build than to run
+            connection = connections[using]
+            qn = connection.ops.quote_name
+            twins = [model._meta.get_field(f.compact) for f in json_fields + text_fields]
+            sql = (f"UPDATE {qn(model._meta.db_table)} SET {', '.join(f'{qn(t.column)} = %s' for t in twins)} "
+                   f"WHERE {qn(model._meta.pk.column)} = %s")
+            with connection.cursor() as cur:
+                cur.executemany(sql, [[t.get_db_prep_save(row.__dict__[t.attname], connection) for t in twins]
+                                      + [row.pk] for row in bulk_rows])
+        if blanked:
+            base.filter(pk__in=blanked).update(
+                **{f.name: (None if f.null else "") for f in lookup_fields},
+                **{f.name: None for f in json_fields})
+        for name, pks in texts.items():
+            if pks:
+                base.filter(pk__in=pks).update(**{name: None})
+
+    changed = len(set(blanked).union(*texts.values()))
+    return len(rows), changed, rows[-1].pk
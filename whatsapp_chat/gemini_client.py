@@ -1,9 +1,8 @@
+import threading
 import time
 from django.conf import settings
-import google.generativeai as genai
 
-# Configure once from settings
-genai.configure(api_key=getattr(settings, "GEMINI_API_KEY", None))
+from .usage import cost_usd, trim_to_budget
 
 MODEL_NAME = getattr(settings, "GEMINI_MODEL", "gemini-1.5-flash")
 TEMPERATURE = float(getattr(settings, "GEMINI_TEMPERATURE", 0.2))
@@ -14,20 +13,54 @@ You are a Atom.Ai(a WhatsApp assistant). Reply with a SHORT, precise answer.
 Prefer bullet points when listing. Avoid long preambles.
 """
 
-def ask_gemini(user_text: str):
-    text_in = (user_text or "").strip() or "Hello"
-    model = genai.GenerativeModel(MODEL_NAME, system_instruction=SYSTEM_INSTRUCTIONS)
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """Import + configure google.generativeai once, on first use."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=getattr(settings, "GEMINI_API_KEY", None))
+                _genai = genai
+    return _genai
+
+
+def ask_gemini(user_text: str, model=None, temperature=None, max_tokens=None, system=None):
+    """
+    Returns (reply_text, latency_ms, usage), same shape as ask_openai.
+    The keyword arguments override the settings (used by `replay_messages`).
+    """
+    model_name = model or MODEL_NAME
+    text_in = trim_to_budget((user_text or "").strip() or "Hello")
+    from .knowledge import with_knowledge  # numpy stays out of startup (see bench_startup)
+    system = with_knowledge((system or SYSTEM_INSTRUCTIONS).strip(), text_in)
+    model = get_genai().GenerativeModel(model_name, system_instruction=system)
 
     start = time.monotonic()
     resp = model.generate_content(
         text_in,
         generation_config={
-            "temperature": TEMPERATURE,
+            "temperature": TEMPERATURE if temperature is None else temperature,
             "top_p": 0.9,
             "top_k": 32,
-            "max_output_tokens": MAX_TOKENS,
+            "max_output_tokens": max_tokens or MAX_TOKENS,
         },
     )
     latency_ms = int((time.monotonic() - start) * 1000)
     out = (resp.text or "Sorry, I couldn't generate a response.").strip()
-    return out, latency_ms
+
+    meta = getattr(resp, "usage_metadata", None)
+    prompt_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    completion_tokens = getattr(meta, "candidates_token_count", 0) or 0
+    finish = resp.candidates[0].finish_reason if resp.candidates else None
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "finish_reason": getattr(finish, "name", None) or (str(finish) if finish is not None else None),
+        "cost_usd": cost_usd(model_name, prompt_tokens, completion_tokens),
+    }
+    return out, latency_ms, usage
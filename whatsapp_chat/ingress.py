@@ -0,0 +1,122 @@
+# whatsapp_chat/ingress.py
+"""
+Lean ingress for Twilio callbacks (/webhook, /status).
+
+Twilio posts small form-encoded bodies and ignores most of what we answer, so
+these requests skip everything the rest of the site needs:
+- parse_form(): the body is split by hand instead of going through QueryDict
+  or DRF's parser/negotiation/authentication stack.
+- StaticResponse: fixed TwiML/"OK" bodies encoded once at import.
+- LeanWSGIHandler / LeanASGIHandler: Django handlers with no middleware
+  (no sessions, auth, messages or CSRF). core/wsgi.py and core/asgi.py route the
+  Twilio paths to them via wsgi_app() / asgi_app() and everything else to the
+  normal handler (runserver uses core/wsgi.py too). Anything that builds its own
+  handler, like the test client, runs the same views through the full stack.
+Set TWILIO_LEAN_INGRESS = False to route everything through the normal handler.
+"""
+import json
+from urllib.parse import unquote_plus
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import HttpResponse
+from django.urls import reverse
+
+from .ratelimit import SHED_REPLY
+
+ENABLED = getattr(settings, "TWILIO_LEAN_INGRESS", True)
+ROUTES = ("whatsapp-webhook", "twilio-status")  # URL names served by the lean handlers
+
+
+def parse_form(raw: str) -> dict:
+    """application/x-www-form-urlencoded -> flat dict (a repeated key keeps its last value, like QueryDict.get)."""
+    data = {}
+    for pair in raw.split("&"):
+        if pair:
+            key, _, value = pair.partition("=")
+            data[unquote_plus(key)] = unquote_plus(value)
+    return data
+
+
+def form_data(request) -> dict:
+    """Twilio's fields from the query string (GET) or the body; JSON bodies are accepted for manual testing."""
+    if request.method == "GET":
+        return parse_form(request.META.get("QUERY_STRING", ""))
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            raise BadRequest("malformed JSON body")  # 400, not a 500
+        return data if isinstance(data, dict) else {}
+    return parse_form(request.body.decode(request.encoding or "utf-8", "replace"))
+
+
+class StaticResponse:
+    """
+    A fixed body, content type and Content-Length (CommonMiddleware isn't there to add
+    it), encoded once; each call builds a fresh HttpResponse around them.
+    """
+
+    def __init__(self, body, content_type):
+        self.body, self.content_type = body.encode("utf-8"), content_type
+        self.length = str(len(self.body))
+
+    def __call__(self):
+        resp = HttpResponse(self.body, content_type=self.content_type)
+        resp.headers["Content-Length"] = self.length
+        return resp
+
+
+EMPTY_TWIML = StaticResponse("<Response/>", "application/xml")
+SHED_TWIML = StaticResponse(f"<Response><Message>{escape(SHED_REPLY)}</Message></Response>", "application/xml")
+OK = StaticResponse("OK", "text/plain")
+
+
+class _NoMiddleware:
+    def load_middleware(self, is_async=False):
+        """BaseHandler.load_middleware() with an empty MIDDLEWARE."""
+        self._view_middleware, self._template_response_middleware, self._exception_middleware = [], [], []
+        self._middleware_chain = convert_exception_to_response(
+            self._get_response_async if is_async else self._get_response)
+
+
+class LeanWSGIHandler(_NoMiddleware, WSGIHandler):
+    pass
+
+
+class LeanASGIHandler(_NoMiddleware, ASGIHandler):
+    pass
+
+
+def paths():
+    """PATH_INFO values (without SCRIPT_NAME) that go to the lean handlers, matched exactly."""
+    return frozenset(reverse(name) for name in ROUTES)
+
+
+def wsgi_app(application):
+    """WSGI callable: Twilio callbacks -> LeanWSGIHandler, everything else -> `application`."""
+    if not ENABLED:
+        return application
+    lean, lean_paths = LeanWSGIHandler(), paths()
+
+    def dispatch(environ, start_response):
+        target = lean if environ.get("PATH_INFO", "") in lean_paths else application
+        return target(environ, start_response)
+    return dispatch
+
+
+def asgi_app(application):
+    """ASGI counterpart of wsgi_app()."""
+    if not ENABLED:
+        return application
+    lean, lean_paths = LeanASGIHandler(), paths()
+
+    async def dispatch(scope, receive, send):
+        path = scope.get("path", "").removeprefix(scope.get("root_path", ""))
+        target = lean if scope["type"] == "http" and path in lean_paths else application
+        return await target(scope, receive, send)
+    return dispatch
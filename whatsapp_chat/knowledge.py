@@ -0,0 +1,435 @@
+# whatsapp_chat/knowledge.py
+"""
+Local knowledge base for retrieval-augmented replies.
+
+Documents (txt/md/html/pdf, e.g. the reports under MEDIA_ROOT/reports) are chunked,
+embedded and stored in KNOWLEDGE_DIR:
+
+    vectors.f32    float32 matrix (rows x dim), memory-mapped read-only for queries
+    chunks.jsonl   {"doc", "text"} per row, addressed through chunks.off (int64 offsets)
+    manifest.json  dim, embedder, row count, per-document row range + signature, dead rows,
+                   generation
+
+Re-ingesting only re-embeds documents whose size/mtime changed; their old rows are
+tombstoned and the files are compacted once too many rows are dead. Replacing the
+manifest is the commit point of both: rows appended after the manifest's row count
+belong to an interrupted ingest and are cut off by the next one, and a compaction
+writes a new generation (gen-N/, generation 0 lives in KNOWLEDGE_DIR itself) that
+only takes effect once the manifest names it.
+
+    python manage.py kb_ingest docs/ --reports
+    context_for("what are your delivery charges?")  -> text for the system prompt
+"""
+import html
+import json
+import os
+import re
+import shutil
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .usage import estimate_tokens
+
+KNOWLEDGE_DIR = Path(getattr(settings, "KNOWLEDGE_DIR", settings.BASE_DIR / "knowledge_index"))
+EMBEDDER = getattr(settings, "KNOWLEDGE_EMBEDDER", "whatsapp_chat.knowledge.HashingEmbedder")
+ENABLED = bool(getattr(settings, "KNOWLEDGE_ENABLED", True))
+TOP_K = int(getattr(settings, "KNOWLEDGE_TOP_K", 3))
+MIN_SCORE = float(getattr(settings, "KNOWLEDGE_MIN_SCORE", 0.2))
+MAX_CONTEXT_TOKENS = int(getattr(settings, "KNOWLEDGE_MAX_CONTEXT_TOKENS", 600))
+CHUNK_WORDS = int(getattr(settings, "KNOWLEDGE_CHUNK_WORDS", 120))
+CHUNK_OVERLAP = int(getattr(settings, "KNOWLEDGE_CHUNK_OVERLAP", 20))
+COMPACT_DEAD_RATIO = 0.3
+
+SUPPORTED_SUFFIXES = {".txt", ".md", ".html", ".htm", ".pdf"}
+DATA_FILES = ("vectors.f32", "chunks.jsonl", "chunks.off")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+# ---------- embedders ----------
+class HashingEmbedder:
+    """
+    Deterministic, dependency-free embedder (feature hashing of unigrams + bigrams).
+    Good enough for keyword-ish retrieval and for tests; swap in OpenAIEmbedder for
+    semantic matching via settings.KNOWLEDGE_EMBEDDER.
+    """
+    name = "hashing-v1"
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            feats = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feat in feats:
+                h = zlib.crc32(feat.encode("utf-8"))  # stable across processes, unlike hash()
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+class OpenAIEmbedder:
+    name = "openai"
+
+    def __init__(self, model=None, dim=1536):
+        self.model = model or getattr(settings, "OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+        self.dim = dim
+        self.name = f"openai:{self.model}"
+
+    def embed(self, texts):
+        from .openai_client import get_client
+        resp = get_client().embeddings.create(model=self.model, input=list(texts))
+        out = np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = import_string(EMBEDDER)()
+    return _embedder
+
+
+# ---------- documents ----------
+def read_document(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        from pypdf import PdfReader  # optional dependency, only needed for PDFs
+        return "\n".join(page.extract_text() or "" for page in PdfReader(str(path)).pages)
+    text = path.read_text(encoding="utf-8", errors="ignore")
+    if suffix in (".html", ".htm"):
+        text = html.unescape(_TAG_RE.sub(" ", text))
+    return text
+
+
+def chunk_text(text: str, words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    return [" ".join(tokens[i:i + words]) for i in range(0, max(1, len(tokens) - overlap), step)]
+
+
+def iter_documents(paths):
+    for p in map(Path, paths):
+        if p.is_dir():
+            yield from (f for f in sorted(p.rglob("*")) if f.suffix.lower() in SUPPORTED_SUFFIXES)
+        elif p.suffix.lower() in SUPPORTED_SUFFIXES and p.exists():
+            yield p
+
+
+def _signature(path: Path):
+    st = path.stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+# ---------- index ----------
+class _Snapshot:
+    """
+    Read-only view of one manifest version. Holds its own memmap and file handle,
+    so a compaction (which retires the files) doesn't disturb in-flight queries.
+    """
+
+    def __init__(self, directory, manifest):
+        self.rows, dim = manifest["rows"], manifest["dim"]
+        if self.rows:
+            self.vectors = np.memmap(directory / "vectors.f32", dtype=np.float32, mode="r", shape=(self.rows, dim))
+            self.offsets = np.fromfile(directory / "chunks.off", dtype=np.int64, count=self.rows)
+            self._chunks = open(directory / "chunks.jsonl", "rb")
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        alive = np.ones(self.rows, dtype=bool)
+        for start, end in manifest["dead"]:
+            alive[start:end] = False
+        self.alive = None if alive.all() else alive
+        self._lock = threading.Lock()
+
+    def chunk(self, row):
+        with self._lock:
+            self._chunks.seek(int(self.offsets[row]))
+            return json.loads(self._chunks.readline())
+
+    def __del__(self):
+        if self.rows:
+            self._chunks.close()
+
+
+class KnowledgeIndex:
+    def __init__(self, directory=KNOWLEDGE_DIR, embedder=None):
+        self.dir = Path(directory)
+        self.embedder = embedder or get_embedder()
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._snapshot = None
+        self.manifest = self._empty_manifest()
+
+    # files
+    def _data_dir(self, generation=None):
+        """Where a generation's files live (default: the current manifest's)."""
+        if generation is None:
+            generation = self.manifest.get("generation", 0)
+        return self.dir / f"gen-{generation}" if generation else self.dir
+
+    @property
+    def vectors_path(self):
+        return self._data_dir() / "vectors.f32"
+
+    @property
+    def chunks_path(self):
+        return self._data_dir() / "chunks.jsonl"
+
+    @property
+    def offsets_path(self):
+        return self._data_dir() / "chunks.off"
+
+    @property
+    def manifest_path(self):
+        return self.dir / "manifest.json"
+
+    def _empty_manifest(self):
+        return {"version": 1, "dim": self.embedder.dim, "embedder": self.embedder.name,
+                "rows": 0, "docs": {}, "dead": [], "generation": 0}
+
+    def _read_manifest(self):
+        if not self.manifest_path.exists():
+            return self._empty_manifest()
+        manifest = json.loads(self.manifest_path.read_text())
+        if manifest["dim"] != self.embedder.dim or manifest["embedder"] != self.embedder.name:
+            raise ValueError(
+                f"index at {self.dir} was built with {manifest['embedder']} ({manifest['dim']}d); "
+                f"rebuild it with kb_ingest --rebuild")
+        return manifest
+
+    def _write_manifest(self):
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest))
+        os.replace(tmp, self.manifest_path)
+
+    # reading
+    def refresh(self):
+        """(Re)map the files if the manifest changed since the last call. Cheap: one stat()."""
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._loaded_mtime:
+            return True
+        with self._lock:
+            for attempt in range(2):
+                self.manifest = self._read_manifest()
+                try:
+                    self._snapshot = _Snapshot(self._data_dir(), self.manifest)
+                    break
+                except FileNotFoundError:
+                    if attempt:  # else a compaction retired them after we read the manifest
+                        raise
+            self._loaded_mtime = mtime
+        return True
+
+    def search(self, query: str, k=TOP_K):
+        """-> [(score, {"doc", "text"}), ...] best first. Cosine similarity (unit vectors)."""
+        if not self.refresh():
+            return []
+        snap = self._snapshot  # consistent view even if another thread refreshes meanwhile
+        if not snap.rows:
+            return []
+        q = self.embedder.embed([query])[0]
+        scores = snap.vectors @ q
+        if snap.alive is not None:
+            scores = np.where(snap.alive, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), snap.chunk(i)) for i in top if np.isfinite(scores[i])]
+
+    # writing (single writer: the kb_ingest command)
+    def _truncate(self):
+        """Cut the files back to the manifest's rows, dropping what an interrupted ingest left."""
+        rows = self.manifest["rows"]
+        chunk_bytes = 0
+        if rows:
+            last = int(np.fromfile(self.offsets_path, dtype=np.int64, count=rows)[-1])
+            with open(self.chunks_path, "rb") as f:
+                f.seek(last)
+                chunk_bytes = last + len(f.readline())
+        sizes = (rows * self.manifest["dim"] * 4, chunk_bytes, rows * 8)
+        for path, size in zip((self.vectors_path, self.chunks_path, self.offsets_path), sizes):
+            with open(path, "ab") as f:
+                if f.tell() > size:
+                    f.truncate(size)
+
+    def _append(self, doc, chunks, vectors):
+        start = self.manifest["rows"]
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        offsets = np.empty(len(chunks), dtype=np.int64)
+        with open(self.chunks_path, "ab") as f:
+            for i, text in enumerate(chunks):
+                offsets[i] = f.tell()
+                f.write(json.dumps({"doc": doc, "text": text}, ensure_ascii=False).encode("utf-8") + b"\n")
+        with open(self.offsets_path, "ab") as f:
+            offsets.tofile(f)
+        with open(self.vectors_path, "ab") as f:
+            vectors.tofile(f)
+        self.manifest["rows"] = start + len(chunks)
+        return start, start + len(chunks)
+
+    def append_vectors(self, doc, chunks, vectors):
+        """Low-level append of pre-computed vectors (benchmarks, custom pipelines)."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self._truncate()
+        start, end = self._append(doc, chunks, vectors)
+        self.manifest["docs"][doc] = {"sig": "", "start": start, "end": end}
+        self._write_manifest()
+
+    def ingest(self, paths, prune=False, batch_size=256):
+        """
+        Incrementally index `paths` (files or directories).
+        prune=True also drops documents that are no longer found under `paths`.
+        Returns {"added", "updated", "unchanged", "removed", "chunks"}.
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = self._read_manifest()
+        self._truncate()
+        docs = self.manifest["docs"]
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "chunks": 0}
+        seen = set()
+
+        for path in iter_documents(paths):
+            key = str(path.resolve())
+            seen.add(key)
+            sig = _signature(path)
+            old = docs.get(key)
+            if old and old["sig"] == sig:
+                stats["unchanged"] += 1
+                continue
+
+            chunks = chunk_text(read_document(path))
+            if old:
+                self.manifest["dead"].append([old["start"], old["end"]])
+            vectors = np.concatenate(
+                [self.embedder.embed(chunks[i:i + batch_size]) for i in range(0, len(chunks), batch_size)]
+            ) if chunks else np.zeros((0, self.embedder.dim), dtype=np.float32)
+            start, end = self._append(key, chunks, vectors)
+            docs[key] = {"sig": sig, "start": start, "end": end}
+            stats["updated" if old else "added"] += 1
+            stats["chunks"] += len(chunks)
+
+        if prune:
+            for key in [k for k in docs if k not in seen]:
+                old = docs.pop(key)
+                self.manifest["dead"].append([old["start"], old["end"]])
+                stats["removed"] += 1
+
+        self._write_manifest()
+        if self.dead_rows() > COMPACT_DEAD_RATIO * max(1, self.manifest["rows"]):
+            self.compact()
+        return stats
+
+    def dead_rows(self):
+        return sum(end - start for start, end in self.manifest["dead"])
+
+    def compact(self):
+        """
+        Rewrite the live rows into the next generation's directory, then switch to it by
+        replacing the manifest. Until then the current generation stays untouched, so a
+        crash mid-way leaves the index as it was.
+        """
+        rows, dim = self.manifest["rows"], self.manifest["dim"]
+        vectors = np.fromfile(self.vectors_path, dtype=np.float32, count=rows * dim).reshape(rows, dim)
+        offsets = np.fromfile(self.offsets_path, dtype=np.int64, count=rows)
+
+        old_dir, generation = self._data_dir(), self.manifest.get("generation", 0) + 1
+        new_dir = self._data_dir(generation)
+        shutil.rmtree(new_dir, ignore_errors=True)  # left behind by a compaction that died
+        new_dir.mkdir()
+        new_vec, new_chunks, new_off = (new_dir / name for name in DATA_FILES)
+        new_docs, cursor = {}, 0
+        with open(self.chunks_path, "rb") as src, open(new_chunks, "wb") as dst_chunks, \
+                open(new_vec, "wb") as dst_vec, open(new_off, "wb") as dst_off:
+            for key, meta in sorted(self.manifest["docs"].items(), key=lambda kv: kv[1]["start"]):
+                n = meta["end"] - meta["start"]
+                new_offsets = np.empty(n, dtype=np.int64)
+                for i, row in enumerate(range(meta["start"], meta["end"])):
+                    src.seek(int(offsets[row]))
+                    new_offsets[i] = dst_chunks.tell()
+                    dst_chunks.write(src.readline())
+                vectors[meta["start"]:meta["end"]].tofile(dst_vec)
+                new_offsets.tofile(dst_off)
+                new_docs[key] = {**meta, "start": cursor, "end": cursor + n}
+                cursor += n
+            for f in (dst_chunks, dst_vec, dst_off):
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.manifest.update(generation=generation, rows=cursor, docs=new_docs, dead=[])
+        self._write_manifest()
+        self._remove_files(old_dir)
+
+    def _remove_files(self, directory):
+        if directory == self.dir:
+            for name in DATA_FILES:
+                (directory / name).unlink(missing_ok=True)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def rebuild(self, paths):
+        self.manifest_path.unlink(missing_ok=True)
+        for directory in [self.dir, *self.dir.glob("gen-*")]:
+            self._remove_files(directory)
+        self.manifest = self._empty_manifest()
+        self._loaded_mtime = None
+        return self.ingest(paths)
+
+
+_index = None
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = KnowledgeIndex()
+    return _index
+
+
+def context_for(user_text: str, k=TOP_K) -> str:
+    """
+    Top matching chunks for the prompt, or "" (disabled, no index, nothing relevant).
+    Capped at MAX_CONTEXT_TOKENS so retrieval never blows up the prompt.
+    """
+    if not ENABLED or not user_text:
+        return ""
+    try:
+        hits = get_index().search(user_text, k)
+    except (OSError, ValueError):
+        return ""  # missing / incompatible index must never break a reply
+    parts, budget = [], MAX_CONTEXT_TOKENS
+    for score, chunk in hits:
+        if score < MIN_SCORE:
+            break
+        cost = estimate_tokens(chunk["text"])
+        if cost > budget:
+            break
+        parts.append(f"- {chunk['text']}")
+        budget -= cost
+    return "\n".join(parts)
+
+
+def with_knowledge(system: str, user_text: str) -> str:
+    """System prompt plus the best-matching chunks (unchanged when nothing matches)."""
+    ctx = context_for(user_text)
+    if not ctx:
+        return system
+    return f"{system}\n\nAnswer using this business information when relevant:\n{ctx}"
@@ -0,0 +1,92 @@
+# whatsapp_chat/management/commands/_seed.py
+"""Shared helpers for the bench_* commands (underscore: not a command itself)."""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from whatsapp_chat.compact import intern_metadata
+from whatsapp_chat.models import ChatMessage
+
+WORDS = (
+    "order refund delivery invoice price discount shipping payment account password "
+    "report weekly monthly sales customer product stock return exchange support hello "
+    "thanks status tracking address update cancel subscription plan upgrade offer coupon"
+).split()
+
+
+# long tail of rarer tokens so term frequencies look like real chat traffic
+RARE_WORDS = [f"{w}{i}" for i in range(200) for w in ("sku", "ticket", "city")]
+
+
+def random_text(rng, n_words):
+    return " ".join(
+        rng.choice(WORDS) if rng.random() < 0.7 else rng.choice(RARE_WORDS)
+        for _ in range(n_words)
+    )
+
+
+def seed_messages(n, seed=0, batch_size=5000, legacy=False, days=0):
+    """
+    bulk_create `n` synthetic ChatMessage rows (deterministic for a given seed).
+    legacy=True fills the original wide columns instead of the compact ones (see compact.py).
+    days > 0 spreads created_at over that many days up to now, oldest rows first.
+    """
+    rng = random.Random(seed)
+    after = ChatMessage.objects.aggregate(m=Max("pk"))["m"] or 0
+    statuses = ["queued", "sent", "delivered", "read", "failed"]
+    suffix = "" if legacy else "_ref"
+    rows = []
+    for i in range(n):
+        phone = f"whatsapp:+9198{rng.randrange(10**8):08d}"
+        channel_metadata = {"type": "whatsapp", "data": {"context": {
+            "ProfileName": "Bench User", "WaId": phone[-12:] if rng.random() < 0.1 else "919800000000"}}}
+        fields = {
+            "account_sid": "AC" + "0" * 32,
+            "sms_status": "received",
+            "message_type": "text",
+            "api_version": "2010-04-01",
+            "to_phone": "whatsapp:+14155238886",
+            "model_name": "gpt-4o-mini",
+            "finish_reason": "stop",
+            "delivery_status": rng.choice(statuses),
+        }
+        rows.append(ChatMessage(
+            message_sid=f"SM{seed:04d}{i:028d}",
+            wa_id=phone[-12:],
+            profile_name="Bench User",
+            from_phone=phone,
+            user_text=random_text(rng, rng.randint(3, 15)),
+            response_text=random_text(rng, rng.randint(20, 80)),
+            latency_ms=rng.randint(300, 4000),
+            **{f"{k}{suffix}": v for k, v in fields.items()},
+            **({"channel_metadata": channel_metadata} if legacy
+               else {"channel_metadata_ref_id": intern_metadata(channel_metadata)}),
+        ))
+        if len(rows) >= batch_size:
+            ChatMessage.objects.bulk_create(rows)
+            rows = []
+    if rows:
+        ChatMessage.objects.bulk_create(rows)
+    if days > 0:
+        _spread_dates(after, n, days)
+
+
+def _spread_dates(after, n, days):
+    """created_at is auto_now_add, so it can only be moved after the insert: one UPDATE per day."""
+    now, per_day = timezone.now(), -(-n // days)
+    for day in range(days):
+        first = after + day * per_day
+        ChatMessage.objects.filter(pk__gt=first, pk__lte=first + per_day).update(
+            created_at=now - timedelta(days=days - day, hours=12))
+
+
+@contextmanager
+def rolled_back():
+    """Run a benchmark inside a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
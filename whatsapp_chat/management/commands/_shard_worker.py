@@ -0,0 +1,34 @@
+# whatsapp_chat/management/commands/_shard_worker.py
+"""
+Entry point of one bench_shards worker process. Started with the "spawn" method
+(a fresh interpreter, like a worker on another node), so Django is set up here
+rather than imported at module level.
+"""
+import functools
+import os
+
+
+def run(db, name, opts, stop, results):
+    """Point the default database at `db` (the bench's scratch database), then run a shards.Worker."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    import django
+    from django.conf import settings
+
+    settings.DATABASES["default"].update(db)
+    django.setup()
+
+    from whatsapp_chat import outbox, replay, shards, twilio_client, views
+    from .bench_outbox import FlakyTwilio
+
+    # the real pipeline (ChatMessage + outbox + send) with local LLM/Twilio stand-ins
+    views.ask_openai = functools.partial(replay.fake_llm, latency_ms=opts["llm_latency_ms"])
+    twilio = FlakyTwilio(opts["twilio_failure_rate"], 0, opts["twilio_latency_ms"], seed=os.getpid())
+    twilio_client.get_client = lambda: twilio
+    # failed sends are retried by the bench's dispatcher; a killed worker's unsent reply (and the
+    # ones behind it) only waits out the short bench lease
+    outbox.BACKOFF_BASE, outbox.LEASE_SECONDS = opts["outbox_backoff"], opts["lease"]
+
+    worker = shards.Worker(name, opts["concurrency"], heartbeat_seconds=opts["heartbeat"],
+                           member_ttl=opts["member_ttl"], lease_seconds=opts["lease"])
+    worker.run(stop)
+    results.put((name, dict(worker.stats)))
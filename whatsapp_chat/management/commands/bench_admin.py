@@ -0,0 +1,84 @@
+# whatsapp_chat/management/commands/bench_admin.py
+"""
+python manage.py bench_admin --rows 200000 --days 1000
+
+Seeds messages spread over --days days (inside a rolled-back transaction) and times
+a full render of the ChatMessage admin changelist: the large-table ChatMessageAdmin
+vs a plain ModelAdmin with the old settings (exact counts, facets, full rows, and
+SELECT DISTINCT for the date_hierarchy years/months/days).
+"""
+import statistics
+import time
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from whatsapp_chat.admin import ChatMessageAdmin
+from whatsapp_chat.models import ChatMessage
+
+from ._seed import rolled_back, seed_messages
+
+
+class LegacyChatMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        "user_text", "created_at", "from_phone", "to_phone_ref",
+        "message_sid", "outbound_message_sid", "delivery_status_ref", "latency_ms",
+    )
+    search_fields = ("from_phone", "message_sid", "outbound_message_sid")
+    list_filter = ("delivery_status_ref", "sms_status_ref", "model_name_ref", "created_at")
+    date_hierarchy = "created_at"
+    show_facets = admin.ShowFacets.ALWAYS
+
+
+class Command(BaseCommand):
+    help = "Benchmark ChatMessage admin changelist render time on a seeded large table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--days", type=int, default=1000, help="spread created_at over this many days")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def _render_ms(self, model_admin, request, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model_admin.changelist_view(request).render()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def handle(self, *args, **opts):
+        factory = RequestFactory()
+        url = reverse("admin:whatsapp_chat_chatmessage_changelist")
+        site = admin.AdminSite(name="bench")
+        variants = {
+            "legacy": LegacyChatMessageAdmin(ChatMessage, site),
+            "large-table": ChatMessageAdmin(ChatMessage, site),
+        }
+        today = timezone.localdate()
+        queries = {
+            "first page": {},  # date_hierarchy lists the years
+            "filtered": {"delivery_status_ref": "failed"},
+            "page 50": {"p": "50"},
+            "year": {"created_at__year": str(today.year)},  # ... its months
+            "month": {"created_at__year": str(today.year), "created_at__month": str(today.month)},  # ... days
+        }
+
+        with rolled_back():
+            seed_messages(opts["rows"], days=opts["days"])
+            user = get_user_model().objects.create_superuser("bench-admin", "bench@example.com", "x")
+            cache.clear()
+
+            self.stdout.write(f"{opts['rows']} rows, median of {opts['repeat']} renders")
+            self.stdout.write(f"{'query':<12} {'legacy ms':>10} {'large-table ms':>15}")
+            for label, params in queries.items():
+                row = []
+                for model_admin in variants.values():
+                    request = factory.get(url, params)
+                    request.user = user
+                    row.append(self._render_ms(model_admin, request, opts["repeat"]))
+                self.stdout.write(f"{label:<12} {row[0]:>10.1f} {row[1]:>15.1f}")
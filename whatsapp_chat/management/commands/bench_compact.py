@@ -0,0 +1,122 @@
+# whatsapp_chat/management/commands/bench_compact.py
+"""
+python manage.py bench_compact --rows 100000
+
+Seeds rows in the old wide layout (inside a rolled-back transaction), runs the
+compact_messages backfill over them and compares the two layouts: on-disk bytes
+per row and full-scan / GROUP BY model times. Each layout is copied into a
+scratch table first (CREATE TABLE AS), so the sizes are those of freshly written
+pages, as after the contract step.
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from whatsapp_chat import compact
+from whatsapp_chat.models import ChannelMetadata, ChatMessage, Lookup
+
+from ._seed import rolled_back, seed_messages
+
+LEGACY_TABLE, COMPACT_TABLE = "bench_chatmessage_legacy", "bench_chatmessage_compact"
+
+
+def _columns(compact_layout):
+    """ChatMessage columns of one layout: without the compact twins, or without the legacy columns."""
+    fields = compact._legacy_fields(ChatMessage)
+    if compact_layout:
+        drop = {f.attname for f in fields if not isinstance(f, compact.CompressibleTextField)}
+    else:
+        drop = {ChatMessage._meta.get_field(f.compact).attname for f in fields}
+    return [f.column for f in ChatMessage._meta.concrete_fields if f.attname not in drop]
+
+
+def _table_bytes(table):
+    with connection.cursor() as cur:
+        if connection.vendor == "sqlite":
+            try:
+                cur.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [table])
+            except Exception:  # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+                return None
+        elif connection.vendor == "postgresql":
+            cur.execute("SELECT pg_total_relation_size(%s::regclass)", [table])
+        else:
+            return None
+        return cur.fetchone()[0]
+
+
+def _time_ms(sql, repeat):
+    samples = []
+    with connection.cursor() as cur:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cur.execute(sql)
+            cur.fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = "Benchmark ChatMessage storage size and scan time: old wide layout vs compact columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--no-compress", action="store_true", help="skip zstd of long texts")
+
+    def handle(self, *args, **opts):
+        n, repeat, qn = opts["rows"], opts["repeat"], connection.ops.quote_name
+        compress = not opts["no_compress"] and compact.zstd_available()
+        if not opts["no_compress"] and not compress:
+            self.stderr.write("zstandard not installed; measuring without text compression")
+        table = qn(ChatMessage._meta.db_table)
+
+        with rolled_back():
+            first = ChatMessage.objects.aggregate(m=Max("pk"))["m"] or 0  # only the seeded rows are measured
+            seed_messages(n, legacy=True)
+            with connection.cursor() as cur:
+                cur.execute(f"CREATE TABLE {LEGACY_TABLE} AS SELECT "
+                            f"{', '.join(map(qn, _columns(False)))} FROM {table} WHERE id > {first}")
+
+            start = time.perf_counter()
+            below = ChatMessage.objects.aggregate(m=Max("pk"))["m"] + 1
+            compress_before = timezone.now() if compress else None
+            while below > first + 1:
+                scanned, _, below = compact.compact_batch(ChatMessage, below, opts["batch_size"], compress_before)
+                if not scanned:
+                    break
+            backfill_s = time.perf_counter() - start
+
+            with connection.cursor() as cur:
+                cur.execute(f"CREATE TABLE {COMPACT_TABLE} AS SELECT "
+                            f"{', '.join(map(qn, _columns(True)))} FROM {table} WHERE id > {first}")
+
+            sizes = {name: _table_bytes(name) for name in (LEGACY_TABLE, COMPACT_TABLE)}
+            shared = sum(_table_bytes(m._meta.db_table) or 0 for m in (Lookup, ChannelMetadata))
+            scans = {
+                "full scan": (f"SELECT * FROM {LEGACY_TABLE}", f"SELECT * FROM {COMPACT_TABLE}"),
+                "group by model": (
+                    f"SELECT model_name, COUNT(*), SUM(cost_usd) FROM {LEGACY_TABLE} GROUP BY model_name",
+                    f"SELECT model_name_ref, COUNT(*), SUM(cost_usd) FROM {COMPACT_TABLE} GROUP BY model_name_ref"),
+                "filter status": (
+                    f"SELECT COUNT(*) FROM {LEGACY_TABLE} WHERE delivery_status = 'failed'",
+                    f"SELECT COUNT(*) FROM {COMPACT_TABLE} WHERE delivery_status_ref = "
+                    f"{compact.lookups.get('failed') or compact.MISSING_ID}"),
+            }
+            timings = {label: [_time_ms(sql, repeat) for sql in pair] for label, pair in scans.items()}
+
+        self.stdout.write(f"{n} rows, backfill {n / backfill_s:.0f} rows/s, "
+                          f"text compression {'on' if compress else 'off'}")
+        if None not in sizes.values():
+            legacy_b, compact_b = sizes[LEGACY_TABLE] / n, (sizes[COMPACT_TABLE] + shared) / n
+            self.stdout.write(f"{'bytes/row':<16} {legacy_b:>10.1f} {compact_b:>10.1f} "
+                              f"{100 * (1 - compact_b / legacy_b):>6.1f}% smaller (incl. lookup tables)")
+        else:
+            self.stdout.write("table sizes unavailable on this backend")
+        self.stdout.write(f"{'median ms':<16} {'legacy':>10} {'compact':>10}")
+        for label, (old, new) in timings.items():
+            self.stdout.write(f"{label:<16} {old:>10.2f} {new:>10.2f} {old / new if new else 0:>6.1f}x")
@@ -0,0 +1,151 @@
+# whatsapp_chat/management/commands/bench_ingress.py
+"""
+python manage.py bench_ingress --requests 3000
+
+Requests/sec of one worker (a single thread calling the WSGI application directly)
+for Twilio status callbacks and inbound webhooks, three ways:
+- drf:   the previous DRF APIViews behind the full middleware stack
+- plain: the current plain Django views behind the full middleware stack
+- lean:  the current views through ingress.LeanWSGIHandler (what core/wsgi.py serves)
+The LLM and Twilio calls are local zero-latency stand-ins and every write happens
+inside a rolled-back transaction, so the numbers are framework + ORM overhead only.
+"""
+import functools
+import io
+import time
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core import signals
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+from django.test.utils import override_settings
+from django.urls import include, path
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from whatsapp_chat import ingress, replay, twilio_client, views
+from whatsapp_chat.models import ChatMessage
+
+from ._seed import rolled_back, seed_messages
+from .bench_outbox import FlakyTwilio
+
+WARMUP = 200
+
+
+class DRFWebhookView(APIView):
+    """The webhook as it was: DRF request parsing, auth/permission checks and a rendered Response."""
+    authentication_classes, permission_classes = [], [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        resp = views.WhatsAppWebhookView().handle(request, request.data)
+        return Response(resp.content.decode(), content_type=resp["Content-Type"])
+
+
+class DRFStatusView(APIView):
+    authentication_classes, permission_classes = [], [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        resp = views.StatusCallbackView().handle(request, request.data)
+        return Response(resp.content.decode())
+
+
+urlpatterns = [
+    path("drf/webhook", DRFWebhookView.as_view()),
+    path("drf/status", DRFStatusView.as_view()),
+    path("whatsapp_chat/", include("whatsapp_chat.urls")),
+]
+
+
+def _environ(path_info, body):
+    return {
+        "REQUEST_METHOD": "POST", "PATH_INFO": path_info, "SCRIPT_NAME": "", "QUERY_STRING": "",
+        "SERVER_NAME": "localhost", "SERVER_PORT": "80", "HTTP_HOST": "localhost",
+        "CONTENT_TYPE": "application/x-www-form-urlencoded", "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body), "wsgi.url_scheme": "http", "wsgi.errors": io.StringIO(),
+    }
+
+
+def _webhook_body(i):
+    phone = f"whatsapp:+9197{i:08d}"
+    return urlencode({
+        "SmsMessageSid": f"SMin{i:028d}", "NumMedia": "0", "ProfileName": "Bench User",
+        "MessageType": "text", "SmsSid": f"SMin{i:028d}", "WaId": phone[-12:], "SmsStatus": "received",
+        "Body": "what are your opening hours?", "To": "whatsapp:+14155238886", "NumSegments": "1",
+        "ReferralNumMedia": "0", "MessageSid": f"SMin{i:028d}", "AccountSid": "AC" + "0" * 32,
+        "From": phone, "ApiVersion": "2010-04-01",
+        "ChannelMetadata": '{"type":"whatsapp","data":{"context":{"ProfileName":"Bench User","WaId":"%s"}}}'
+                           % phone[-12:],
+    }).encode()
+
+
+def _status_body(i, sids):
+    return urlencode({
+        "MessageSid": sids[i % len(sids)], "MessageStatus": ("sent", "delivered", "read")[i % 3],
+        "To": "whatsapp:+919800000000", "From": "whatsapp:+14155238886", "AccountSid": "AC" + "0" * 32,
+        "ApiVersion": "2010-04-01", "ChannelPrefix": "whatsapp", "SmsStatus": "delivered",
+    }).encode()
+
+
+def _rps(app, path_info, bodies):
+    def start_response(status, headers):
+        if not status.startswith("200"):
+            raise RuntimeError(f"{path_info}: {status}")
+    start = time.perf_counter()
+    for body in bodies:
+        b"".join(app(_environ(path_info, body), start_response))
+    return len(bodies) / (time.perf_counter() - start)
+
+
+class Command(BaseCommand):
+    help = "Benchmark requests/sec per worker of the Twilio callbacks: DRF + middleware vs lean ingress."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=3000, help="requests per endpoint and variant")
+        parser.add_argument("--rows", type=int, default=20_000, help="seeded messages for status lookups")
+
+    def handle(self, *args, **opts):
+        n = opts["requests"]
+        # like the test client: keep the benchmark's transaction open across requests
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+        fake_llm = functools.partial(replay.fake_llm, latency_ms=0)
+        try:
+            with override_settings(ROOT_URLCONF=__name__), rolled_back(), \
+                    mock.patch.object(views, "ask_openai", fake_llm), \
+                    mock.patch.object(twilio_client, "get_client", lambda: FlakyTwilio(0, 0, 0)):
+                seed_messages(opts["rows"])
+                ChatMessage.objects.update(outbound_message_sid=Concat(Value("SMout"), Cast("pk", CharField())))
+                sids = list(ChatMessage.objects.values_list("outbound_message_sid", flat=True)[:opts["rows"]])
+
+                full, lean = WSGIHandler(), ingress.LeanWSGIHandler()
+                variants = {
+                    "drf": (full, "/drf/"),
+                    "plain": (full, "/whatsapp_chat/"),
+                    "lean": (lean, "/whatsapp_chat/"),
+                }
+                limited = _webhook_body(0)  # one sender far over its rate limit: admission check + TwiML only
+                endpoints = {  # each variant gets its own senders so none benefits from another's caches
+                    "status": ("status", lambda i: _status_body(i, sids)),
+                    "webhook": ("webhook", _webhook_body),
+                    "limited": ("webhook", lambda i: limited),
+                }
+                self.stdout.write(f"{n} requests per cell after {WARMUP} warm-up requests, 1 worker thread")
+                self.stdout.write(f"{'endpoint':<10}" + "".join(f"{v + ' req/s':>14}" for v in variants)
+                                  + f"{'lean/drf':>10}")
+                for label, (suffix, make_body) in endpoints.items():
+                    rates = []
+                    for k, (app, prefix) in enumerate(variants.values()):
+                        offset = (k + 1) * (n + WARMUP)
+                        bodies = [make_body(offset + i) for i in range(n + WARMUP)]
+                        _rps(app, prefix + suffix, bodies[:WARMUP])
+                        rates.append(_rps(app, prefix + suffix, bodies[WARMUP:]))
+                    self.stdout.write(f"{label:<10}" + "".join(f"{r:>14.0f}" for r in rates)
+                                      + f"{rates[-1] / rates[0]:>9.2f}x")
+        finally:
+            for signal in (signals.request_started, signals.request_finished):
+                signal.connect(close_old_connections)
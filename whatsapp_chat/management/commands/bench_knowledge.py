@@ -0,0 +1,63 @@
+# whatsapp_chat/management/commands/bench_knowledge.py
+"""
+python manage.py bench_knowledge --sizes 10000,100000,300000
+
+Builds throw-away indexes of random unit vectors in a temp directory and reports
+knowledge-base query latency (embed + top-k + chunk reads) per index size, plus the
+time to map a freshly written index.
+"""
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from whatsapp_chat.knowledge import HashingEmbedder, KnowledgeIndex
+
+QUERIES = ["what are your delivery charges", "refund policy for damaged items",
+           "opening hours on sunday", "weekly sales report", "how do I cancel my subscription"]
+
+
+class Command(BaseCommand):
+    help = "Benchmark knowledge-base search latency against index size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000", help="comma separated cumulative chunk counts")
+        parser.add_argument("--dim", type=int, default=384)
+        parser.add_argument("--k", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **opts):
+        sizes = sorted(int(s) for s in opts["sizes"].split(","))
+        dim, k, repeat = opts["dim"], opts["k"], opts["repeat"]
+        rng = np.random.default_rng(0)
+        tmp = tempfile.mkdtemp(prefix="kb-bench-")
+        try:
+            index = KnowledgeIndex(tmp, embedder=HashingEmbedder(dim))
+            self.stdout.write(f"{'chunks':>10} {'MB':>8} {'map ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+            indexed = 0
+            for size in sizes:
+                for lo in range(indexed, size, 50_000):
+                    n = min(50_000, size - lo)
+                    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                    index.append_vectors(f"synthetic-{lo}", [f"chunk {lo + i}" for i in range(n)], vectors)
+                indexed = size
+
+                start = time.perf_counter()
+                index.refresh()
+                map_ms = (time.perf_counter() - start) * 1000
+
+                samples = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    index.search(QUERIES[i % len(QUERIES)], k)
+                    samples.append((time.perf_counter() - start) * 1000)
+                samples.sort()
+                p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                self.stdout.write(f"{size:>10} {size * dim * 4 / 1e6:>8.1f} {map_ms:>8.2f} "
+                                  f"{statistics.median(samples):>8.2f} {p95:>8.2f}")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
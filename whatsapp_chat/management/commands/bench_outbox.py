@@ -0,0 +1,86 @@
+# whatsapp_chat/management/commands/bench_outbox.py
+"""
+python manage.py bench_outbox --messages 2000 --failure-rate 0.3 --permanent-rate 0.02
+
+Drains a seeded outbox (inside a rolled-back transaction) against a flaky local
+stand-in for the Twilio client and reports throughput and final outcomes.
+"""
+import itertools
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from twilio.base.exceptions import TwilioRestException
+
+from whatsapp_chat import outbox
+from whatsapp_chat.models import OutboundMessage
+
+from ._seed import rolled_back
+
+
+class FlakyTwilio:
+    """Mimics client.messages.create(): latency, 503s/429s/timeouts, and invalid numbers."""
+
+    def __init__(self, failure_rate, permanent_rate, latency_ms, seed=0):
+        self.failure_rate, self.permanent_rate = failure_rate, permanent_rate
+        self.latency = latency_ms / 1000
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self.messages = self
+        self.calls = 0
+
+    def create(self, to, **kwargs):
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            n = next(self._ids)
+        time.sleep(self.latency)
+        if roll < self.permanent_rate:
+            raise TwilioRestException(400, "/Messages", "invalid 'To' number", code=21211, method="POST")
+        if roll < self.permanent_rate + self.failure_rate:
+            if roll < self.permanent_rate + self.failure_rate / 3:
+                raise ConnectionError("connection reset by peer")
+            raise TwilioRestException(503, "/Messages", "service unavailable", method="POST")
+        return type("Msg", (), {"sid": f"SMbench{n:026d}"})()
+
+
+class Command(BaseCommand):
+    help = "Benchmark outbox draining throughput against a flaky Twilio stand-in."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--failure-rate", type=float, default=0.3, help="transient failure probability")
+        parser.add_argument("--permanent-rate", type=float, default=0.02)
+        parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated Twilio API latency")
+        parser.add_argument("--batch-size", type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=outbox.CONCURRENCY)
+
+    def handle(self, *args, **opts):
+        client = FlakyTwilio(opts["failure_rate"], opts["permanent_rate"], opts["latency_ms"])
+        n = opts["messages"]
+
+        with rolled_back():
+            OutboundMessage.objects.bulk_create(
+                OutboundMessage(to_phone=f"whatsapp:+9198{i:08d}", body="bench reply") for i in range(n))
+
+            start = time.perf_counter()
+            # backoff_base=0 so retries are due immediately and the run measures dispatch cost
+            while True:
+                counts = outbox.dispatch_batch(opts["batch_size"], client=client,
+                                               concurrency=opts["concurrency"], backoff_base=0)
+                if not any(counts.values()):
+                    break
+            elapsed = time.perf_counter() - start
+
+            sent = OutboundMessage.objects.filter(status=OutboundMessage.SENT).count()
+            dead = OutboundMessage.objects.filter(status=OutboundMessage.DEAD).count()
+            pending = OutboundMessage.objects.filter(status=OutboundMessage.PENDING).count()
+
+        self.stdout.write(f"messages      : {n}")
+        self.stdout.write(f"twilio calls  : {client.calls} ({client.calls / n:.2f} per message)")
+        self.stdout.write(f"sent / dead   : {sent} / {dead} (pending {pending})")
+        self.stdout.write(f"elapsed       : {elapsed:.2f}s -> {n / elapsed:.0f} messages/s "
+                          f"(batch {opts['batch_size']}, concurrency {opts['concurrency']}, "
+                          f"{opts['latency_ms']:.0f} ms simulated latency)")
@@ -0,0 +1,45 @@
+# whatsapp_chat/management/commands/bench_ratelimit.py
+"""
+python manage.py bench_ratelimit --requests 200000 --senders 5000
+
+Measures the per-request cost of webhook admission (rate limit + LLM gate).
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from whatsapp_chat.ratelimit import FairGate, SenderRateLimiter
+
+
+class Command(BaseCommand):
+    help = "Benchmark admission-control overhead per webhook request."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200_000)
+        parser.add_argument("--senders", type=int, default=5_000)
+        parser.add_argument("--cache", default=None, help="also exercise the shared limiter on this cache alias")
+
+    def handle(self, *args, **opts):
+        n, senders = opts["requests"], opts["senders"]
+        rng = random.Random(0)
+        keys = [f"whatsapp:+9198{rng.randrange(10**8):08d}" for _ in range(senders)]
+        stream = [rng.choice(keys) for _ in range(n)]
+
+        limiter = SenderRateLimiter(rate=1000.0, burst=1000, cache_alias=opts["cache"])
+        gate = FairGate(slots=8, per_sender=1, max_waiting=32, timeout=0)
+
+        start = time.perf_counter()
+        for sender in stream:
+            limiter.allow(sender)
+        limit_us = (time.perf_counter() - start) / n * 1e6
+
+        start = time.perf_counter()
+        for sender in stream:
+            if gate.acquire(sender):
+                gate.release(sender)
+        gate_us = (time.perf_counter() - start) / n * 1e6
+
+        self.stdout.write(f"rate limiter : {limit_us:7.2f} us/request ({'shared+local' if opts['cache'] else 'local'})")
+        self.stdout.write(f"llm gate     : {gate_us:7.2f} us/request (uncontended acquire+release)")
+        self.stdout.write(f"total        : {limit_us + gate_us:7.2f} us/request")
@@ -0,0 +1,62 @@
+# whatsapp_chat/management/commands/bench_search.py
+"""
+python manage.py bench_search --sizes 10000,100000,300000
+
+Seeds synthetic messages (inside a rolled-back transaction) and compares
+full-text search latency with the old LIKE '%...%' scan as the table grows.
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from whatsapp_chat import search
+from whatsapp_chat.models import ChatMessage
+
+from ._seed import rolled_back, seed_messages
+
+QUERIES = ["ticket42", "sku7 refund", "city150", "weekly sales report", "cancel subscription"]
+
+
+def _time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = "Benchmark ?q= search latency (full-text index vs icontains) against table size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000", help="comma separated cumulative row counts")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--page", type=int, default=25, help="rows fetched per query (one API page)")
+
+    def handle(self, *args, **opts):
+        sizes = sorted(int(s) for s in opts["sizes"].split(","))
+        repeat, page = opts["repeat"], opts["page"]
+
+        if not search.is_installed():
+            self.stderr.write("full-text index unavailable on this backend; only the fallback is measured")
+
+        self.stdout.write(f"{'rows':>10} {'fts ms':>10} {'like ms':>10} {'speedup':>8}")
+        with rolled_back():
+            seeded = 0
+            for size in sizes:
+                seed_messages(size - seeded, seed=size)
+                seeded = size
+
+                fts, like = [], []
+                for text in QUERIES:
+                    fts.append(_time_ms(
+                        lambda: list(search.search(ChatMessage.objects.all(), text)[:page]), repeat))
+                    like_q = Q(user_text__icontains=text) | Q(response_text__icontains=text)
+                    like.append(_time_ms(
+                        lambda: list(ChatMessage.objects.filter(like_q)[:page]), repeat))
+
+                f, l = statistics.mean(fts), statistics.mean(like)
+                self.stdout.write(f"{size:>10} {f:>10.2f} {l:>10.2f} {l / f if f else 0:>7.1f}x")
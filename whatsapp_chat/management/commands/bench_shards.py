@@ -0,0 +1,194 @@
+# whatsapp_chat/management/commands/bench_shards.py
+"""
+python manage.py bench_shards --workers 1,2,4 --conversations 100 --messages 5
+python manage.py bench_shards --workers 4 --churn      # kill one worker, then add one, mid-run
+
+Multi-process harness for shards.py. For each worker count it starts that many
+process_inbound-style worker processes on a scratch database, queues
+conversations x messages at once, waits until everything is answered and sent
+(this process runs the outbox dispatcher meanwhile) and then checks that:
+- every message was answered exactly once (one ChatMessage each, none failed),
+- each conversation's replies were committed in message order, and no message
+  started before the previous one of its conversation had finished,
+- each conversation's replies were sent in message order, although
+  --twilio-failure-rate of the sends fail and are retried.
+It reports messages/s and the speedup over the first worker count. --churn
+SIGKILLs one worker a third of the way in (its leases must expire and its slots
+move) and starts a new one at two thirds (slots move back). The LLM and Twilio
+calls are local stand-ins with the given latencies.
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from whatsapp_chat import outbox, shards
+from whatsapp_chat.models import ChatMessage, InboundMessage, OutboundMessage, ShardMember
+
+from . import _shard_worker
+from .bench_outbox import FlakyTwilio
+
+HEARTBEAT, MEMBER_TTL, LEASE = 0.5, 2.0, 3.0  # seconds; short so churn settles quickly
+OUTBOX_BACKOFF = 0.05  # seconds, doubled per attempt; short so retries don't dominate the run
+
+
+def _payload(conversation, seq):
+    phone = f"whatsapp:+9196{conversation:08d}"
+    return {
+        "Body": f"c{conversation} m{seq}: what are your opening hours?",
+        "From": phone, "To": "whatsapp:+14155238886", "WaId": phone[-12:],
+        "MessageSid": f"SMsh{conversation:014d}{seq:014d}", "ProfileName": "Bench User",
+        "NumMedia": "0", "NumSegments": "1", "SmsStatus": "received", "MessageType": "text",
+    }
+
+
+def _check_order(messages):
+    """-> (conversations out of order, overlapping messages, conversations that changed worker)"""
+    seqs, out_of_order = defaultdict(list), set()
+    for phone, text in ChatMessage.objects.order_by("pk").values_list("from_phone", "user_text"):
+        seqs[phone].append(int(text.split()[1][1:-1]))  # "c12 m3: ..." -> 3
+    for phone, got in seqs.items():
+        if got != list(range(messages)):
+            out_of_order.add(phone)
+
+    overlaps, workers, last = 0, defaultdict(set), {}
+    for conv, started, finished, worker in (InboundMessage.objects.order_by("conversation", "pk")
+                                            .values_list("conversation", "started_at", "finished_at", "worker")):
+        if conv in last and started < last[conv]:
+            overlaps += 1
+        last[conv] = finished
+        workers[conv].add(worker)
+    return len(out_of_order), overlaps, sum(len(w) > 1 for w in workers.values())
+
+
+def _check_sends():
+    """
+    -> conversations whose replies were sent out of message order. A reply is only
+    sent once the previous one is recorded as sent, so the order of `updated_at`
+    (set when the send is recorded) is the send order.
+    """
+    seqs = defaultdict(list)
+    for phone, text in (OutboundMessage.objects.filter(status=OutboundMessage.SENT)
+                        .order_by("updated_at", "pk").values_list("to_phone", "chat_message__user_text")):
+        seqs[phone].append(int(text.split()[1][1:-1]))
+    return sum(got != sorted(got) for got in seqs.values())
+
+
+class Command(BaseCommand):
+    help = "Multi-process harness for sharded inbound processing: ordering checks and throughput scaling."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", default="1,2,4", help="comma-separated worker process counts")
+        parser.add_argument("--conversations", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=5, help="messages per conversation")
+        parser.add_argument("--concurrency", type=int, default=4, help="threads per worker")
+        parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+        parser.add_argument("--twilio-latency-ms", type=float, default=5.0)
+        parser.add_argument("--twilio-failure-rate", type=float, default=0.2,
+                            help="share of sends that fail transiently and are retried")
+        parser.add_argument("--churn", action="store_true", help="kill one worker and add one during each run")
+        parser.add_argument("--timeout", type=float, default=300.0, help="seconds per run")
+
+    def handle(self, *args, **opts):
+        counts = [int(n) for n in opts["workers"].split(",")]
+        worker_opts = {"concurrency": opts["concurrency"], "llm_latency_ms": opts["llm_latency_ms"],
+                       "twilio_latency_ms": opts["twilio_latency_ms"],
+                       "twilio_failure_rate": opts["twilio_failure_rate"], "outbox_backoff": OUTBOX_BACKOFF,
+                       "heartbeat": HEARTBEAT, "member_ttl": MEMBER_TTL, "lease": LEASE}
+        with tempfile.TemporaryDirectory() as tmp:
+            db = self._scratch_db(tmp)
+            try:
+                self.stdout.write(f"{opts['conversations']} conversations x {opts['messages']} messages, "
+                                  f"{opts['concurrency']} threads/worker, LLM ~{opts['llm_latency_ms']:.0f}ms"
+                                  f"{', with churn' if opts['churn'] else ''}")
+                self.stdout.write(f"{'workers':>7} {'msgs/s':>9} {'speedup':>8} {'answered':>9} {'replies':>8} "
+                                  f"{'out of order':>13} {'overlaps':>9} {'sent unordered':>15} {'dead':>5} "
+                                  f"{'moved convs':>12} {'redone':>7}")
+                base, failures = None, 0
+                for n in counts:
+                    row = self._run(n, db, worker_opts, opts)
+                    base = base or row["rate"]
+                    ok = (row["answered"] == row["replies"] == row["total"]
+                          and not row["out_of_order"] and not row["overlaps"] and not row["sent_unordered"])
+                    failures += not ok
+                    self.stdout.write(f"{n:>7} {row['rate']:>9.1f} {row['rate'] / base:>7.2f}x "
+                                      f"{row['answered']:>4}/{row['total']:<4} {row['replies']:>8} "
+                                      f"{row['out_of_order']:>13} {row['overlaps']:>9} "
+                                      f"{row['sent_unordered']:>15} {row['dead']:>5} {row['moved']:>12} "
+                                      f"{row['redone']:>7}")
+            finally:
+                connection.creation.destroy_test_db(self._old_name, verbosity=0)
+        if failures:
+            raise CommandError(f"{failures} run(s) lost, duplicated or reordered messages")
+
+    def _scratch_db(self, tmp):
+        """A migrated throwaway database the worker processes can share (a file on SQLite)."""
+        if connection.vendor == "sqlite":
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "bench_shards.sqlite3")
+            # WAL: readers don't block the writer; writers wait for the lock (see settings.DATABASES)
+            connection.settings_dict["OPTIONS"].update({"timeout": 60, "init_command": "PRAGMA synchronous=NORMAL"})
+        self._old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cur:
+                cur.execute("PRAGMA journal_mode=WAL")
+        return {"NAME": connection.settings_dict["NAME"], "OPTIONS": connection.settings_dict["OPTIONS"]}
+
+    def _start(self, ctx, name, db, worker_opts, stop, results):
+        proc = ctx.Process(target=_shard_worker.run, args=(db, name, worker_opts, stop, results), daemon=True)
+        proc.start()
+        return proc
+
+    def _run(self, n, db, worker_opts, opts):
+        for model in (OutboundMessage, ChatMessage, InboundMessage, ShardMember):
+            model.objects.all().delete()
+        ctx = multiprocessing.get_context("spawn")
+        stop, results = ctx.Event(), ctx.Queue()
+        procs = {f"w{i}": self._start(ctx, f"w{i}", db, worker_opts, stop, results) for i in range(n)}
+
+        deadline = time.monotonic() + 120
+        while len(shards.live_members(MEMBER_TTL)) < n:  # spawned interpreters take a moment to boot
+            if time.monotonic() > deadline:
+                raise CommandError("workers did not register")
+            time.sleep(0.1)
+        time.sleep(3 * HEARTBEAT)  # let every worker see the full ring
+
+        total = opts["conversations"] * opts["messages"]
+        InboundMessage.objects.bulk_create(
+            InboundMessage(conversation=p["WaId"], slot=shards.slot_for(p["WaId"]), payload=p)
+            for p in (_payload(c, m) for m in range(opts["messages"]) for c in range(opts["conversations"])))
+
+        start, killed, joined = time.perf_counter(), False, False
+        open_ = InboundMessage.objects.filter(status__in=shards.OPEN)
+        unsent = OutboundMessage.objects.filter(status=OutboundMessage.PENDING)
+        twilio = FlakyTwilio(opts["twilio_failure_rate"], 0, opts["twilio_latency_ms"], seed=n)
+        while (left := open_.count()) or unsent.exists():
+            if time.perf_counter() - start > opts["timeout"]:
+                raise CommandError(f"{left} messages still open after {opts['timeout']}s")
+            if opts["churn"] and n > 1 and not killed and left < total * 2 / 3:
+                procs.pop("w0").kill()  # crash: no leave(), in-flight claims only expire
+                killed = True
+            elif opts["churn"] and killed and not joined and left < total / 3:
+                procs["w-join"] = self._start(ctx, "w-join", db, worker_opts, stop, results)
+                joined = True
+            # the dispatcher: retries of failed sends, and replies held back behind them
+            if not any(outbox.dispatch_batch(client=twilio, backoff_base=OUTBOX_BACKOFF).values()):
+                time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        for _ in procs:
+            results.get(timeout=60)
+        for proc in procs.values():
+            proc.join(timeout=30)
+
+        out_of_order, overlaps, moved = _check_order(opts["messages"])
+        return {"rate": total / elapsed, "total": total, "sent_unordered": _check_sends(),
+                "dead": OutboundMessage.objects.filter(status=OutboundMessage.DEAD).count(),
+                "answered": InboundMessage.objects.filter(status=InboundMessage.DONE).count(),
+                "replies": ChatMessage.objects.count(),
+                "redone": InboundMessage.objects.filter(attempts__gt=1).count(),  # claimed again after a lease ran out
+                "out_of_order": out_of_order, "overlaps": overlaps, "moved": moved}
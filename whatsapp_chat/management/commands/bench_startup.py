@@ -0,0 +1,81 @@
+# whatsapp_chat/management/commands/bench_startup.py
+"""
+python manage.py bench_startup [--runs 5] [--budget-ms 600]
+
+Measures cold import cost of the app (django.setup() + URLconf) with
+`python -X importtime` in a fresh interpreter, lists the heaviest imports and
+fails (non-zero exit) when the median exceeds the budget or a lazily loaded
+provider SDK sneaks back into startup. Run it in CI to keep startup lean.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+BUDGET_MS = int(getattr(settings, "STARTUP_IMPORT_BUDGET_MS", 600))
+
+# must only be imported on first use (see openai_client / gemini_client / twilio_client / knowledge)
+LAZY_MODULES = ("openai", "twilio.rest", "google.generativeai", "pdfkit", "weasyprint", "numpy")
+
+PROBE = (
+    "import os, django;"
+    "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings');"
+    "django.setup();"
+    "from django.conf import settings;"
+    "__import__(settings.ROOT_URLCONF)"
+)
+
+
+def _parse_importtime(stderr):
+    """-> (total_us, {module: cumulative_us}) from `-X importtime` output."""
+    total, modules = 0, {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        us = int(cumulative)
+        modules[name.strip()] = us
+        if not name.startswith("  "):  # top level import: cumulative includes its children
+            total += us
+    return total, modules
+
+
+class Command(BaseCommand):
+    help = "Measure startup import time with -X importtime and enforce a budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--budget-ms", type=int, default=BUDGET_MS)
+        parser.add_argument("--top", type=int, default=10)
+
+    def handle(self, *args, **opts):
+        env = {**os.environ, "WSGI_PRELOAD_PROVIDERS": "0"}
+        totals, modules = [], {}
+        for _ in range(opts["runs"]):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", PROBE],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                raise CommandError(proc.stderr[-2000:])
+            total, modules = _parse_importtime(proc.stderr)
+            totals.append(total / 1000)
+
+        median = statistics.median(totals)
+        self.stdout.write(f"startup imports: median {median:.0f} ms over {len(totals)} runs "
+                          f"(min {min(totals):.0f}, max {max(totals):.0f}), budget {opts['budget_ms']} ms")
+        self.stdout.write("heaviest top-level packages:")
+        top_level = {m: us for m, us in modules.items() if "." not in m}
+        for name, us in sorted(top_level.items(), key=lambda kv: -kv[1])[:opts["top"]]:
+            self.stdout.write(f"  {us / 1000:8.1f} ms  {name}")
+
+        leaked = [m for m in LAZY_MODULES if m in modules]
+        if leaked:
+            raise CommandError(f"lazily loaded modules imported at startup: {', '.join(leaked)}")
+        if median > opts["budget_ms"]:
+            raise CommandError(f"startup import time {median:.0f} ms exceeds budget {opts['budget_ms']} ms")
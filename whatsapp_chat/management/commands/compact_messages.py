@@ -0,0 +1,69 @@
+# whatsapp_chat/management/commands/compact_messages.py
+"""
+python manage.py compact_messages                       # move old rows to the compact columns
+python manage.py compact_messages --compress-after-days 90
+python manage.py compact_messages --check               # rows still left in the legacy columns
+
+Rolling out the compact ChatMessage layout (see whatsapp_chat/compact.py) without downtime:
+
+1. expand:   migrate (0006, 0010). 0006 adds tables and nullable columns without a
+             default, which SQLite and Postgres add without rebuilding the table.
+             0010 adds the to_phone_ref and channel_metadata_ref indexes, built with
+             CREATE INDEX CONCURRENTLY on Postgres so writes go on meanwhile.
+             Deploy the new code: it writes only the compact columns and reads both.
+2. backfill: this command, while the app is serving. Batches are small, short
+             transactions, newest rows first, so recent conversations (what the API
+             filters and the admin show) are compacted first. Safe to stop and re-run.
+3. contract: once --check reports 0, set CHATMESSAGE_BACKFILL_COMPLETE = True so reads
+             stop falling back to the legacy columns. In a later release drop the
+             legacy fields from models.py (a plain RemoveField migration) and
+             VACUUM FULL / pg_repack or VACUUM on SQLite to hand the space back.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from whatsapp_chat import compact
+from whatsapp_chat.models import ChatMessage
+
+
+class Command(BaseCommand):
+    help = "Backfill ChatMessage's compact columns in small batches (online, resumable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="pause between batches (seconds)")
+        parser.add_argument("--compress-after-days", type=int, default=compact.COMPRESS_AFTER_DAYS,
+                            help="also zstd long texts older than this (needs zstandard)")
+        parser.add_argument("--check", action="store_true", help="count rows not compacted yet and exit")
+
+    def handle(self, *args, **opts):
+        if opts["check"]:
+            left = ChatMessage.objects.filter(compact.pending_q(ChatMessage)).count()
+            self.stdout.write(f"{left} rows still use the legacy columns")
+            return
+
+        compress_before = None
+        if opts["compress_after_days"] is not None:
+            if not compact.zstd_available():
+                raise CommandError("--compress-after-days needs zstandard (pip install zstandard)")
+            compress_before = timezone.now() - timedelta(days=opts["compress_after_days"])
+
+        below = (ChatMessage.objects.aggregate(m=Max("pk"))["m"] or 0) + 1
+        scanned = changed = 0
+        start = time.perf_counter()
+        while True:
+            n, c, lowest = compact.compact_batch(ChatMessage, below, opts["batch_size"], compress_before)
+            if not n:
+                break
+            scanned, changed, below = scanned + n, changed + c, lowest
+            if scanned % (opts["batch_size"] * 20) < opts["batch_size"]:
+                self.stdout.write(f"  {scanned} rows scanned, {changed} compacted, "
+                                  f"{scanned / (time.perf_counter() - start):.0f} rows/s")
+            if opts["sleep"]:
+                time.sleep(opts["sleep"])
+        self.stdout.write(f"done: {scanned} rows scanned, {changed} compacted "
+                          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,36 @@
+# whatsapp_chat/management/commands/dispatch_outbox.py
+"""
+python manage.py dispatch_outbox            # run forever
+python manage.py dispatch_outbox --once     # drain what is due now and exit (cron)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from whatsapp_chat import outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued outbound replies, retrying transient Twilio failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="drain due messages once and exit")
+        parser.add_argument("--batch-size", type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=outbox.CONCURRENCY)
+        parser.add_argument("--interval", type=float, default=1.0, help="idle poll interval (seconds)")
+
+    def handle(self, *args, **opts):
+        totals = {"sent": 0, "retrying": 0, "dead": 0}
+        while True:
+            close_old_connections()
+            counts = outbox.dispatch_batch(opts["batch_size"], concurrency=opts["concurrency"])
+            for k, v in counts.items():
+                totals[k] += v
+            if any(counts.values()):
+                self.stdout.write(f"sent={counts['sent']} retrying={counts['retrying']} dead={counts['dead']}")
+                continue  # keep draining while there is work
+            if opts["once"]:
+                break
+            time.sleep(opts["interval"])
+        self.stdout.write(f"done: sent={totals['sent']} retrying={totals['retrying']} dead={totals['dead']}")
@@ -0,0 +1,44 @@
+# whatsapp_chat/management/commands/kb_ingest.py
+"""
+python manage.py kb_ingest docs/faq.md docs/policies/ --reports
+python manage.py kb_ingest docs/ --prune      # also drop documents no longer present
+python manage.py kb_ingest docs/ --rebuild    # start over (e.g. after changing KNOWLEDGE_EMBEDDER)
+
+Unchanged files (same size and mtime) are skipped, so it is cheap to run from cron.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from whatsapp_chat.knowledge import KnowledgeIndex
+
+
+class Command(BaseCommand):
+    help = "Build or incrementally update the local knowledge-base index used for replies."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="files or directories (.txt .md .html .pdf)")
+        parser.add_argument("--reports", action="store_true", help="include the PDFs under MEDIA_ROOT/reports")
+        parser.add_argument("--prune", action="store_true", help="remove indexed documents not found in paths")
+        parser.add_argument("--rebuild", action="store_true", help="discard the index and re-embed everything")
+
+    def handle(self, *args, **opts):
+        paths = list(opts["paths"])
+        if opts["reports"]:
+            paths.append(os.path.join(settings.MEDIA_ROOT, "reports"))
+        if not paths:
+            raise CommandError("give at least one path or --reports")
+
+        start = time.perf_counter()
+        index = KnowledgeIndex()
+        try:
+            stats = index.rebuild(paths) if opts["rebuild"] else index.ingest(paths, prune=opts["prune"])
+        except ValueError as e:  # index built with another embedder
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"added={stats['added']} updated={stats['updated']} unchanged={stats['unchanged']} "
+            f"removed={stats['removed']} chunks={stats['chunks']} "
+            f"rows={index.manifest['rows']} dead={index.dead_rows()} "
+            f"in {time.perf_counter() - start:.1f}s -> {index.dir}")
@@ -0,0 +1,38 @@
+# whatsapp_chat/management/commands/process_inbound.py
+"""
+python manage.py process_inbound                  # one shard worker, runs until SIGTERM / Ctrl-C
+python manage.py process_inbound --name node2-a   # stable name: a restart gets the same slots back
+python manage.py process_inbound --once           # answer what is claimable now and exit
+
+Run any number of these (per node, per core) with INBOUND_SHARDED = True; they
+split the conversations between them, see whatsapp_chat/shards.py.
+"""
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from whatsapp_chat import shards
+
+
+class Command(BaseCommand):
+    help = "Answer queued inbound messages: ordered per conversation, sharded across workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", help="worker name on the hash ring (default host:pid)")
+        parser.add_argument("--concurrency", type=int, default=shards.CONCURRENCY,
+                            help="conversations answered in parallel by this worker")
+        parser.add_argument("--once", action="store_true", help="exit once nothing is claimable")
+
+    def handle(self, *args, **opts):
+        if not shards.ENABLED:
+            self.stderr.write("INBOUND_SHARDED is off: the webhook answers inline and queues nothing")
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())  # finish in-flight messages, then leave the ring
+
+        worker = shards.Worker(opts["name"], opts["concurrency"], report=self.stdout.write)
+        worker.run(stop, idle_exit=opts["once"])
+        s = worker.stats
+        self.stdout.write(f"done: answered={s['done']} retried={s['retried']} failed={s['failed']} "
+                          f"lost={s['lost']} rebalances={s['rebalances']}")
@@ -0,0 +1,118 @@
+# whatsapp_chat/management/commands/replay_messages.py
+"""
+python manage.py replay_messages --since 2025-09-01 --limit 1000 --out replay.jsonl \\
+    --config name=mini,provider=openai,model=gpt-4o-mini,rps=5 \\
+    --config name=mini-short,provider=openai,model=gpt-4o-mini,max_tokens=256,system=@prompts/short.txt,rps=5
+
+python manage.py replay_messages --config name=fake,provider=fake,latency_ms=400   # no API calls
+python manage.py replay_messages --report-only --out replay.jsonl
+
+Re-running with the same --out resumes: (message, config) pairs that already have a
+reply are skipped and errored ones are tried again. See whatsapp_chat/replay.py.
+"""
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from whatsapp_chat import replay
+from whatsapp_chat.models import ChatMessage
+
+REPORT_COLUMNS = [
+    ("config", "config", 14), ("model", "model", 18), ("replies", "n", 7), ("errors", "err", 5),
+    ("latency_p50_ms", "p50 ms", 8), ("latency_p90_ms", "p90 ms", 8), ("latency_p99_ms", "p99 ms", 8),
+    ("avg_prompt_tokens", "in tok", 8), ("avg_completion_tokens", "out tok", 8),
+    ("reply_chars_p50", "chars", 7), ("truncated_pct", "trunc%", 7), ("cost_usd", "cost $", 10),
+]
+
+
+def _date(value):
+    try:
+        return timezone.make_aware(datetime.strptime(value, "%Y-%m-%d"))
+    except ValueError:
+        raise CommandError(f"expected YYYY-MM-DD, got {value!r}")
+
+
+class Command(BaseCommand):
+    help = "Replay historical user messages through candidate LLM configs and compare the results."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--config", action="append", default=[],
+                            help="name=..,provider=openai|gemini|fake,model=..,temperature=..,max_tokens=..,"
+                                 "system=@file,rps=..,burst=.. (repeatable; configs of one provider "
+                                 "share its rps, the lowest given wins)")
+        parser.add_argument("--out", default="replay.jsonl", help="JSONL results file (appended, resumable)")
+        parser.add_argument("--parquet", help="also write a columnar copy here (requires pyarrow)")
+        parser.add_argument("--since", help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--until", help="YYYY-MM-DD, exclusive")
+        parser.add_argument("--limit", type=int, help="replay at most this many messages")
+        parser.add_argument("--workers", type=int, default=8, help="concurrent provider calls")
+        parser.add_argument("--no-baseline", action="store_true", help="don't write the recorded replies")
+        parser.add_argument("--report-only", action="store_true", help="just summarize --out")
+
+    def handle(self, *args, **opts):
+        if not opts["report_only"]:
+            self._replay(opts)
+        try:
+            report = replay.summarize(opts["out"])
+        except FileNotFoundError:
+            raise CommandError(f"{opts['out']} does not exist")
+        self._print_report(report)
+
+        if opts["parquet"]:
+            try:
+                replay.to_parquet(opts["out"], opts["parquet"])
+            except ImportError:
+                raise CommandError("--parquet needs pyarrow (pip install pyarrow)")
+            self.stdout.write(f"columnar copy -> {opts['parquet']}")
+
+    def _replay(self, opts):
+        if not opts["config"]:
+            raise CommandError("give at least one --config (or --report-only)")
+        try:
+            configs = [replay.ReplayConfig.parse(spec) for spec in opts["config"]]
+        except (ValueError, TypeError, ImportError, OSError) as e:
+            raise CommandError(f"bad --config: {e}")
+        if len({c.name for c in configs}) != len(configs):
+            raise CommandError("--config names must be unique")
+
+        qs = (ChatMessage.objects.filter(Q(user_text__gt="") | Q(user_text_z__isnull=False))
+              .only(*replay.ROW_FIELDS).order_by("pk"))
+        if opts["since"]:
+            qs = qs.filter(created_at__gte=_date(opts["since"]))
+        if opts["until"]:
+            qs = qs.filter(created_at__lt=_date(opts["until"]))
+        if opts["limit"]:
+            qs = qs[:opts["limit"]]
+
+        start = time.perf_counter()
+        progress = {"n": 0}
+
+        def on_record(record):
+            progress["n"] += 1
+            if progress["n"] % 500 == 0:
+                self.stdout.write(f"  {progress['n']} records, {time.perf_counter() - start:.0f}s")
+
+        try:
+            counts = replay.replay(qs.iterator(chunk_size=1000), configs, opts["out"],
+                                   workers=opts["workers"], baseline=not opts["no_baseline"],
+                                   on_record=on_record)
+        except KeyboardInterrupt:
+            raise CommandError(f"interrupted; re-run with --out {opts['out']} to resume")
+        self.stdout.write(f"wrote {counts['written']} records, skipped {counts['skipped']} already done "
+                          f"in {time.perf_counter() - start:.1f}s -> {opts['out']}")
+
+    def _print_report(self, report):
+        self.stdout.write(" ".join(f"{title:>{w}}" for _, title, w in REPORT_COLUMNS))
+        for row in report:
+            cells = []
+            for key, _, w in REPORT_COLUMNS:
+                value = row[key]
+                if value is None:
+                    value = "-"
+                elif key == "cost_usd":
+                    value = f"{value:.4f}"
+                cells.append(f"{str(value)[:w]:>{w}}")
+            self.stdout.write(" ".join(cells))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_sid', models.CharField(db_index=True, max_length=64)),
+                ('account_sid', models.CharField(blank=True, max_length=64, null=True)),
+                ('sms_status', models.CharField(blank=True, max_length=32, null=True)),
+                ('message_type', models.CharField(blank=True, max_length=32, null=True)),
+                ('num_media', models.IntegerField(default=0)),
+                ('num_segments', models.IntegerField(default=1)),
+                ('wa_id', models.CharField(blank=True, max_length=32, null=True)),
+                ('profile_name', models.CharField(blank=True, max_length=128, null=True)),
+                ('api_version', models.CharField(blank=True, max_length=16, null=True)),
+                ('channel_metadata', models.JSONField(blank=True, null=True)),
+                ('from_phone', models.CharField(db_index=True, max_length=32)),
+                ('to_phone', models.CharField(db_index=True, max_length=32)),
+                ('user_text', models.TextField(blank=True, null=True)),
+                ('response_text', models.TextField(blank=True, null=True)),
+                ('model_name', models.CharField(default='gemini-1.5-flash', max_length=64)),
+                ('temperature', models.FloatField(default=0.2)),
+                ('latency_ms', models.IntegerField(default=0)),
+                ('outbound_message_sid', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('delivery_status', models.CharField(blank=True, max_length=32, null=True)),
+                ('delivery_error_code', models.CharField(blank=True, max_length=32, null=True)),
+                ('delivery_error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='completion_tokens',
+            field=models.IntegerField(db_default=models.Value(0), null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='cost_usd',
+            field=models.FloatField(db_default=models.Value(0), null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='finish_reason',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='prompt_tokens',
+            field=models.IntegerField(db_default=models.Value(0), null=True),
+        ),
+    ]
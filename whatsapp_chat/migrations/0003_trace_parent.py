@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0002_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='trace_parent',
+            field=models.CharField(blank=True, max_length=55, null=True),
+        ),
+    ]
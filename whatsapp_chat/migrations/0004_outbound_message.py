@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0003_trace_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_phone', models.CharField(max_length=32)),
+                ('body', models.TextField(blank=True, null=True)),
+                ('media_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('status_callback', models.URLField(blank=True, max_length=500, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('dead', 'dead')], default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sid', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('last_error_code', models.CharField(blank=True, max_length=32, null=True)),
+                ('last_error_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chat_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='whatsapp_chat.chatmessage')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='whatsapp_ch_status_c04712_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0004_outbound_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['created_at', 'id'], name='chatmessage_created_id'),
+        ),
+    ]
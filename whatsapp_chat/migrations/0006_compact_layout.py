@@ -0,0 +1,85 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+import django.db.models.deletion
+import whatsapp_chat.compact
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0005_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('data', models.JSONField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Lookup',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('value', models.CharField(max_length=128, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='account_sid_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='account sid'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='api_version_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='api version'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='delivery_status_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='delivery status'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='finish_reason_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='finish reason'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='message_type_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='message type'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='model_name_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='model name'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='response_text_z',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='sms_status_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='sms status'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='to_phone_ref',
+            field=whatsapp_chat.compact.LookupField(blank=True, null=True, verbose_name='to phone'),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='user_text_z',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='channel_metadata_ref',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='whatsapp_chat.channelmetadata', verbose_name='channel metadata'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:02
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0006_compact_layout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('heartbeat_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InboundMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.CharField(max_length=32)),
+                ('slot', models.SmallIntegerField()),
+                ('payload', models.JSONField()),
+                ('status_callback', models.URLField(blank=True, max_length=500, null=True)),
+                ('trace_parent', models.CharField(blank=True, max_length=55, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('worker', models.CharField(blank=True, max_length=64, null=True)),
+                ('token', models.CharField(blank=True, max_length=32, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('chat_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='whatsapp_chat.chatmessage')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['slot', 'status', 'next_attempt_at'], name='whatsapp_ch_slot_1e8521_idx'), models.Index(fields=['conversation', 'status', 'id'], name='whatsapp_ch_convers_38fa4f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,162 @@
+"""
+Full-text index over ChatMessage.user_text / response_text (see whatsapp_chat/search.py).
+
+The SQL is vendor specific, so it runs from RunPython rather than a plain RunSQL:
+SQLite gets a contentless FTS5 table fed by triggers (skipped on builds without FTS5),
+Postgres a tsvector column kept by a trigger with a GIN index, other backends nothing
+(search falls back to icontains there). MessageSearchIndex maps the FTS5 table for
+the ORM and is unmanaged, so its CreateModel touches no schema.
+
+A text moved into its compressed *_z column keeps its index entries: the SQLite
+triggers skip rows with a compressed text, the Postgres one keeps that text's
+lexemes. SQL can't decompress, so texts that are compressed already when this runs
+are indexed from Python.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLE = "whatsapp_chat_chatmessage"
+FTS_TABLE = f"{TABLE}_fts"
+UNCOMPRESSED = "{row}.user_text_z IS NULL AND {row}.response_text_z IS NULL"
+
+SQLITE = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            user_text, response_text,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(2.0, 1.0)')",  # user_text weighs double
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, user_text, response_text)
+            VALUES (new.id, new.user_text, new.response_text);
+        END""",
+    # A contentless 'delete' needs the indexed values, which a compressed row no longer
+    # has in SQL; its entries stay behind, but search joins the table and ids aren't reused.
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {TABLE}
+        WHEN {UNCOMPRESSED.format(row="old")} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_text, response_text)
+            VALUES ('delete', old.id, old.user_text, old.response_text);
+        END""",
+    # Only text edits touch the index; status callbacks update other columns. Edits
+    # of compressed rows are refused by the model, and compressing nulls a text whose
+    # *_z column is already set, so the entries stay.
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF user_text, response_text ON {TABLE}
+        WHEN {UNCOMPRESSED.format(row="old")} AND {UNCOMPRESSED.format(row="new")} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, user_text, response_text)
+            VALUES ('delete', old.id, old.user_text, old.response_text);
+            INSERT INTO {FTS_TABLE}(rowid, user_text, response_text)
+            VALUES (new.id, new.user_text, new.response_text);
+        END""",
+    f"""INSERT INTO {FTS_TABLE}(rowid, user_text, response_text)
+        SELECT id, user_text, response_text FROM {TABLE} WHERE {UNCOMPRESSED.format(row=TABLE)}""",
+]
+SQLITE_REVERSE = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+SQLITE_INDEX = f"INSERT INTO {FTS_TABLE}(rowid, user_text, response_text) VALUES (%s, %s, %s)"
+
+POSTGRES = [
+    f"ALTER TABLE {TABLE} ADD COLUMN search_vector tsvector",
+    f"""CREATE FUNCTION {TABLE}_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.search_vector :=
+                CASE WHEN TG_OP = 'UPDATE' AND NEW.user_text IS NULL AND NEW.user_text_z IS NOT NULL
+                     THEN coalesce(ts_filter(OLD.search_vector, '{{a}}'), ''::tsvector)
+                     ELSE setweight(to_tsvector('simple', coalesce(NEW.user_text, '')), 'A') END ||
+                CASE WHEN TG_OP = 'UPDATE' AND NEW.response_text IS NULL AND NEW.response_text_z IS NOT NULL
+                     THEN coalesce(ts_filter(OLD.search_vector, '{{b}}'), ''::tsvector)
+                     ELSE setweight(to_tsvector('simple', coalesce(NEW.response_text, '')), 'B') END;
+            RETURN NEW;
+        END $$""",
+    f"""CREATE TRIGGER {TABLE}_search BEFORE INSERT OR UPDATE OF user_text, response_text, user_text_z, response_text_z
+        ON {TABLE} FOR EACH ROW EXECUTE FUNCTION {TABLE}_search_vector()""",
+    f"UPDATE {TABLE} SET user_text = user_text WHERE {UNCOMPRESSED.format(row=TABLE)}",
+    f"CREATE INDEX {TABLE}_search_gin ON {TABLE} USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    f"DROP INDEX IF EXISTS {TABLE}_search_gin",
+    f"DROP TRIGGER IF EXISTS {TABLE}_search ON {TABLE}",
+    f"DROP FUNCTION IF EXISTS {TABLE}_search_vector()",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+POSTGRES_INDEX = (f"UPDATE {TABLE} SET search_vector = setweight(to_tsvector('simple', %s), 'A') || "
+                  f"setweight(to_tsvector('simple', %s), 'B') WHERE id = %s")
+
+
+def _sqlite_has_fts5(connection):
+    with connection.cursor() as cur:
+        cur.execute("PRAGMA compile_options")
+        return any(row[0] == "ENABLE_FTS5" for row in cur.fetchall())
+
+
+def _vendor(connection):
+    if connection.vendor == "sqlite":
+        return "sqlite" if _sqlite_has_fts5(connection) else None
+    return "postgresql" if connection.vendor == "postgresql" else None
+
+
+def _compressed_texts(apps, using):
+    """(id, user_text, response_text) of rows with a compressed text, decompressed."""
+    ChatMessage = apps.get_model("whatsapp_chat", "ChatMessage")
+    rows = (ChatMessage.objects.using(using)
+            .filter(models.Q(user_text_z__isnull=False) | models.Q(response_text_z__isnull=False))
+            .values_list("id", "user_text", "user_text_z", "response_text", "response_text_z")
+            .iterator())
+    unzstd = None
+    for pk, user_text, user_text_z, response_text, response_text_z in rows:
+        if unzstd is None:
+            import zstandard  # only there if texts were compressed
+
+            unzstd = zstandard.ZstdDecompressor()
+        texts = [t if z is None else unzstd.decompress(bytes(z)).decode("utf-8")
+                 for t, z in ((user_text, user_text_z), (response_text, response_text_z))]
+        yield pk, *texts
+
+
+def forwards(apps, schema_editor):
+    connection = schema_editor.connection
+    vendor = _vendor(connection)
+    if vendor is None:
+        return
+    for sql in SQLITE if vendor == "sqlite" else POSTGRES:
+        schema_editor.execute(sql, params=None)
+    with connection.cursor() as cur:
+        for pk, user_text, response_text in _compressed_texts(apps, connection.alias):
+            if vendor == "sqlite":
+                cur.execute(SQLITE_INDEX, [pk, user_text, response_text])
+            else:
+                cur.execute(POSTGRES_INDEX, [user_text or "", response_text or "", pk])
+
+
+def backwards(apps, schema_editor):
+    vendor = _vendor(schema_editor.connection)
+    if vendor is None:
+        return
+    for sql in SQLITE_REVERSE if vendor == "sqlite" else POSTGRES_REVERSE:
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0007_inbound_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+        migrations.CreateModel(
+            name='MessageSearchIndex',
+            fields=[
+                ('message', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='whatsapp_chat.chatmessage')),
+                ('document', models.TextField(db_column='whatsapp_chat_chatmessage_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'whatsapp_chat_chatmessage_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp_chat', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outboundmessage',
+            index=models.Index(fields=['to_phone', 'status', 'id'], name='whatsapp_ch_to_phon_b937d0_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:04
+
+from django.db import migrations, models
+
+from whatsapp_chat.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('whatsapp_chat', '0009_outbox_phone_order'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['to_phone_ref'], name='chatmessage_to_phone_ref'),
+        ),
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['channel_metadata_ref'], name='chatmessage_channel_meta'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:10
+
+from django.db import migrations, models
+
+from whatsapp_chat.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('whatsapp_chat', '0010_compact_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['delivery_status_ref'], name='chatmessage_delivery_status'),
+        ),
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['sms_status_ref'], name='chatmessage_sms_status'),
+        ),
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['model_name_ref'], name='chatmessage_model_name'),
+        ),
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=models.Index(fields=['finish_reason_ref'], name='chatmessage_finish_reason'),
+        ),
+    ]
@@ -1,41 +1,202 @@
 # whatsapp_chat/models.py
 from django.db import models
+from django.utils import timezone
+
+from .compact import CompressibleTextField, LegacyCharField, LegacyJSONField, LookupField
+
+
+class Lookup(models.Model):
+    """Interned strings behind ChatMessage's LookupFields (see compact.py)."""
+    id = models.SmallAutoField(primary_key=True)
+    value = models.CharField(max_length=128, unique=True)
+
+    def __str__(self):
+        return self.value
+
+
+class ChannelMetadata(models.Model):
+    """Each distinct Twilio ChannelMetadata payload, stored once."""
+    digest = models.CharField(max_length=64, unique=True)  # sha256 of the canonical JSON
+    data = models.JSONField()
+
+    def __str__(self):
+        return self.digest[:12]
 
 
 class ChatMessage(models.Model):
     # Inbound (from Twilio webhook)
     message_sid = models.CharField(max_length=64, db_index=True)
-    account_sid = models.CharField(max_length=64, blank=True, null=True)
-    sms_status = models.CharField(max_length=32, blank=True, null=True)
-    message_type = models.CharField(max_length=32, blank=True, null=True)
+    account_sid_ref = LookupField(blank=True, null=True, verbose_name="account sid")
+    sms_status_ref = LookupField(blank=True, null=True, verbose_name="sms status")
+    message_type_ref = LookupField(blank=True, null=True, verbose_name="message type")
     num_media = models.IntegerField(default=0)
     num_segments = models.IntegerField(default=1)
     wa_id = models.CharField(max_length=32, blank=True, null=True)
     profile_name = models.CharField(max_length=128, blank=True, null=True)
-    api_version = models.CharField(max_length=16, blank=True, null=True)
-    channel_metadata = models.JSONField(blank=True, null=True)
+    api_version_ref = LookupField(blank=True, null=True, verbose_name="api version")
+    channel_metadata_ref = models.ForeignKey(ChannelMetadata, on_delete=models.PROTECT, blank=True, null=True,
+                                             db_index=False, related_name="+", verbose_name="channel metadata")
 
     # Phones & text
     from_phone = models.CharField(max_length=32, db_index=True)  # whatsapp:+91...
-    to_phone = models.CharField(max_length=32, db_index=True)
-    user_text = models.TextField(blank=True, null=True)
+    to_phone_ref = LookupField(blank=True, null=True, verbose_name="to phone")
+    # long texts of old rows may be archived zstd-compressed in *_z (CHATMESSAGE_COMPRESS_AFTER_DAYS)
+    user_text = CompressibleTextField(blank=True, null=True, compact="user_text_z")
+    user_text_z = models.BinaryField(blank=True, null=True)
 
     # Gemini output + metrics
-    response_text = models.TextField(blank=True, null=True)
-    model_name = models.CharField(max_length=64, default="gemini-1.5-flash")
+    response_text = CompressibleTextField(blank=True, null=True, compact="response_text_z")
+    response_text_z = models.BinaryField(blank=True, null=True)
+    model_name_ref = LookupField(blank=True, null=True, verbose_name="model name")
     temperature = models.FloatField(default=0.2)
     latency_ms = models.IntegerField(default=0)
+    # nullable with a constant database default, so SQLite adds them with ALTER TABLE ADD COLUMN
+    # instead of rebuilding the table (an int db_default isn't taken as constant there, a Value is)
+    prompt_tokens = models.IntegerField(null=True, db_default=models.Value(0))
+    completion_tokens = models.IntegerField(null=True, db_default=models.Value(0))
+    finish_reason_ref = LookupField(blank=True, null=True, verbose_name="finish reason")  # stop / length (hit MAX_TOKENS) / ...
+    cost_usd = models.FloatField(null=True, db_default=models.Value(0))
 
     # Outbound send (REST API)
     outbound_message_sid = models.CharField(max_length=64, blank=True, null=True, db_index=True)
-    delivery_status = models.CharField(max_length=32, blank=True, null=True)  # queued/sent/delivered/failed
+    delivery_status_ref = LookupField(blank=True, null=True, verbose_name="delivery status")  # queued/sent/delivered/failed
     delivery_error_code = models.CharField(max_length=32, blank=True, null=True)
     delivery_error_message = models.TextField(blank=True, null=True)
 
+    # W3C traceparent of the inbound request (only when TRACING_ENABLED), links status callbacks back to it
+    trace_parent = models.CharField(max_length=55, blank=True, null=True)
+
+    # Legacy wide columns. Reading them returns the *_ref value; new rows leave them empty
+    # and `manage.py compact_messages` empties old ones. Write and filter the *_ref fields.
+    account_sid = LegacyCharField(max_length=64, blank=True, null=True, editable=False, compact="account_sid_ref")
+    sms_status = LegacyCharField(max_length=32, blank=True, null=True, editable=False, compact="sms_status_ref")
+    message_type = LegacyCharField(max_length=32, blank=True, null=True, editable=False,
+                                   compact="message_type_ref")
+    api_version = LegacyCharField(max_length=16, blank=True, null=True, editable=False, compact="api_version_ref")
+    channel_metadata = LegacyJSONField(blank=True, null=True, editable=False, compact="channel_metadata_ref_id")
+    to_phone = LegacyCharField(max_length=32, db_index=True, editable=False, compact="to_phone_ref")
+    model_name = LegacyCharField(max_length=64, default="gemini-1.5-flash", editable=False,
+                                 compact="model_name_ref")
+    finish_reason = LegacyCharField(max_length=32, blank=True, null=True, editable=False,
+                                    compact="finish_reason_ref")
+    delivery_status = LegacyCharField(max_length=32, blank=True, null=True, editable=False,
+                                      compact="delivery_status_ref")
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # newest-first listing (admin adds -pk as tie-breaker) and the admin date_hierarchy
+            models.Index(fields=["created_at", "id"], name="chatmessage_created_id"),
+            # built CONCURRENTLY on Postgres by migration 0010
+            models.Index(fields=["to_phone_ref"], name="chatmessage_to_phone_ref"),
+            models.Index(fields=["channel_metadata_ref"], name="chatmessage_channel_meta"),
+            # the admin's list filter choices probe these (compact.lookup_choices), by migration 0011
+            models.Index(fields=["delivery_status_ref"], name="chatmessage_delivery_status"),
+            models.Index(fields=["sms_status_ref"], name="chatmessage_sms_status"),
+            models.Index(fields=["model_name_ref"], name="chatmessage_model_name"),
+            models.Index(fields=["finish_reason_ref"], name="chatmessage_finish_reason"),
+        ]
 
     def __str__(self):
         return f"{self.from_phone} → {self.to_phone} | {self.created_at:%Y-%m-%d %H:%M}"
+
+
+class MessageSearchIndex(models.Model):
+    """
+    The SQLite FTS5 index over ChatMessage texts (created by migration 0008), mapped
+    read-only so search.py can join it; no table on other backends. It is contentless:
+    its columns read as NULL, only the MATCH and rank are used.
+    """
+    message = models.OneToOneField(ChatMessage, primary_key=True, db_column="rowid", db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name="search_index")
+    # FTS5's hidden column named after the table: the left side of MATCH
+    document = models.TextField(db_column="whatsapp_chat_chatmessage_fts")
+    rank = models.FloatField()  # bm25(2.0, 1.0), lower is better
+
+    class Meta:
+        managed = False
+        db_table = "whatsapp_chat_chatmessage_fts"
+
+
+class OutboundMessage(models.Model):
+    """Transactional outbox: a reply waiting to be (re)sent through Twilio."""
+    PENDING, SENT, DEAD = "pending", "sent", "dead"
+    STATUS_CHOICES = [(PENDING, "pending"), (SENT, "sent"), (DEAD, "dead")]
+
+    chat_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name="outbox",
+                                     blank=True, null=True)
+    to_phone = models.CharField(max_length=32)
+    body = models.TextField(blank=True, null=True)
+    media_url = models.URLField(max_length=500, blank=True, null=True)
+    status_callback = models.URLField(max_length=500, blank=True, null=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sid = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    last_error_code = models.CharField(max_length=32, blank=True, null=True)
+    last_error_message = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),  # dispatcher's "due" query
+            models.Index(fields=["to_phone", "status", "id"]),   # "anything earlier to this number unsent?"
+        ]
+
+    def __str__(self):
+        return f"{self.to_phone} | {self.status} ({self.attempts} attempts)"
+
+
+class InboundMessage(models.Model):
+    """
+    A webhook message waiting for its reply when INBOUND_SHARDED is on (see shards.py).
+    Messages of one conversation are answered strictly in id order; `slot` decides
+    which process_inbound worker owns the conversation.
+    """
+    PENDING, PROCESSING, DONE, FAILED = "pending", "processing", "done", "failed"
+    STATUS_CHOICES = [(PENDING, "pending"), (PROCESSING, "processing"), (DONE, "done"), (FAILED, "failed")]
+
+    conversation = models.CharField(max_length=32)       # wa_id, or from_phone without one
+    slot = models.SmallIntegerField()                    # hash(conversation) % INBOUND_SLOTS
+    payload = models.JSONField()                         # Twilio's form fields, as received
+    status_callback = models.URLField(max_length=500, blank=True, null=True)
+    trace_parent = models.CharField(max_length=55, blank=True, null=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # while processing: end of the lease
+    worker = models.CharField(max_length=64, blank=True, null=True)
+    token = models.CharField(max_length=32, blank=True, null=True)  # current claim; a stale worker can't finish
+    last_error = models.TextField(blank=True, null=True)
+    chat_message = models.ForeignKey(ChatMessage, on_delete=models.SET_NULL, related_name="+",
+                                     blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["slot", "status", "next_attempt_at"]),  # a worker's claim query
+            models.Index(fields=["conversation", "status", "id"]),       # "anything earlier still open?"
+        ]
+
+    def __str__(self):
+        return f"{self.conversation} #{self.pk} | {self.status}"
+
+
+class ShardMember(models.Model):
+    """A live process_inbound worker; rows whose heartbeat is older than SHARD_MEMBER_TTL are ignored."""
+    name = models.CharField(max_length=64, unique=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
@@ -1,7 +1,9 @@
 # whatsapp_chat/openai_client.py
+import threading
 import time
 from django.conf import settings
-from openai import OpenAI
+
+from .usage import cost_usd, trim_to_budget
 
 # Read from Django settings with sane defaults
 OPENAI_API_KEY = getattr(settings, "OPENAI_API_KEY", None)
@@ -14,22 +16,46 @@ You are Atom.Ai (a WhatsApp assistant). Reply with a SHORT, precise answer.
 Prefer bullet points when listing. Avoid long preambles.
 """
 
-# Single client reused per process
-_client = OpenAI(api_key=OPENAI_API_KEY)
+# Single client reused per process, built on first use: importing `openai` alone
+# costs ~1s, which every worker and management command would otherwise pay.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
 
-def ask_openai(user_text: str):
+def reset_client():
+    """Drop the client (e.g. after fork) so each worker opens its own connection pool."""
+    global _client
+    _client = None
+
+
+def ask_openai(user_text: str, model=None, temperature=None, max_tokens=None, system=None):
     """
-    Returns (reply_text, latency_ms)
+    Returns (reply_text, latency_ms, usage)
+    usage = {"prompt_tokens", "completion_tokens", "finish_reason", "cost_usd"}
+    The keyword arguments override the settings (used by `replay_messages`).
     """
-    text_in = (user_text or "").strip() or "Hello"
+    model = model or MODEL_NAME
+    text_in = trim_to_budget((user_text or "").strip() or "Hello")
+    from .knowledge import with_knowledge  # numpy stays out of startup (see bench_startup)
+    system = with_knowledge((system or SYSTEM_INSTRUCTIONS).strip(), text_in)
 
     start = time.monotonic()
-    resp = _client.chat.completions.create(
-        model=MODEL_NAME,
-        temperature=TEMPERATURE,
-        max_tokens=MAX_TOKENS,
+    resp = get_client().chat.completions.create(
+        model=model,
+        temperature=TEMPERATURE if temperature is None else temperature,
+        max_tokens=max_tokens or MAX_TOKENS,
         messages=[
-            {"role": "system", "content": SYSTEM_INSTRUCTIONS.strip()},
+            {"role": "system", "content": system},
             {"role": "user",   "content": text_in},
         ],
     )
@@ -41,4 +67,13 @@ def ask_openai(user_text: str):
         reply = resp.choices[0].message.content.strip()
 
     reply = reply or "Sorry, I couldn't generate a response."
-    return reply, latency_ms
+
+    prompt_tokens = getattr(resp.usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(resp.usage, "completion_tokens", 0) or 0
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "finish_reason": resp.choices[0].finish_reason if resp.choices else None,
+        "cost_usd": cost_usd(model, prompt_tokens, completion_tokens),
+    }
+    return reply, latency_ms, usage
@@ -0,0 +1,216 @@
+# whatsapp_chat/outbox.py
+"""
+Outbound outbox: replies are committed together with their ChatMessage and then
+sent through Twilio. Anything that fails with a retryable error is retried with
+exponential backoff by `python manage.py dispatch_outbox`; permanent failures
+(and rows out of attempts) end up as status="dead" (the dead-letter list).
+
+Replies to one number go out in the order they were queued: a row is only sent
+once no earlier row to the same number is still pending, so a retry holds back
+the replies behind it (a dead-lettered one stops holding them).
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import tracing, twilio_client
+from .models import ChatMessage, OutboundMessage
+
+MAX_ATTEMPTS = int(getattr(settings, "OUTBOX_MAX_ATTEMPTS", 6))
+BACKOFF_BASE = float(getattr(settings, "OUTBOX_BACKOFF_BASE", 5.0))     # seconds, doubled per attempt
+BACKOFF_MAX = float(getattr(settings, "OUTBOX_BACKOFF_MAX", 15 * 60.0))
+LEASE_SECONDS = float(getattr(settings, "OUTBOX_LEASE_SECONDS", 60.0))  # claimed rows are hidden this long
+BATCH_SIZE = int(getattr(settings, "OUTBOX_BATCH_SIZE", 50))
+CONCURRENCY = int(getattr(settings, "OUTBOX_CONCURRENCY", 4))
+
+# Twilio REST error codes that will never succeed on retry
+# https://www.twilio.com/docs/api/errors
+PERMANENT_API_CODES = {
+    20003,  # authentication failed
+    21211,  # invalid 'To' number
+    21408,  # permission to send to this region not enabled
+    21606,  # 'From' number not capable of sending
+    21610,  # recipient unsubscribed (STOP)
+    21614,  # 'To' is not a valid mobile number
+    63016,  # outside the WhatsApp 24h session window (needs a template)
+}
+# Delivery error codes (status callback ErrorCode) worth retrying
+RETRYABLE_DELIVERY_CODES = {
+    "30001",  # queue overflow
+    "30003",  # unreachable destination handset
+    "30008",  # unknown error
+    "30009",  # missing segment
+    "63018",  # rate limit exceeded for the WhatsApp sender
+}
+
+
+def is_retryable(exc) -> bool:
+    """Network errors, throttling and 5xx are retryable; other 4xx are not."""
+    status = getattr(exc, "status", None)
+    code = getattr(exc, "code", None)
+    if code in PERMANENT_API_CODES:
+        return False
+    if status is None:  # connection reset, timeout, DNS...
+        return True
+    return status == 429 or status >= 500 or code == 20429
+
+
+def backoff(attempts, base=None):
+    """Exponential backoff with jitter: ~base, 2*base, 4*base ... capped at BACKOFF_MAX."""
+    base = BACKOFF_BASE if base is None else base
+    delay = min(BACKOFF_MAX, base * 2 ** max(0, attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def enqueue(to_phone, body=None, media_url=None, status_callback=None, chat_message=None, deliver_now=False):
+    """
+    Call inside the same transaction.atomic() that writes the ChatMessage.
+    deliver_now=True: the caller will deliver() it itself, so the row starts out
+    leased and the dispatcher only picks it up if that attempt never happens.
+    """
+    now = timezone.now()
+    return OutboundMessage.objects.create(
+        chat_message=chat_message,
+        to_phone=to_phone,
+        body=body,
+        media_url=media_url,
+        status_callback=status_callback,
+        next_attempt_at=now + timedelta(seconds=LEASE_SECONDS) if deliver_now else now,
+    )
+
+
+def _send(row, client):
+    """Network only (safe to run in worker threads). -> (sid, exception)"""
+    with tracing.span("twilio.send", {"outbox.id": row.pk, "outbox.attempt": row.attempts + 1}) as sp:
+        try:
+            msg = client.messages.create(
+                from_=settings.WHATSAPP_FROM,
+                to=row.to_phone,
+                body=row.body or None,
+                media_url=[row.media_url] if row.media_url else None,
+                status_callback=row.status_callback or None,
+            )
+        except Exception as e:
+            return None, e
+        sp.set_attribute("messaging.outbound.id", msg.sid)
+        return msg.sid, None
+
+
+def _record(row, sid, exc, backoff_base=None):
+    """Persist the outcome of one attempt on the outbox row and its ChatMessage."""
+    row.attempts += 1
+    cm_update = {}
+    if exc is None:
+        row.status, row.sid = OutboundMessage.SENT, sid
+        row.last_error_code = row.last_error_message = None
+        cm_update = {"outbound_message_sid": sid, "delivery_status_ref": "queued"}
+    else:
+        row.last_error_code = str(getattr(exc, "code", "") or "") or None
+        row.last_error_message = f"{type(exc).__name__}: {exc}"
+        if is_retryable(exc) and row.attempts < MAX_ATTEMPTS:
+            row.status = OutboundMessage.PENDING
+            row.next_attempt_at = timezone.now() + backoff(row.attempts, backoff_base)
+            cm_update = {"delivery_status_ref": "retrying"}
+        else:
+            row.status = OutboundMessage.DEAD
+            cm_update = {"delivery_status_ref": "failed"}
+        cm_update["delivery_error_code"] = row.last_error_code
+        cm_update["delivery_error_message"] = row.last_error_message
+
+    row.save(update_fields=["status", "sid", "attempts", "next_attempt_at",
+                            "last_error_code", "last_error_message", "updated_at"])
+    if row.chat_message_id and cm_update:
+        ChatMessage.objects.filter(pk=row.chat_message_id).update(**cm_update)
+    return row
+
+
+def deliver(row, client=None, backoff_base=None):
+    """
+    Send one outbox row right away (webhook fast path); failures stay queued. If an
+    earlier reply to the same number is still pending the row is left to the
+    dispatcher (due now), which sends it after that one.
+    """
+    if OutboundMessage.objects.filter(to_phone=row.to_phone, status=OutboundMessage.PENDING,
+                                      pk__lt=row.pk).exists():
+        OutboundMessage.objects.filter(pk=row.pk, status=OutboundMessage.PENDING).update(
+            next_attempt_at=timezone.now())
+        return row
+    sid, exc = _send(row, client or twilio_client.get_client())
+    return _record(row, sid, exc, backoff_base)
+
+
+def _due(now):
+    """Pending, not leased (or lease expired), and the oldest pending row to its number."""
+    earlier = OutboundMessage.objects.filter(
+        to_phone=OuterRef("to_phone"), status=OutboundMessage.PENDING, pk__lt=OuterRef("pk"))
+    return Q(status=OutboundMessage.PENDING, next_attempt_at__lte=now) & ~Exists(earlier)
+
+
+def claim_due(batch_size=BATCH_SIZE):
+    """
+    Claim up to `batch_size` due rows, at most one per number. Claimed rows get their
+    next_attempt_at pushed out by LEASE_SECONDS, so concurrent dispatchers skip them:
+    the claim is one conditional UPDATE that re-checks the rows (like shards.claim),
+    so no transaction has to read before it writes.
+    """
+    now = timezone.now()
+    pks = list(OutboundMessage.objects.filter(_due(now)).order_by("next_attempt_at")
+               .values_list("pk", flat=True)[:batch_size])
+    if not pks:
+        return []
+    leased_until = now + timedelta(seconds=LEASE_SECONDS)
+    OutboundMessage.objects.filter(_due(now), pk__in=pks).update(next_attempt_at=leased_until)
+    return list(OutboundMessage.objects.filter(pk__in=pks, next_attempt_at=leased_until).order_by("pk"))
+
+
+def dispatch_batch(batch_size=BATCH_SIZE, client=None, concurrency=CONCURRENCY, backoff_base=None):
+    """
+    Claim and send one batch. Twilio calls run on a small thread pool; DB writes stay
+    on the calling thread. Returns {"sent", "retrying", "dead"} counts.
+    """
+    rows = claim_due(batch_size)
+    counts = {"sent": 0, "retrying": 0, "dead": 0}
+    if not rows:
+        return counts
+
+    client = client or twilio_client.get_client()
+    if concurrency > 1 and len(rows) > 1:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(rows))) as pool:
+            results = list(pool.map(lambda r: _send(r, client), rows))
+    else:
+        results = [_send(r, client) for r in rows]
+
+    for row, (sid, exc) in zip(rows, results):
+        _record(row, sid, exc, backoff_base)
+        counts["sent" if row.status == OutboundMessage.SENT else
+               "retrying" if row.status == OutboundMessage.PENDING else "dead"] += 1
+    return counts
+
+
+def retry_from_status(outbound_sid, error_code):
+    """
+    Status callback reported a failed delivery. Requeue the outbox row when the
+    error is transient, otherwise dead-letter it. Returns the row (or None).
+    """
+    row = OutboundMessage.objects.filter(sid=outbound_sid).first()
+    if row is None:
+        return None
+    row.last_error_code = str(error_code or "") or None
+    row.last_error_message = f"delivery failed (ErrorCode {error_code})"
+    if row.last_error_code in RETRYABLE_DELIVERY_CODES and row.attempts < MAX_ATTEMPTS:
+        row.status = OutboundMessage.PENDING
+        row.next_attempt_at = timezone.now() + backoff(row.attempts)
+    else:
+        row.status = OutboundMessage.DEAD
+    row.save(update_fields=["status", "next_attempt_at", "last_error_code", "last_error_message", "updated_at"])
+    return row
+
+
+def requeue(queryset):
+    """Manual retry of dead-lettered rows (admin action / API)."""
+    return queryset.filter(status=OutboundMessage.DEAD).update(
+        status=OutboundMessage.PENDING, next_attempt_at=timezone.now(), attempts=0)
@@ -0,0 +1,40 @@
+# whatsapp_chat/preload.py
+"""
+Warm imports for `gunicorn --preload` (see gunicorn.conf.py).
+
+Provider SDKs are imported lazily, so a plain process never pays for them.
+Under --preload we import them once in the master instead: forked workers then
+share those pages copy-on-write, and the first webhook in each worker is fast.
+Clients (sockets, connection pools) are NOT created here; each worker builds
+its own on first use.
+"""
+import importlib
+
+from django.conf import settings
+
+PRELOAD_MODULES = getattr(settings, "PRELOAD_MODULES", [
+    "openai",
+    "twilio.rest",
+    "numpy",
+    "whatsapp_chat.knowledge",
+    "whatsapp_chat.views",
+    "whatsapp_chat.urls",
+])
+
+
+def preload():
+    loaded = []
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            pass  # optional provider not installed
+    return loaded
+
+
+def reset_after_fork():
+    """Per-worker state that must not be inherited from the master."""
+    from . import openai_client, twilio_client
+    openai_client.reset_client()
+    twilio_client.reset_client()
@@ -0,0 +1,255 @@
+# whatsapp_chat/ratelimit.py
+"""
+Admission control for the webhook.
+
+1) SenderRateLimiter: token bucket per sender (wa_id / from_phone), kept in-process,
+   optionally backed by a shared Django cache so all workers see the same budget.
+2) FairGate: caps concurrent LLM calls; waiting requests are served round-robin
+   across senders so one chatty number can't starve everyone else. When the wait
+   queue is full, or every slot stays busy until the wait times out, the request is
+   shed. A sender's next message waiting only for that sender's own call to finish
+   (LLM_MAX_PER_SENDER) isn't shed: it waits for its turn, however long the call takes.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+
+RATE = float(getattr(settings, "RATE_LIMIT_RATE", 0.2))          # tokens/sec per sender (12/min)
+BURST = int(getattr(settings, "RATE_LIMIT_BURST", 5))            # bucket capacity
+SHARED_CACHE = getattr(settings, "RATE_LIMIT_CACHE", None)       # cache alias, e.g. "default"; None = in-process only
+MAX_SENDERS = int(getattr(settings, "RATE_LIMIT_MAX_SENDERS", 100_000))
+
+LLM_MAX_CONCURRENCY = int(getattr(settings, "LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_PER_SENDER = int(getattr(settings, "LLM_MAX_PER_SENDER", 1))
+LLM_MAX_WAITING = int(getattr(settings, "LLM_MAX_WAITING", 32))
+LLM_QUEUE_TIMEOUT = float(getattr(settings, "LLM_QUEUE_TIMEOUT", 5.0))  # seconds, while every slot is busy
+
+SHED_REPLY = getattr(
+    settings, "LLM_SHED_REPLY",
+    "We're receiving a lot of messages right now. Please try again in a minute.",
+)
+
+# admitted / limited / shed (/ queued), exposed on /health; sender_waits counts requests
+# that had to wait for their own sender's earlier call while slots were free
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _bump(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def snapshot():
+    with _stats_lock:
+        return dict(stats)
+
+
+class TokenBucket:
+    """Token bucket refilled lazily on access. Not thread-safe on its own."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, n=1, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+
+class SenderRateLimiter:
+    """
+    Per-sender token buckets. The in-process bucket rejects floods without any I/O;
+    the shared cache (if configured) enforces the same budget across workers.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, cache_alias=SHARED_CACHE, max_senders=MAX_SENDERS):
+        self.rate, self.burst = rate, burst
+        self.cache_alias = cache_alias
+        self.max_senders = max_senders
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, sender: str) -> bool:
+        if self.rate <= 0 or not sender:
+            return True
+
+        with self._lock:
+            bucket = self._buckets.get(sender)
+            if bucket is None:
+                bucket = self._buckets[sender] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_senders:
+                    self._buckets.popitem(last=False)  # forget the least recently seen sender
+            else:
+                self._buckets.move_to_end(sender)
+            ok = bucket.take()
+
+        if ok and self.cache_alias:
+            ok = self._allow_shared(sender)
+        return ok
+
+    def _allow_shared(self, sender):
+        # Fixed window of one bucket refill (burst / rate seconds) admitting `burst`, so
+        # across workers a sender gets the bucket's long-run rate; only at a window edge
+        # can two windows' worth (2 x burst) land back to back.
+        # add()+incr() is atomic on memcached/redis/db caches, no read-modify-write race.
+        window = max(1, int(self.burst / self.rate))
+        key = f"rl:{sender}:{int(time.time() // window)}"
+        cache = caches[self.cache_alias]
+        cache.add(key, 0, timeout=window * 2)
+        try:
+            return cache.incr(key) <= self.burst
+        except ValueError:  # evicted between add and incr
+            return True
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class FairGate:
+    """
+    Counting semaphore with round-robin hand-off across senders, at most `per_sender`
+    slots per sender. acquire() returns False when the request should be shed.
+    """
+
+    def __init__(self, slots=LLM_MAX_CONCURRENCY, per_sender=LLM_MAX_PER_SENDER,
+                 max_waiting=LLM_MAX_WAITING, timeout=LLM_QUEUE_TIMEOUT):
+        self.slots, self.per_sender = slots, per_sender
+        self.max_waiting, self.timeout = max_waiting, timeout
+        self._cond = threading.Condition()
+        self._free = slots
+        self._inflight = Counter()
+        self._queues = OrderedDict()  # sender -> deque of tickets, rotated on every grant
+        self._waiting = 0
+        self._granted = set()
+
+    def acquire(self, sender: str, timeout=None) -> bool:
+        """
+        False (shed) when the wait queue is full or `timeout` runs out with every slot
+        busy. Past the timeout with slots free, only the sender's own calls hold the
+        request back, so it keeps waiting for one of them to finish.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if self._free > 0 and not self._waiting and self._inflight[sender] < self.per_sender:
+                self._take(sender)
+                return True
+            if self._waiting >= self.max_waiting:
+                return False
+            if self._free > 0 and self._inflight[sender] >= self.per_sender:
+                _bump("sender_waits")
+
+            ticket = object()
+            self._queues.setdefault(sender, deque()).append(ticket)
+            self._waiting += 1
+            self._dispatch()
+
+            deadline = time.monotonic() + timeout
+            while ticket not in self._granted:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                elif self._free == 0:
+                    self._abandon(sender, ticket)
+                    return False
+                else:  # _dispatch() left a slot free: only the per-sender cap holds this one back
+                    self._cond.wait()
+            self._granted.discard(ticket)
+            return True
+
+    def release(self, sender: str):
+        with self._cond:
+            self._free += 1
+            self._inflight[sender] -= 1
+            if self._inflight[sender] <= 0:
+                del self._inflight[sender]
+            self._dispatch()
+
+    def _take(self, sender):
+        self._free -= 1
+        self._inflight[sender] += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiting senders, one ticket per sender per round."""
+        granted = False
+        while self._free > 0 and self._queues:
+            for sender in list(self._queues):
+                if self._inflight[sender] < self.per_sender:
+                    break
+            else:
+                break  # everyone waiting is already at their per-sender cap
+
+            queue = self._queues.pop(sender)
+            ticket = queue.popleft()
+            if queue:
+                self._queues[sender] = queue  # re-append = back of the rotation
+            self._waiting -= 1
+            self._take(sender)
+            self._granted.add(ticket)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _abandon(self, sender, ticket):
+        if ticket in self._granted:  # granted right as we timed out: give it back
+            self._granted.discard(ticket)
+            self._free += 1
+            self._inflight[sender] -= 1
+            if self._inflight[sender] <= 0:
+                del self._inflight[sender]
+            self._dispatch()
+            return
+        queue = self._queues.get(sender)
+        if queue is not None:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[sender]
+        self._waiting -= 1
+
+
+# Process-wide instances used by the webhook
+limiter = SenderRateLimiter()
+gate = FairGate()
+
+
+def admit(sender: str):
+    """
+    Returns "ok", "limited" or "shed". On "ok" the caller MUST call done(sender).
+    """
+    if not limiter.allow(sender):
+        _bump("limited")
+        return "limited"
+    if not gate.acquire(sender):
+        _bump("shed")
+        return "shed"
+    _bump("admitted")
+    return "ok"
+
+
+def done(sender: str):
+    gate.release(sender)
+
+
+def allow(sender: str):
+    """
+    Rate limit only, for queued messages (INBOUND_SHARDED, see shards.py): their LLM
+    calls are bounded by the process_inbound workers, not by this process' gate.
+    Returns "ok" or "limited"; nothing to release.
+    """
+    if not limiter.allow(sender):
+        _bump("limited")
+        return "limited"
+    _bump("queued")
+    return "ok"
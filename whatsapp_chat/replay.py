@@ -0,0 +1,328 @@
+# whatsapp_chat/replay.py
+"""
+Offline replay of historical conversations through candidate LLM configs.
+
+Each ChatMessage.user_text is sent through every ReplayConfig on a bounded thread
+pool (each provider has one requests/sec budget, shared by its configs) and one
+JSON line per (message, config) is appended to the output file. The recorded production reply
+is written alongside as the "recorded" baseline. Re-running with the same output
+file skips pairs that already succeeded, so an interrupted run just resumes.
+
+    python manage.py replay_messages --limit 500 \\
+        --config name=mini-t0,provider=openai,model=gpt-4o-mini,temperature=0,rps=5 \\
+        --config name=flash,provider=gemini,model=gemini-1.5-flash,rps=2
+"""
+import json
+import random
+import statistics
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .ratelimit import TokenBucket
+from .usage import TRUNCATED_REASONS, cost_usd, estimate_tokens
+
+PROVIDERS = {
+    "openai": "whatsapp_chat.openai_client.ask_openai",
+    "gemini": "whatsapp_chat.gemini_client.ask_gemini",
+    "fake": "whatsapp_chat.replay.fake_llm",
+}
+DEFAULT_MODELS = {  # what each provider runs when a config gives no model
+    "openai": "whatsapp_chat.openai_client.MODEL_NAME",
+    "gemini": "whatsapp_chat.gemini_client.MODEL_NAME",
+    "fake": "whatsapp_chat.replay.FAKE_MODEL",
+}
+FAKE_MODEL = "fake"
+BASELINE = "recorded"
+
+# columns fetched per historical row; the wide JSON/error columns are never needed
+ROW_FIELDS = ("id", "user_text", "user_text_z", "response_text", "response_text_z", "latency_ms",
+              "prompt_tokens", "completion_tokens", "cost_usd",
+              "model_name_ref", "finish_reason_ref", "model_name", "finish_reason")  # + legacy twins, see compact.py
+
+
+def fake_llm(user_text, model=FAKE_MODEL, temperature=0.2, max_tokens=512, system=None,
+             latency_ms=300, error_rate=0.0):
+    """
+    Local stand-in with the ask_openai() signature: no network, deterministic for a
+    given (text, model, temperature), log-normal latency around `latency_ms`.
+    """
+    text = (user_text or "").strip() or "Hello"
+    rng = random.Random(zlib.crc32(f"{model}|{temperature}|{text}".encode("utf-8")))
+    delay = float(latency_ms) * rng.lognormvariate(0, 0.4) / 1000
+    time.sleep(delay)
+    if rng.random() < float(error_rate):
+        raise ConnectionError("fake provider: simulated timeout")
+
+    words = text.split()
+    n = int(rng.uniform(10, 60) * (1 + float(temperature)))
+    reply = " ".join(rng.choice(words) for _ in range(n))
+    completion = min(estimate_tokens(reply), int(max_tokens))
+    prompt = estimate_tokens(text) + estimate_tokens(system or "")
+    usage = {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "finish_reason": "length" if completion >= int(max_tokens) else "stop",
+        "cost_usd": cost_usd(model, prompt, completion),
+    }
+    return reply, int(delay * 1000), usage
+
+
+def _coerce(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+class ProviderLimit:
+    """A requests/sec budget for one provider, shared by its configs and all worker threads."""
+
+    def __init__(self, rps, burst=1):
+        self._bucket = TokenBucket(float(rps), int(burst))
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the budget admits one more call."""
+        while True:
+            with self._lock:
+                if self._bucket.take():
+                    return
+                wait_s = (1 - self._bucket.tokens) / self._bucket.rate
+            time.sleep(wait_s)
+
+
+def share_limits(configs):
+    """
+    Give the configs of each provider one ProviderLimit: they draw on the same API
+    account, so their rps add up. The lowest rps (and burst) given for a provider wins.
+    """
+    for provider in {c.provider for c in configs}:
+        group = [c for c in configs if c.provider == provider]
+        limited = [c for c in group if c.rps]
+        limit = ProviderLimit(min(c.rps for c in limited), min(c.burst for c in limited)) if limited else None
+        for config in group:
+            config.limit = limit
+
+
+class ReplayConfig:
+    """
+    One candidate: a provider function plus keyword overrides for it.
+    `rps`/`burst` throttle calls to the provider, see share_limits().
+    """
+
+    def __init__(self, name=None, provider="openai", rps=None, burst=1, **options):
+        if provider not in PROVIDERS:
+            raise ValueError(f"unknown provider {provider!r} (choose from {', '.join(PROVIDERS)})")
+        self.provider, self.options = provider, options
+        self.model = options.get("model") or import_string(DEFAULT_MODELS[provider])
+        self.name = name or f"{provider}:{self.model}"
+        if self.name == BASELINE:
+            raise ValueError(f"config name {BASELINE!r} is reserved for the recorded replies")
+        self.rps, self.burst = (float(rps) if rps else None), int(burst)
+        self.limit = ProviderLimit(self.rps, self.burst) if self.rps else None
+        self._call = import_string(PROVIDERS[provider])
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        "name=candidate,provider=openai,model=gpt-4o,temperature=0.5,rps=2,system=@prompts/v2.txt"
+        (`system=@path` reads the prompt from a file.)
+        """
+        options = {}
+        for part in filter(None, spec.split(",")):
+            key, sep, value = part.partition("=")
+            if not sep:
+                raise ValueError(f"expected key=value, got {part!r}")
+            key, value = key.strip(), value.strip()
+            if key == "system" and value.startswith("@"):
+                value = Path(value[1:]).read_text(encoding="utf-8")
+            options[key] = value if key in ("name", "provider", "model", "system") else _coerce(value)
+        return cls(**options)
+
+    def throttle(self):
+        """Block until the provider's rate limit admits one more call."""
+        if self.limit is not None:
+            self.limit.wait()
+
+    def __call__(self, user_text):
+        return self._call(user_text, **self.options)
+
+
+def baseline_record(row):
+    """The production reply already stored on the row, in replay-record shape."""
+    return {
+        "message_id": row.pk,
+        "config": BASELINE,
+        "model": row.model_name,
+        "latency_ms": row.latency_ms,
+        "queue_ms": 0,
+        "prompt_tokens": row.prompt_tokens,
+        "completion_tokens": row.completion_tokens,
+        "finish_reason": row.finish_reason,
+        "cost_usd": row.cost_usd,
+        "reply_chars": len(row.response_text or ""),
+        "reply": row.response_text,
+        "error": None,
+    }
+
+
+def _replay_one(config, row):
+    queued = time.perf_counter()
+    config.throttle()
+    queue_ms = int((time.perf_counter() - queued) * 1000)
+    record = {"message_id": row.pk, "config": config.name, "model": config.model, "queue_ms": queue_ms}
+    try:
+        reply, latency_ms, usage = config(row.user_text)
+    except Exception as e:  # keep going; errored pairs are retried on the next (resumed) run
+        record.update(latency_ms=None, error=f"{type(e).__name__}: {e}")
+        return record
+    record.update(latency_ms=latency_ms, reply_chars=len(reply), reply=reply, error=None, **usage)
+    return record
+
+
+def completed_pairs(path):
+    """(config, message_id) pairs already in `path` without an error."""
+    done = set()
+    if not Path(path).exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            if not rec.get("error"):
+                done.add((rec["config"], rec["message_id"]))
+    return done
+
+
+def replay(rows, configs, out_path, workers=8, baseline=True, on_record=None):
+    """
+    Stream `rows` (e.g. queryset.iterator()) through every config.
+    At most 2 * workers calls are in flight, so memory stays flat for any number of
+    rows; records are written from this thread only. Returns {"written", "skipped"}.
+    """
+    share_limits(configs)
+    done = completed_pairs(out_path)
+    counts = {"written": 0, "skipped": 0}
+    path = Path(out_path)
+    needs_newline = False
+    if path.exists() and path.stat().st_size:
+        with open(path, "rb") as f:
+            f.seek(-1, 2)
+            needs_newline = f.read(1) != b"\n"
+
+    with open(path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        if needs_newline:
+            out.write("\n")
+        stamp = timezone.now().isoformat()
+
+        def write(record):
+            record["replayed_at"] = stamp
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            counts["written"] += 1
+            if on_record:
+                on_record(record)
+
+        in_flight = set()
+        try:
+            for row in rows:
+                if baseline and (BASELINE, row.pk) not in done:
+                    write(baseline_record(row))
+                for config in configs:
+                    if (config.name, row.pk) in done:
+                        counts["skipped"] += 1
+                        continue
+                    if len(in_flight) >= 2 * workers:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            write(fut.result())
+                    in_flight.add(pool.submit(_replay_one, config, row))
+            for fut in in_flight:
+                write(fut.result())
+        except BaseException:
+            # Ctrl-C: drop queued work, keep what finished; the next run resumes from the file
+            pool.shutdown(wait=False, cancel_futures=True)
+            out.flush()
+            if hasattr(rows, "close"):
+                rows.close()  # release the server-side cursor while the connection is still open
+            raise
+    return counts
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(path):
+    """
+    Per-config latency percentiles, token usage, reply length and cost from a replay file.
+    A resumed run appends a new record for each pair that errored before; only the
+    latest record of each (config, message) counts.
+    """
+    latest = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            rec.pop("reply", None)  # not needed here; keeps memory down on big files
+            latest[rec["config"], rec["message_id"]] = rec
+
+    acc = {}
+    for rec in latest.values():
+        a = acc.setdefault(rec["config"], {"model": rec.get("model"), "n": 0, "errors": 0, "latency": [],
+                                           "prompt": 0, "completion": 0, "chars": [], "cost": 0.0,
+                                           "truncated": 0})
+        a["n"] += 1
+        if rec.get("error"):
+            a["errors"] += 1
+            continue
+        if rec.get("latency_ms") is not None:
+            a["latency"].append(rec["latency_ms"])
+        a["prompt"] += rec.get("prompt_tokens") or 0
+        a["completion"] += rec.get("completion_tokens") or 0
+        a["chars"].append(rec.get("reply_chars") or 0)
+        a["cost"] += rec.get("cost_usd") or 0.0
+        a["truncated"] += rec.get("finish_reason") in TRUNCATED_REASONS
+
+    report = []
+    for name, a in acc.items():
+        ok = a["n"] - a["errors"]
+        report.append({
+            "config": name,
+            "model": a["model"],
+            "replies": ok,
+            "errors": a["errors"],
+            "latency_p50_ms": _pct(a["latency"], 50),
+            "latency_p90_ms": _pct(a["latency"], 90),
+            "latency_p99_ms": _pct(a["latency"], 99),
+            "latency_mean_ms": round(statistics.fmean(a["latency"]), 1) if a["latency"] else None,
+            "avg_prompt_tokens": round(a["prompt"] / ok, 1) if ok else None,
+            "avg_completion_tokens": round(a["completion"] / ok, 1) if ok else None,
+            "reply_chars_p50": _pct(a["chars"], 50),
+            "reply_chars_mean": round(statistics.fmean(a["chars"]), 1) if a["chars"] else None,
+            "truncated_pct": round(100 * a["truncated"] / ok, 2) if ok else None,
+            "cost_usd": round(a["cost"], 6),
+        })
+    report.sort(key=lambda r: (r["config"] != BASELINE, r["config"]))
+    return report
+
+
+def to_parquet(jsonl_path, parquet_path):
+    """Columnar copy of a replay file for notebooks/BI tools (needs pyarrow)."""
+    import pyarrow.json as pj
+    import pyarrow.parquet as pq
+    pq.write_table(pj.read_json(str(jsonl_path)), str(parquet_path))
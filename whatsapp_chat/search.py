@@ -0,0 +1,125 @@
+# whatsapp_chat/search.py
+"""
+Full-text search over ChatMessage.user_text / response_text.
+
+SQLite: a contentless FTS5 table fed by triggers.
+Postgres: a tsvector column kept by a trigger, with a GIN index.
+Both are created by migration 0008_search_index. When compact_messages moves a
+text into its compressed column the triggers leave its index entries alone, so
+archived messages stay searchable (their texts are read-only, see compact.py).
+Other backends (or SQLite builds without FTS5) fall back to icontains.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, Lookup, Q
+from django.db.models.expressions import RawSQL
+
+from .models import ChatMessage, MessageSearchIndex
+
+TABLE = ChatMessage._meta.db_table
+FTS_TABLE = f"{TABLE}_fts"
+TSV_COLUMN = "search_vector"
+TSV_CONFIG = "simple"  # language agnostic; users write in many languages
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class _Match(Lookup):
+    """search_index__document__match=<fts5 query>"""
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+MessageSearchIndex._meta.get_field("document").register_lookup(_Match)
+
+# (alias, database name) -> bool, so we only hit sqlite_master / information_schema once per
+# process; keyed by name too because the test runner swaps the database under an alias
+_installed = {}
+
+
+def is_installed(using=DEFAULT_DB_ALIAS):
+    """True when the index for `using` exists (migration 0008) and can be queried."""
+    connection = connections[using]
+    key = (using, connection.settings_dict["NAME"])
+    if key in _installed:
+        return _installed[key]
+
+    ok = False
+    with connection.cursor() as cur:
+        if connection.vendor == "sqlite":
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [FTS_TABLE])
+            ok = cur.fetchone() is not None
+        elif connection.vendor == "postgresql":
+            cur.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_name=%s AND column_name=%s",
+                [TABLE, TSV_COLUMN],
+            )
+            ok = cur.fetchone() is not None
+    _installed[key] = ok
+    return ok
+
+
+def fts5_query(text: str) -> str:
+    """
+    Turn free user input into a safe FTS5 MATCH expression:
+    every word is quoted (AND-ed), the last one is a prefix match.
+    """
+    tokens = _TOKEN_RE.findall(text or "")
+    if not tokens:
+        return ""
+    parts = [f'"{t}"' for t in tokens]
+    parts[-1] += "*"
+    return " ".join(parts)
+
+
+def _fallback_q(text):
+    return Q(user_text__icontains=text) | Q(response_text__icontains=text)
+
+
+def matching_q(text: str, using=DEFAULT_DB_ALIAS) -> Q:
+    """A Q() selecting messages that match `text` (no ranking)."""
+    connection = connections[using]
+    if not is_installed(using):
+        return _fallback_q(text)
+
+    if connection.vendor == "sqlite":
+        match = fts5_query(text)
+        if not match:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+
+    return Q(pk__in=RawSQL(
+        f"SELECT id FROM {TABLE} WHERE {TSV_COLUMN} @@ websearch_to_tsquery('{TSV_CONFIG}', %s)",
+        [text],
+    ))
+
+
+def search(qs, text: str):
+    """
+    Filter `qs` to messages matching `text`, best matches first.
+    Adds a `search_rank` attribute (higher is better) when the index is available.
+    """
+    using = qs.db
+    connection = connections[using]
+    if not is_installed(using):
+        return qs.filter(_fallback_q(text))
+
+    if connection.vendor == "sqlite":
+        match = fts5_query(text)
+        if not match:
+            return qs.none()
+        # join the index (a pk__in subquery can't carry the rank); bm25 is "lower is better",
+        # negate so callers can always sort desc
+        return (qs.filter(search_index__document__match=match)
+                .annotate(search_rank=-F("search_index__rank"))
+                .order_by("-search_rank", "-created_at"))
+
+    rank = RawSQL(f"ts_rank_cd({TABLE}.{TSV_COLUMN}, websearch_to_tsquery('{TSV_CONFIG}', %s))", [text])
+    return (qs.filter(matching_q(text, using))
+            .annotate(search_rank=rank)
+            .order_by("-search_rank", "-created_at"))
@@ -1,9 +1,24 @@
 # whatsapp_chat/serializers.py
 from rest_framework import serializers
-from .models import ChatMessage
+from .models import ChatMessage, OutboundMessage
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
+    # only set when the list is filtered with ?q=
+    search_rank = serializers.SerializerMethodField()
+
     class Meta:
         model = ChatMessage
+        # the compact twins; their values come out through the original field names
+        exclude = ("account_sid_ref", "sms_status_ref", "message_type_ref", "api_version_ref",
+                   "channel_metadata_ref", "to_phone_ref", "model_name_ref", "finish_reason_ref",
+                   "delivery_status_ref", "user_text_z", "response_text_z")
+
+    def get_search_rank(self, obj):
+        return getattr(obj, "search_rank", None)
+
+
+class OutboundMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OutboundMessage
         fields = "__all__"
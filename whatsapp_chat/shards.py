@@ -0,0 +1,300 @@
+# whatsapp_chat/shards.py
+"""
+Ordered per-conversation processing on sharded workers (INBOUND_SHARDED = True).
+
+The webhook only rate-limits and queues each message (InboundMessage) and answers
+Twilio right away; `python manage.py process_inbound` workers, as many processes
+on as many nodes as needed, call the LLM and send the replies.
+
+- Each conversation (wa_id / from_phone) hashes to one of SLOTS slots, and the
+  slots are spread over the live workers with a consistent-hash ring (HashRing,
+  VNODES points per worker), so a worker joining or leaving moves ~1/N of them.
+  Membership is the ShardMember table: workers heartbeat into it and recompute
+  their slots whenever the set of live names changes.
+- Ordering: a worker only ever claims a conversation's oldest open message, and
+  the claim is a single conditional UPDATE that re-checks this in the database.
+  While a rebalance is in flight two workers may both think they own a slot, but
+  a conversation still never has two messages in progress, or a later one
+  answered before an earlier one.
+- Claims are leases, renewed on every heartbeat. If a worker dies its messages
+  become claimable again after LEASE_SECONDS and the new owner redoes them
+  (at least once, like the outbox). The ChatMessage and the "done" mark commit
+  in one transaction that starts by re-checking the claim token, so a worker
+  whose lease was taken over records nothing. The replies themselves go out in
+  the same order through the outbox (see outbox.py).
+Different conversations run in parallel: across workers by slot, and within a
+worker on a pool of CONCURRENCY threads.
+"""
+import bisect
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from . import outbox, tracing
+from .models import InboundMessage, ShardMember
+
+ENABLED = bool(getattr(settings, "INBOUND_SHARDED", False))
+SLOTS = int(getattr(settings, "INBOUND_SLOTS", 256))
+VNODES = int(getattr(settings, "SHARD_VNODES", 64))
+CONCURRENCY = int(getattr(settings, "INBOUND_WORKER_CONCURRENCY", 8))
+MAX_ATTEMPTS = int(getattr(settings, "INBOUND_MAX_ATTEMPTS", 5))
+LEASE_SECONDS = float(getattr(settings, "INBOUND_LEASE_SECONDS", 30.0))
+HEARTBEAT_SECONDS = float(getattr(settings, "SHARD_HEARTBEAT_SECONDS", 5.0))
+MEMBER_TTL = float(getattr(settings, "SHARD_MEMBER_TTL", 15.0))  # no heartbeat for this long = gone
+
+OPEN = (InboundMessage.PENDING, InboundMessage.PROCESSING)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def slot_for(conversation: str) -> int:
+    """Stable across processes and nodes (hash() is salted per process)."""
+    return _hash(conversation) % SLOTS
+
+
+class HashRing:
+    """Consistent hashing of slots onto worker names, `vnodes` points per worker."""
+
+    def __init__(self, members, vnodes=VNODES):
+        self.members = tuple(sorted(set(members)))
+        points = sorted((_hash(f"{m}#{i}"), m) for m in self.members for i in range(vnodes))
+        self._points = [p for p, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, slot):
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(f"slot:{slot}")) % len(self._points)
+        return self._owners[i]
+
+    def slots_of(self, member, slots=None):
+        return frozenset(s for s in range(SLOTS if slots is None else slots) if self.owner(s) == member)
+
+
+# ---------- membership ----------
+def heartbeat(name, ttl=MEMBER_TTL):
+    now = timezone.now()
+    # UPDATE first rather than update_or_create(): no transaction that reads before it writes
+    if not ShardMember.objects.filter(name=name).update(heartbeat_at=now):
+        ShardMember.objects.create(name=name, heartbeat_at=now)
+    ShardMember.objects.filter(heartbeat_at__lt=now - timedelta(seconds=10 * ttl)).delete()  # long dead
+
+
+def live_members(ttl=MEMBER_TTL):
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    return tuple(sorted(ShardMember.objects.filter(heartbeat_at__gte=cutoff).values_list("name", flat=True)))
+
+
+def leave(name):
+    """Graceful shutdown: the other workers take the slots over on their next heartbeat."""
+    ShardMember.objects.filter(name=name).delete()
+
+
+# ---------- queue ----------
+def enqueue(conversation, data, status_callback=None, trace_parent=None):
+    """Queue a webhook message (the webhook's side when INBOUND_SHARDED is on)."""
+    return InboundMessage.objects.create(
+        conversation=conversation,
+        slot=slot_for(conversation),
+        payload=data,
+        status_callback=status_callback,
+        trace_parent=trace_parent,
+    )
+
+
+def _claimable(now):
+    """Open, not leased (or lease expired), and the oldest open message of its conversation."""
+    earlier = InboundMessage.objects.filter(
+        conversation=OuterRef("conversation"), status__in=OPEN, pk__lt=OuterRef("pk"))
+    return Q(status__in=OPEN, next_attempt_at__lte=now) & ~Exists(earlier)
+
+
+def claim(worker, slots, limit, busy=(), lease_seconds=None):
+    """
+    Claim up to `limit` messages from `slots`, skipping the `busy` conversations (the
+    worker's own in-flight ones, in case a lease ran out under it). Head-of-line means
+    at most one message per conversation is claimable, so one UPDATE claims the batch;
+    a concurrent claimer's UPDATE re-checks the lease and skips rows taken meanwhile.
+    """
+    if not slots or limit <= 0:
+        return []
+    now = timezone.now()
+    pks = list(InboundMessage.objects
+               .filter(_claimable(now), slot__in=slots)
+               .exclude(conversation__in=list(busy))
+               .order_by("id")
+               .values_list("pk", flat=True)[:limit])
+    if not pks:
+        return []
+    token = uuid.uuid4().hex
+    InboundMessage.objects.filter(_claimable(now), pk__in=pks).update(
+        status=InboundMessage.PROCESSING, worker=worker, token=token, started_at=now,
+        attempts=F("attempts") + 1,
+        next_attempt_at=now + timedelta(seconds=LEASE_SECONDS if lease_seconds is None else lease_seconds))
+    return list(InboundMessage.objects.filter(pk__in=pks, token=token).order_by("id"))
+
+
+def renew(tokens, lease_seconds=None):
+    """Extend the leases of the in-flight claims (called on every heartbeat)."""
+    if tokens:
+        InboundMessage.objects.filter(token__in=list(tokens), status=InboundMessage.PROCESSING).update(
+            next_attempt_at=timezone.now() + timedelta(
+                seconds=LEASE_SECONDS if lease_seconds is None else lease_seconds))
+
+
+class LeaseLost(Exception):
+    """The message was claimed by another worker after our lease ran out; our result is dropped."""
+
+
+def confirm(job, lease_seconds=None):
+    """
+    Re-check our claim (and renew its lease) as the first statement of the transaction
+    that stores the answer: it fails early if the lease was taken over, and being a
+    write it makes SQLite take the write lock before the transaction reads anything.
+    """
+    if not InboundMessage.objects.filter(pk=job.pk, token=job.token).update(
+            next_attempt_at=timezone.now() + timedelta(
+                seconds=LEASE_SECONDS if lease_seconds is None else lease_seconds)):
+        raise LeaseLost(job.pk)
+
+
+def finish(job, chat_message):
+    """Mark `job` done. Call inside the transaction that writes its ChatMessage."""
+    if not InboundMessage.objects.filter(pk=job.pk, token=job.token).update(
+            status=InboundMessage.DONE, token=None, chat_message=chat_message,
+            finished_at=timezone.now(), last_error=None):
+        raise LeaseLost(job.pk)
+
+
+def fail(job, exc):
+    """Retry with backoff (the conversation waits), or give up after MAX_ATTEMPTS (it moves on)."""
+    retry = job.attempts < MAX_ATTEMPTS
+    InboundMessage.objects.filter(pk=job.pk, token=job.token).update(
+        status=InboundMessage.PENDING if retry else InboundMessage.FAILED,
+        token=None,
+        last_error=f"{type(exc).__name__}: {exc}",
+        next_attempt_at=timezone.now() + outbox.backoff(job.attempts) if retry else F("next_attempt_at"),
+        finished_at=None if retry else timezone.now(),
+    )
+    return retry
+
+
+def answer(job, on_begin, on_saved):
+    """Default handler: the webhook's own LLM -> ChatMessage + outbox -> send pipeline."""
+    from .views import reply_to  # views imports this module
+    reply_to(job.payload, job.status_callback, job.trace_parent, on_begin=on_begin, on_saved=on_saved)
+
+
+# ---------- worker ----------
+class Worker:
+    """
+    One process_inbound process. `handler(job, on_begin, on_saved)` answers a message
+    and must call on_begin() first and on_saved(chat_message) last inside the
+    transaction that stores the answer.
+    """
+
+    def __init__(self, name=None, concurrency=CONCURRENCY, handler=answer, report=None,
+                 heartbeat_seconds=HEARTBEAT_SECONDS, member_ttl=MEMBER_TTL, lease_seconds=LEASE_SECONDS):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.handler = handler
+        self.report = report or (lambda msg: None)
+        self.heartbeat_seconds, self.member_ttl, self.lease_seconds = heartbeat_seconds, member_ttl, lease_seconds
+        self.members, self.slots = (), frozenset()
+        self.stats = Counter()  # done / retried / failed / lost / rebalances, and errors_after_commit
+        self._lock = threading.Lock()
+        self._in_flight = {}  # future -> job
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def heartbeat(self):
+        """Refresh our membership and leases; recompute our slots if the ring changed."""
+        close_old_connections()
+        heartbeat(self.name, self.member_ttl)
+        renew({job.token for job in self._in_flight.values()}, self.lease_seconds)
+        members = live_members(self.member_ttl)
+        if members != self.members:
+            slots = HashRing(members).slots_of(self.name)
+            self.report(f"{self.name}: {len(members)} live worker(s), owns {len(slots)}/{SLOTS} slots "
+                        f"(+{len(slots - self.slots)} -{len(self.slots - slots)})")
+            self.members, self.slots = members, slots
+            self.stats["rebalances"] += 1
+
+    def process(self, job):
+        """
+        Runs on a pool thread. Once the transaction with the answer has committed the
+        message is done: an error after that (e.g. recording the Twilio send) is only
+        counted and reported, since retrying would answer the message twice. The
+        outbox row committed with the answer gets the reply sent.
+        """
+        committed = []
+
+        def on_saved(cm):
+            finish(job, cm)
+            transaction.on_commit(lambda: committed.append(True))
+
+        try:
+            with tracing.span("inbound.process", {"inbound.id": job.pk, "inbound.attempt": job.attempts}) as sp:
+                sp.add_link(job.trace_parent)
+                self.handler(job, lambda: confirm(job, self.lease_seconds), on_saved)
+            self._count("done")
+        except LeaseLost:
+            self._count("lost")
+        except Exception as e:
+            if committed:
+                self._count("done")
+                self._count("errors_after_commit")
+                self.report(f"{self.name}: inbound {job.pk} answered, then {type(e).__name__}: {e}")
+            else:
+                self._count("retried" if fail(job, e) else "failed")
+        finally:
+            close_old_connections()
+
+    def run(self, stop=None, idle_exit=False, poll=0.2):
+        """
+        Claim and answer messages until `stop` (a threading or multiprocessing Event)
+        is set, or with idle_exit=True until nothing in our slots is claimable (at
+        once if we own no slots).
+        In-flight messages are finished and the worker leaves the ring on the way out.
+        """
+        stop = stop or threading.Event()
+        next_beat = 0.0
+        pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="inbound")
+        try:
+            while not stop.is_set():
+                if time.monotonic() >= next_beat:
+                    self.heartbeat()
+                    next_beat = time.monotonic() + self.heartbeat_seconds
+                free = self.concurrency - len(self._in_flight)
+                jobs = claim(self.name, self.slots, free, {j.conversation for j in self._in_flight.values()},
+                             self.lease_seconds) if free else []
+                for job in jobs:
+                    self._in_flight[pool.submit(self.process, job)] = job
+                if self._in_flight:
+                    done, _ = wait(self._in_flight, timeout=poll, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        del self._in_flight[f]
+                elif not jobs:
+                    if idle_exit:
+                        break
+                    stop.wait(poll)
+        finally:
+            wait(self._in_flight)
+            self._in_flight.clear()
+            pool.shutdown()
+            leave(self.name)
@@ -1,3 +1,584 @@
-from django.test import TestCase
+import functools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin as django_admin
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import compact, ingress, knowledge, outbox, ratelimit, replay, search, shards, tracing
+from .changelist import IndexedDatesQuerySet
+from .management.commands import bench_startup
+from .models import ChatMessage, InboundMessage, Lookup, OutboundMessage
+
+
+class _FailingEmbedder(knowledge.HashingEmbedder):
+    def embed(self, texts):
+        if any("explode" in t for t in texts):
+            raise RuntimeError("embedding service down")
+        return super().embed(texts)
+
+
+class KnowledgeIndexTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.docs, self.dir = Path(tmp.name) / "docs", Path(tmp.name) / "index"
+        self.docs.mkdir()
+
+    def write(self, name, text):
+        (self.docs / name).write_text(text)
+
+    def index(self, embedder=None):
+        return knowledge.KnowledgeIndex(self.dir, embedder=embedder or knowledge.HashingEmbedder(64))
+
+    def assert_consistent(self, index):
+        rows, dim = index.manifest["rows"], index.manifest["dim"]
+        self.assertEqual(index.vectors_path.stat().st_size, rows * dim * 4)
+        self.assertEqual(index.offsets_path.stat().st_size, rows * 8)
+
+    def test_ingest_after_an_interrupted_one_drops_its_rows(self):
+        self.write("a.txt", "delivery charges are five dollars")
+        self.index().ingest([self.docs])
+        self.write("b.txt", "refunds are issued within seven days")
+        self.write("c.txt", "opening hours explode at nine")
+        with self.assertRaises(RuntimeError):
+            self.index(_FailingEmbedder(64)).ingest([self.docs])  # b's rows are written, the manifest isn't
+
+        index = self.index()
+        stats = index.ingest([self.docs])
+        self.assertEqual((stats["added"], stats["unchanged"]), (2, 1))
+        self.assert_consistent(index)
+        for query, doc in (("refunds within seven days", "b.txt"), ("opening hours", "c.txt")):
+            _, chunk = index.search(query, k=1)[0]
+            self.assertEqual(Path(chunk["doc"]).name, doc)
+
+    def test_compaction_switches_generation(self):
+        for name in "abc":
+            self.write(f"{name}.txt", f"document {name} talks about topic {name}")
+        index = self.index()
+        index.ingest([self.docs])
+        reader = self.index()
+        self.assertTrue(reader.refresh())
+        for name in "ab":
+            self.write(f"{name}.txt", f"document {name} now covers pricing {name}")
+        index.ingest([self.docs])  # 2 of 3 documents dead: compacts
+
+        self.assertEqual((index.manifest["generation"], index.dead_rows()), (1, 0))
+        self.assertFalse((self.dir / "vectors.f32").exists())
+        self.assert_consistent(index)
+        _, chunk = reader.search("pricing b", k=1)[0]  # picks up the new generation
+        self.assertEqual(Path(chunk["doc"]).name, "b.txt")
+
+
+class ReplayTests(SimpleTestCase):
+    def test_configs_of_a_provider_share_one_limit(self):
+        configs = [replay.ReplayConfig("a", "fake", rps=5), replay.ReplayConfig("b", "fake", rps=2, burst=3),
+                   replay.ReplayConfig("c", "fake"), replay.ReplayConfig("d", "openai")]
+        replay.share_limits(configs)
+        self.assertIs(configs[0].limit, configs[1].limit)
+        self.assertIs(configs[0].limit, configs[2].limit)
+        self.assertEqual((configs[0].limit._bucket.rate, configs[0].limit._bucket.capacity), (2.0, 1))
+        self.assertIsNone(configs[3].limit)
+
+    def test_default_model_is_the_providers(self):
+        from .openai_client import MODEL_NAME
+
+        config = replay.ReplayConfig.parse("provider=openai")
+        self.assertEqual((config.name, config.model), (f"openai:{MODEL_NAME}", MODEL_NAME))
+
+    def test_summarize_counts_the_latest_record_per_pair(self):
+        records = [
+            {"config": "fake", "message_id": 1, "error": "ConnectionError: timeout"},
+            {"config": "fake", "message_id": 2, "error": None, "latency_ms": 100, "reply_chars": 5},
+            {"config": "fake", "message_id": 1, "error": None, "latency_ms": 300, "reply_chars": 7},  # resumed
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+        self.addCleanup(os.unlink, f.name)
+        [row] = replay.summarize(f.name)
+        self.assertEqual((row["replies"], row["errors"], row["latency_p90_ms"]), (2, 0, 300))
+
+
+class SearchTests(TestCase):
+    def message(self, user_text, response_text=""):
+        return ChatMessage.objects.create(message_sid=f"SMsearch{ChatMessage.objects.count()}",
+                                          from_phone="whatsapp:+15550008", user_text=user_text,
+                                          response_text=response_text)
+
+    def found(self, text):
+        return list(search.search(ChatMessage.objects.all(), text).values_list("pk", flat=True))
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        cm = self.message("my parcel is delayed")
+        self.assertEqual(self.found("parcel"), [cm.pk])
+        self.assertEqual(list(ChatMessage.objects.filter(search.matching_q("parc")).values_list("pk", flat=True)),
+                         [cm.pk])
+
+        cm.user_text = "refund please"
+        cm.save()
+        self.assertEqual((self.found("parcel"), self.found("refund")), ([], [cm.pk]))
+        cm.delete()
+        self.assertEqual(self.found("refund"), [])
+
+    def test_user_text_weighs_double(self):
+        asked = self.message("invoice copy", "sure thing")
+        answered = self.message("sure thing", "invoice copy")
+        results = list(search.search(ChatMessage.objects.all(), "invoice"))
+        self.assertEqual([m.pk for m in results], [asked.pk, answered.pk])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    @skipUnless(compact.zstd_available(), "needs zstandard")
+    def test_compressed_rows_stay_searchable(self):
+        cm = self.message("where is my parcel " * 40)
+        compact.compact_batch(ChatMessage, cm.pk + 1, compress_before=timezone.now() + timedelta(minutes=1))
+        self.assertIsNotNone(ChatMessage.objects.filter(pk=cm.pk).values_list("user_text_z", flat=True).get())
+
+        self.assertEqual(self.found("parcel"), [cm.pk])
+        [result] = self.client.get(reverse("messages-list"), {"q": "parcel"}).json()["results"]
+        self.assertEqual(result["id"], cm.pk)
+        self.assertIsNotNone(result["search_rank"])
+        model_admin = django_admin.site._registry[ChatMessage]
+        qs, _ = model_admin.get_search_results(RequestFactory().get("/"), ChatMessage.objects.all(), "parcel")
+        self.assertEqual(list(qs.values_list("pk", flat=True)), [cm.pk])
+
+    def test_falls_back_to_icontains_without_fts5(self):
+        cm = self.message("my parcel is delayed")
+        self.message("hello")
+        with mock.patch.object(search, "is_installed", return_value=False):
+            self.assertEqual(self.found("arcel is"), [cm.pk])  # a substring, not a word prefix
+            model_admin = django_admin.site._registry[ChatMessage]
+            qs, _ = model_admin.get_search_results(RequestFactory().get("/"), ChatMessage.objects.all(), "arcel")
+            self.assertEqual(list(qs.values_list("pk", flat=True)), [cm.pk])
+
+
+class IndexedDatesTests(TestCase):
+    def test_years_match_the_default_implementation(self):
+        when = [datetime(2022, 12, 31, 23, 30), datetime(2023, 1, 1, 0, 30), datetime(2025, 6, 1)]
+        for i, dt in enumerate(when):
+            cm = ChatMessage.objects.create(message_sid=f"SMdates{i}", user_text="hi")
+            ChatMessage.objects.filter(pk=cm.pk).update(created_at=timezone.make_aware(dt))
+        qs = IndexedDatesQuerySet(ChatMessage)
+        for kind in ("year", "month", "day"):
+            with self.subTest(kind=kind):
+                self.assertEqual(qs.datetimes("created_at", kind, "DESC"),
+                                 list(ChatMessage.objects.datetimes("created_at", kind, "DESC")))
+
+
+class ChangelistTests(TestCase):
+    def test_filter_choices_are_the_lookup_values_in_use(self):
+        for i, status in enumerate(("sent", "failed", "sent")):
+            ChatMessage.objects.create(message_sid=f"SMchoice{i}", delivery_status_ref=status, sms_status_ref="received")
+        Lookup.objects.create(value="undelivered")  # interned, but no row holds it
+        with self.assertNumQueries(1):
+            self.assertEqual(compact.lookup_choices(ChatMessage, "delivery_status_ref"), ["failed", "sent"])
+
+    def test_preview_ellipsis_only_when_cut(self):
+        model_admin = django_admin.site._registry[ChatMessage]
+        for length, preview in ((80, "x" * 80), (81, "x" * 80 + "…")):
+            cm = ChatMessage.objects.create(message_sid=f"SMpreview{length}", user_text="x" * length)
+            with self.subTest(length=length):
+                row = ChatMessage.objects.annotate(**model_admin.list_annotations).get(pk=cm.pk)
+                self.assertEqual(model_admin.user_text_preview(row), preview)
+
+
+class UsageSummaryTests(TestCase):
+    def test_limit_is_validated_and_capped(self):
+        ChatMessage.objects.bulk_create(ChatMessage(message_sid=f"SMusage{i}", from_phone=f"whatsapp:+9{i}",
+                                                    cost_usd=i) for i in range(3))
+        for limit in ("abc", "0", "-5", "1.5"):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.client.get(reverse("usage-summary"), {"limit": limit}).status_code, 400)
+        response = self.client.get(reverse("usage-summary"), {"group_by": "sender", "limit": "2"})
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertEqual(self.client.get(reverse("usage-summary"), {"limit": "10000000"}).status_code, 200)
+
+
+# Run with `manage.py shell -c` and TRACING_ENABLED=1: tracing is fixed at import, so the
+# views must be imported in a process that starts with it on.
+TRACED_REQUESTS = """
+import functools
+from unittest import mock
+from urllib.parse import urlencode
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from whatsapp_chat import replay, tracing
+from whatsapp_chat.models import ChatMessage
+from whatsapp_chat.tests import _FakeTwilio
+
+setup_test_environment()
+connection.creation.create_test_db(verbosity=0)
+twilio = _FakeTwilio()
+with mock.patch("whatsapp_chat.views.ask_openai", functools.partial(replay.fake_llm, latency_ms=0)), \\
+        mock.patch("whatsapp_chat.twilio_client.get_client", lambda: twilio):
+    client, form = Client(), "application/x-www-form-urlencoded"  # what Twilio posts
+    client.post(reverse("whatsapp-webhook"), urlencode({"Body": "hi", "From": "whatsapp:+15550009", "WaId": "15550009",
+                "To": "whatsapp:+14155238886", "MessageSid": "SMtraced"}), content_type=form)
+    sid = ChatMessage.objects.get().outbound_message_sid
+    client.post(reverse("twilio-status"), urlencode({"MessageSid": sid, "MessageStatus": "delivered"}),
+                content_type=form)
+tracing.flush()
+"""
+
+
+class TracingTests(TestCase):
+    def test_webhook_and_status_callback_spans(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "traces.jsonl"
+            proc = subprocess.run([sys.executable, "manage.py", "shell", "-c", TRACED_REQUESTS], cwd=settings.BASE_DIR,
+                                  env={**os.environ, "TRACING_ENABLED": "1", "TRACING_EXPORTER": "file",
+                                       "TRACING_FILE": str(path)},
+                                  capture_output=True, text=True)
+            self.assertEqual(proc.returncode, 0, proc.stderr[-2000:])
+            requests = [json.loads(line) for line in path.read_text().splitlines()]
+
+        spans = {}
+        for request in requests:  # OTLP/JSON ExportTraceServiceRequest, one per line
+            [resource] = request["resourceSpans"]
+            self.assertIn({"key": "service.name", "value": {"stringValue": tracing.SERVICE_NAME}},
+                          resource["resource"]["attributes"])
+            for s in resource["scopeSpans"][0]["spans"]:
+                self.assertRegex(s["traceId"], r"^[0-9a-f]{32}$")
+                self.assertRegex(s["spanId"], r"^[0-9a-f]{16}$")
+                self.assertLessEqual(int(s["startTimeUnixNano"]), int(s["endTimeUnixNano"]))
+                self.assertEqual(s["status"], {"code": 1})
+                spans[s["name"]] = {**s, "attributes": {a["key"]: a["value"] for a in s["attributes"]}}
+
+        root = spans["webhook.inbound"]
+        self.assertNotIn("parentSpanId", root)
+        self.assertEqual(root["attributes"]["messaging.message.id"], {"stringValue": "SMtraced"})
+        for name in ("webhook.admission", "llm.openai", "db.insert", "twilio.send"):
+            with self.subTest(span=name):
+                self.assertEqual((spans[name]["traceId"], spans[name]["parentSpanId"]),
+                                 (root["traceId"], root["spanId"]))
+        self.assertEqual(spans["webhook.admission"]["attributes"]["admission"], {"stringValue": "ok"})
+        self.assertIn("llm.usage.completion_tokens", spans["llm.openai"]["attributes"])
+
+        callback = spans["twilio.status_callback"]
+        self.assertNotEqual(callback["traceId"], root["traceId"])
+        self.assertEqual(callback["links"], [{"traceId": root["traceId"], "spanId": root["spanId"]}])
+
+    def test_disabled_tracing_adds_nothing(self):
+        def handle():
+            pass
+
+        self.assertIs(tracing.span("x"), tracing.NOOP)
+        self.assertIs(tracing.traced("x")(handle), handle)
+        twilio = _FakeTwilio()
+        with mock.patch("whatsapp_chat.views.ask_openai", functools.partial(replay.fake_llm, latency_ms=0)), \
+                mock.patch("whatsapp_chat.twilio_client.get_client", lambda: twilio), \
+                mock.patch.object(tracing._exporter, "submit") as submit:
+            self.client.post(reverse("whatsapp-webhook"), {"Body": "hi", "From": "whatsapp:+15550010"},
+                             content_type="application/json")
+        submit.assert_not_called()
+        self.assertEqual(len(twilio.sent), 1)
+        self.assertIsNone(ChatMessage.objects.get().trace_parent)
+
+    @skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_a_forked_child_starts_its_own_exporter(self):
+        exporter = tracing._exporter
+        with mock.patch.object(exporter, "_export"):
+            exporter.submit("span")
+            exporter.flush()
+            pid = os.fork()  # gunicorn --preload: the parent's exporter thread doesn't exist in the worker
+            if pid == 0:
+                os._exit(0 if exporter._thread is None else 1)
+            _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class CompactStorageTests(TestCase):
+    LEGACY = {"account_sid": "AC" + "1" * 32, "to_phone": "whatsapp:+14155238886",
+              "model_name": "gpt-4o-mini", "delivery_status": "delivered"}
+
+    def setUp(self):
+        # the interned id -> value caches outlive each test's rollback, which hands the ids out again
+        for table in (compact.lookups, compact.metadata):
+            patcher = mock.patch.multiple(table, _ids={}, _values={})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def legacy_row(self, user_text="hello", **columns):
+        """A row as written before the compact layout: values in the wide columns, no twins."""
+        cm = ChatMessage.objects.create(message_sid=f"SMlegacy{ChatMessage.objects.count()}",
+                                        from_phone="whatsapp:+15550005", user_text=user_text)
+        ChatMessage.objects.filter(pk=cm.pk).update(**{**self.LEGACY, **columns}, channel_metadata={"type": "whatsapp"})
+        return ChatMessage.objects.get(pk=cm.pk)
+
+    def stored(self, cm, *names):
+        return ChatMessage.objects.filter(pk=cm.pk).values(*names).get()
+
+    def test_legacy_rows_read_through_the_old_names(self):
+        cm = self.legacy_row()
+        self.assertIsNone(cm.to_phone_ref)
+        self.assertEqual([getattr(cm, name) for name in self.LEGACY], list(self.LEGACY.values()))
+        self.assertEqual(cm.channel_metadata, {"type": "whatsapp"})
+
+    def test_filters_match_rows_the_backfill_has_not_reached(self):
+        phone = self.LEGACY["to_phone"]
+        legacy = self.legacy_row()
+        compacted = ChatMessage.objects.create(message_sid="SMnew", from_phone="whatsapp:+15550006", to_phone_ref=phone)
+        ChatMessage.objects.create(message_sid="SMother", from_phone="whatsapp:+15550007",
+                                   to_phone_ref="whatsapp:+14155230000")
+
+        matched = ChatMessage.objects.filter(compact.value_q(ChatMessage, "to_phone_ref", phone))
+        self.assertEqual(set(matched.values_list("pk", flat=True)), {legacy.pk, compacted.pk})
+        results = self.client.get(reverse("messages-list"), {"to_phone": phone}).json()["results"]
+        self.assertEqual(sorted(r["id"] for r in results), sorted([legacy.pk, compacted.pk]))
+
+    def test_backfill_moves_values_to_the_compact_columns(self):
+        rows = [self.legacy_row(), self.legacy_row(delivery_status="failed")]
+        out = StringIO()
+        call_command("compact_messages", "--check", stdout=out)
+        self.assertIn("2 rows still use the legacy columns", out.getvalue())
+
+        self.assertEqual(compact.compact_batch(ChatMessage, rows[-1].pk + 1), (2, 2, rows[0].pk))
+        self.assertEqual(self.stored(rows[1], "to_phone", "to_phone_ref", "delivery_status", "delivery_status_ref",
+                                     "channel_metadata", "channel_metadata_ref__data"),
+                         {"to_phone": "", "to_phone_ref": self.LEGACY["to_phone"], "delivery_status": None,
+                          "delivery_status_ref": "failed", "channel_metadata": None,
+                          "channel_metadata_ref__data": {"type": "whatsapp"}})
+        self.assertEqual(ChatMessage.objects.get(pk=rows[0].pk).model_name, self.LEGACY["model_name"])
+        out = StringIO()
+        call_command("compact_messages", "--check", stdout=out)
+        self.assertIn("0 rows still use the legacy columns", out.getvalue())
+
+    @skipUnless(compact.zstd_available(), "needs zstandard")
+    def test_old_long_texts_round_trip_through_zstd(self):
+        text = "the parcel was left at the wrong address " * 20
+        cm = self.legacy_row(user_text=text)
+        compact.compact_batch(ChatMessage, cm.pk + 1, compress_before=timezone.now() + timedelta(minutes=1))
+
+        stored = self.stored(cm, "user_text", "user_text_z")
+        self.assertIsNone(stored["user_text"])
+        self.assertLess(len(stored["user_text_z"]), len(text))
+        self.assertEqual(ChatMessage.objects.get(pk=cm.pk).user_text, text)
+
+    @skipUnless(compact.zstd_available(), "needs zstandard")
+    def test_compressed_rows_are_read_only(self):
+        text = "please send the invoice for order 4471 again " * 20
+        cm = self.legacy_row(user_text=text)
+        compact.compact_batch(ChatMessage, cm.pk + 1, compress_before=timezone.now() + timedelta(minutes=1))
+
+        cm = ChatMessage.objects.get(pk=cm.pk)
+        for name in ("user_text", "response_text"):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                setattr(cm, name, "edited")
+        cm.user_text = text  # posting the same text back is a no-op
+        cm.save()
+        self.assertIsNotNone(self.stored(cm, "user_text_z")["user_text_z"])
+
+
+class SharedRateLimitTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_workers_share_one_burst_per_window(self):
+        workers = [ratelimit.SenderRateLimiter(rate=1, burst=3, cache_alias="default") for _ in range(2)]
+        with mock.patch("whatsapp_chat.ratelimit.time.time", return_value=3000.0):  # one window
+            admitted = [w.allow("whatsapp:+15550001") for w in workers for _ in range(3)]
+        self.assertEqual(admitted, [True] * 3 + [False] * 3)
+
+
+class FairGateTests(SimpleTestCase):
+    def acquire_in_thread(self, gate, sender):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(gate.acquire(sender)), daemon=True)
+        thread.start()
+        return thread, result
+
+    def test_a_senders_next_message_waits_out_its_slow_call(self):
+        gate = ratelimit.FairGate(slots=2, per_sender=1, max_waiting=4, timeout=0.05)
+        waits = ratelimit.snapshot().get("sender_waits", 0)
+        self.assertTrue(gate.acquire("a"))
+        thread, result = self.acquire_in_thread(gate, "a")
+        thread.join(0.3)  # well past the timeout, with a slot free all along
+        self.assertTrue(thread.is_alive())
+
+        gate.release("a")
+        thread.join(5)
+        self.assertEqual(result, [True])
+        self.assertEqual(ratelimit.snapshot()["sender_waits"], waits + 1)
+
+    def test_sheds_when_every_slot_stays_busy(self):
+        gate = ratelimit.FairGate(slots=1, per_sender=1, max_waiting=1, timeout=0.05)
+        self.assertTrue(gate.acquire("a"))
+        self.assertFalse(gate.acquire("b"))
+        full = ratelimit.FairGate(slots=1, per_sender=1, max_waiting=0, timeout=5)
+        self.assertTrue(full.acquire("a"))
+        self.assertFalse(full.acquire("b"))  # no room in the wait queue: shed at once
+
+
+class IngressTests(TestCase):
+    def test_only_the_exact_callback_paths_take_the_lean_handler(self):
+        app = ingress.wsgi_app(lambda environ, start_response: "full stack")
+        for path in ("/whatsapp_chat/statuses", "/whatsapp_chat/webhook/extra", "/whatsapp_chat/webhooks"):
+            with self.subTest(path=path):
+                self.assertEqual(app({"PATH_INFO": path}, None), "full stack")
+        environ = RequestFactory().get(reverse("twilio-status")).environ
+        self.assertNotEqual(app(environ, lambda status, headers: None), "full stack")
+
+    def test_malformed_json_is_a_bad_request(self):
+        response = self.client.post(reverse("whatsapp-webhook"), data="{not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class _TwilioError(Exception):
+    def __init__(self, status, code=None):
+        super().__init__(f"HTTP {status}")
+        self.status, self.code = status, code
+
+
+class _FakeTwilio:
+    """client.messages.create() that raises the queued errors, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors, self.messages, self.sent = list(errors), self, []
+
+    def create(self, to, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((to, kwargs.get("body")))
+        return type("Msg", (), {"sid": f"SMfake{len(self.sent):028d}"})()
+
+
+class OutboxTests(TestCase):
+    def enqueue(self, to="whatsapp:+15550002", body="hi"):
+        cm = ChatMessage.objects.create(message_sid=f"SMout{OutboundMessage.objects.count()}", from_phone=to)
+        return outbox.enqueue(to, body, chat_message=cm)
+
+    def test_transient_failures_retry_until_dead(self):
+        row = self.enqueue()
+        client = _FakeTwilio(*[_TwilioError(503)] * outbox.MAX_ATTEMPTS)
+        for attempt in range(1, outbox.MAX_ATTEMPTS):
+            outbox.deliver(row, client)
+            self.assertEqual((row.status, row.attempts), (OutboundMessage.PENDING, attempt))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+        outbox.deliver(row, client)
+        self.assertEqual(row.status, OutboundMessage.DEAD)
+        self.assertEqual(ChatMessage.objects.get(pk=row.chat_message_id).delivery_status_ref, "failed")
+
+    def test_permanent_failure_is_dead_lettered_at_once(self):
+        row = outbox.deliver(self.enqueue(), _FakeTwilio(_TwilioError(400, code=21211)))
+        self.assertEqual((row.status, row.attempts), (OutboundMessage.DEAD, 1))
+
+    def test_only_staff_can_requeue(self):
+        row = outbox.deliver(self.enqueue(), _FakeTwilio(_TwilioError(400, code=21211)))
+        url = reverse("outbox-dead")
+        self.assertEqual(len(self.client.get(url).json()["results"]), 1)
+        self.assertEqual(self.client.post(url, {"ids": [row.pk]}, content_type="application/json").status_code, 403)
+
+        self.client.force_login(get_user_model().objects.create_user("ops", is_staff=True))
+        response = self.client.post(url, {"ids": [row.pk]}, content_type="application/json")
+        self.assertEqual((response.status_code, response.json()["requeued"]), (202, 1))
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (OutboundMessage.PENDING, 0))
+        self.assertEqual(outbox.dispatch_batch(client=_FakeTwilio(), concurrency=1)["sent"], 1)
+
+
+class OutboxOrderTests(TestCase):
+    def test_a_retry_holds_back_later_replies_to_the_number(self):
+        first = outbox.enqueue("whatsapp:+15550003", "first", deliver_now=True)
+        second = outbox.enqueue("whatsapp:+15550003", "second", deliver_now=True)
+        other = outbox.enqueue("whatsapp:+15550004", "other")
+        client = _FakeTwilio(_TwilioError(503))
+
+        outbox.deliver(first, client)  # fails: retried later
+        outbox.deliver(second, client)  # must not overtake it
+        self.assertEqual(client.sent, [])
+        OutboundMessage.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual([r.pk for r in outbox.claim_due()], [first.pk, other.pk])
+
+        OutboundMessage.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+        while outbox.dispatch_batch(client=client, concurrency=1)["sent"]:
+            pass
+        self.assertEqual([body for to, body in client.sent if to.endswith("3")], ["first", "second"])
+
+
+class ShardWorkerTests(TransactionTestCase):
+    def setUp(self):
+        self.twilio = _FakeTwilio()
+        for target, value in (("whatsapp_chat.views.ask_openai", functools.partial(replay.fake_llm, latency_ms=0)),
+                              ("whatsapp_chat.twilio_client.get_client", lambda: self.twilio)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_answers_and_sends_each_conversation_in_order(self):
+        for seq in range(4):
+            for conv in ("919800000001", "919800000002"):
+                shards.enqueue(conv, {"Body": f"m{seq}", "From": f"whatsapp:+{conv}", "WaId": conv,
+                                      "MessageSid": f"SM{conv}{seq}"})
+        worker = shards.Worker("test")
+        worker.heartbeat()
+        # Worker.run() without its thread pool (the in-memory test database is shared across threads)
+        while jobs := shards.claim(worker.name, worker.slots, limit=10):
+            self.assertEqual(len({job.conversation for job in jobs}), len(jobs))  # one per conversation
+            for job in jobs:
+                worker.process(job)
+
+        self.assertEqual(worker.stats["done"], 8)
+        for conv in ("919800000001", "919800000002"):
+            replies = ChatMessage.objects.filter(wa_id=conv).order_by("pk").values_list("user_text", flat=True)
+            self.assertEqual(list(replies), ["m0", "m1", "m2", "m3"])
+        sent = [body for to, body in self.twilio.sent if to.endswith("1")]
+        self.assertEqual(len(sent), 4)
+
+    def test_an_error_after_the_answer_commits_is_not_retried(self):
+        shards.enqueue("919800000003", {"Body": "hi", "From": "whatsapp:+919800000003", "WaId": "919800000003",
+                                        "MessageSid": "SMcommitted"})
+        worker = shards.Worker("test")
+        worker.heartbeat()
+        [job] = shards.claim(worker.name, worker.slots, limit=10)
+        with mock.patch("whatsapp_chat.outbox._record", side_effect=RuntimeError("database is locked")):
+            worker.process(job)  # the reply is sent, recording that fails
+
+        self.assertEqual((worker.stats["done"], worker.stats["retried"], worker.stats["errors_after_commit"]),
+                         (1, 0, 1))
+        self.assertEqual(InboundMessage.objects.get(pk=job.pk).status, InboundMessage.DONE)
+        self.assertEqual(shards.claim(worker.name, worker.slots, limit=10), [])
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+    def test_once_exits_without_slots(self):
+        with mock.patch.object(shards.HashRing, "slots_of", return_value=frozenset()):
+            runner = threading.Thread(target=shards.Worker("idle").run, kwargs={"idle_exit": True}, daemon=True)
+            runner.start()
+            runner.join(5)
+        self.assertFalse(runner.is_alive())
+
+
+class StartupImportTests(SimpleTestCase):
+    MODULE_BUDGET = 1000  # ~800 today; a heavy dependency imported at startup shows up as hundreds more
+    RUNS = 5  # bench_startup's default; the median rides out a slow run on a busy machine
+
+    def test_wsgi_startup_stays_lean(self):
+        totals = []
+        for _ in range(self.RUNS):
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import core.wsgi"],
+                                  cwd=settings.BASE_DIR, env={**os.environ, "WSGI_PRELOAD_PROVIDERS": "0"},
+                                  capture_output=True, text=True)
+            self.assertEqual(proc.returncode, 0, proc.stderr[-2000:])
+            total_us, modules = bench_startup._parse_importtime(proc.stderr)
+            totals.append(total_us / 1000)
+
+        sdks = ("openai", "google.genai", "google.generativeai", "twilio", *bench_startup.LAZY_MODULES)
+        self.assertEqual([m for m in modules if m.startswith(sdks)], [])
+        self.assertLess(len(modules), self.MODULE_BUDGET)
+        self.assertLessEqual(statistics.median(totals), bench_startup.BUDGET_MS,
+                             f"import time in ms: {[round(t) for t in totals]}")
@@ -0,0 +1,241 @@
+# whatsapp_chat/tracing.py
+"""
+Minimal OpenTelemetry-compatible tracing (off by default).
+
+    with tracing.span("llm.openai", {"llm.model": MODEL_NAME}):
+        ...
+
+    @tracing.traced("webhook.inbound")
+    def post(self, request): ...
+
+Finished spans are exported as OTLP/JSON, either appended to a local file
+(one ExportTraceServiceRequest per line, like the collector's file exporter)
+or POSTed to an OTLP/HTTP collector. When TRACING_ENABLED is False, `traced`
+returns the function untouched and `span` returns a shared no-op object.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+
+ENABLED = bool(getattr(settings, "TRACING_ENABLED", False))
+EXPORTER = getattr(settings, "TRACING_EXPORTER", "file")  # "file" | "otlp"
+FILE_PATH = getattr(settings, "TRACING_FILE", None) or (settings.BASE_DIR / "traces.jsonl")
+OTLP_ENDPOINT = getattr(settings, "TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = getattr(settings, "TRACING_SERVICE_NAME", "whatsapp-chatbot")
+
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 1.0  # seconds
+
+_current = contextvars.ContextVar("whatsapp_chat_span", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+    trace_id = span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_link(self, traceparent):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "links",
+                 "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, name, attributes=None):
+        parent = _current.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.links = []
+        self.error = None
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _exporter.submit(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_link(self, traceparent):
+        """Link to another trace, given its W3C traceparent (see `traceparent()`)."""
+        parts = (traceparent or "").split("-")
+        if len(parts) == 4:
+            self.links.append((parts[1], parts[2]))
+
+    def to_otlp(self):
+        out = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,  # SERVER for roots, INTERNAL otherwise
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attr(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        if self.links:
+            out["links"] = [{"traceId": t, "spanId": s} for t, s in self.links]
+        return out
+
+
+def _attr(key, value):
+    if isinstance(value, bool):
+        v = {"boolValue": value}
+    elif isinstance(value, int):
+        v = {"intValue": str(value)}
+    elif isinstance(value, float):
+        v = {"doubleValue": value}
+    else:
+        v = {"stringValue": str(value)}
+    return {"key": key, "value": v}
+
+
+class _BatchExporter:
+    """
+    Background thread that batches finished spans, started on first use in each
+    process. A forked child (gunicorn --preload workers) starts over with
+    reset(): the parent's thread doesn't exist there, and the parent's queue and
+    lock may have been in use when it forked.
+    """
+
+    def __init__(self):
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        self._queue = queue.Queue(maxsize=10_000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass  # never block a request on telemetry
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break  # flush requested: export what we have now
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._export(batch)
+            for w in waiters:
+                w.set()
+
+    def flush(self, timeout=5.0):
+        """Block until every span submitted so far has been exported."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _export(self, spans):
+        payload = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [_attr("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "whatsapp_chat"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}, separators=(",", ":"))
+        try:
+            if EXPORTER == "otlp":
+                req = urllib.request.Request(
+                    OTLP_ENDPOINT, data=payload.encode(), headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(req, timeout=5).close()
+            else:
+                with open(FILE_PATH, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+        except Exception:
+            pass  # telemetry must never take the app down
+
+
+_exporter = _BatchExporter()
+if hasattr(os, "register_at_fork"):  # not on Windows, which doesn't fork
+    os.register_at_fork(after_in_child=_exporter.reset)
+
+
+def span(name, attributes=None):
+    if not ENABLED:
+        return NOOP
+    return Span(name, attributes)
+
+
+def traced(name):
+    """Decorator version of span(); a no-op when tracing is disabled."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current():
+    return _current.get() or NOOP
+
+
+def traceparent():
+    """W3C traceparent of the active span (None when tracing is off)."""
+    s = _current.get()
+    return f"00-{s.trace_id}-{s.span_id}-01" if s else None
+
+
+def flush():
+    _exporter.flush()
@@ -0,0 +1,25 @@
+# whatsapp_chat/twilio_client.py
+import threading
+
+from django.conf import settings
+
+# Single client reused per process (keeps its HTTP session warm), built on first use
+# so that `twilio.rest` is not imported at startup.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from twilio.rest import Client
+                _client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+    return _client
+
+
+def reset_client():
+    """Drop the client (e.g. after fork) so each worker opens its own connections."""
+    global _client
+    _client = None
@@ -1,6 +1,7 @@
 # whatsapp_chat/urls.py
 from django.urls import path
-from .views import ( HealthView, WhatsAppWebhookView, StatusCallbackView, ChatMessageListView, ChatMessageCSVExport, 
+from .views import ( HealthView, WhatsAppWebhookView, StatusCallbackView, ChatMessageListView, ChatMessageCSVExport, UsageSummaryView,
+                        OutboxDeadLetterView,
                         # ConvertHtml2PDFWeasyView
                         SendImageView, SendPDFView,ConvertHtml2PDF, 
                     )
@@ -13,6 +14,8 @@ urlpatterns = [
 
     path("messages", ChatMessageListView.as_view(), name="messages-list"),
     path("save_messages_csv", ChatMessageCSVExport.as_view(), name="messages-csv"),
+    path("usage", UsageSummaryView.as_view(), name="usage-summary"),
+    path("outbox/dead", OutboxDeadLetterView.as_view(), name="outbox-dead"),
 
     path("send_image", SendImageView.as_view(), name="send-image"),
     path("send_pdf", SendPDFView.as_view(), name="send-pdf"),
@@ -39,6 +42,16 @@ GET   http://127.0.0.1:8000/whatsapp_chat/messages
 GET   http://127.0.0.1:8000/whatsapp_chat/save_messages_csv
 
 
+GET   http://127.0.0.1:8000/whatsapp_chat/usage?group_by=model      (or group_by=sender, &start=2025-01-01&end=2025-01-31, &limit=100, at most 1000)
+
+
+GET   http://127.0.0.1:8000/whatsapp_chat/outbox/dead
+POST  http://127.0.0.1:8000/whatsapp_chat/outbox/dead      (staff user: admin session or basic auth)
+{
+    "ids": [12, 15]
+}
+
+
 POST  http://127.0.0.1:8000/whatsapp_chat/send_image
 {
     "to": "whatsapp:+91xxxxxxxx",
@@ -0,0 +1,53 @@
+# whatsapp_chat/usage.py
+"""
+Token accounting: local pre-flight estimate/trim and per-call cost.
+"""
+import math
+
+from django.conf import settings
+
+# USD per 1M tokens: model -> (prompt, completion). Override with settings.LLM_PRICING.
+DEFAULT_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+PRICING = {**DEFAULT_PRICING, **getattr(settings, "LLM_PRICING", {})}
+
+MAX_INPUT_TOKENS = int(getattr(settings, "LLM_MAX_INPUT_TOKENS", 1500))
+
+# finish reasons that mean "hit MAX_TOKENS" (OpenAI / Gemini spelling)
+TRUNCATED_REASONS = ("length", "MAX_TOKENS")
+
+_ELLIPSIS = " … "
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap, dependency-free upper-ish estimate (~4 UTF-8 bytes per token).
+    Non-latin scripts use more bytes per char, which matches how BPE tokenizers behave.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def trim_to_budget(text: str, max_tokens: int = MAX_INPUT_TOKENS) -> str:
+    """
+    Keep the head and tail of oversized input (questions tend to sit at the end of
+    long pastes) so the prompt stays under `max_tokens` by the local estimate.
+    """
+    if max_tokens <= 0 or estimate_tokens(text) <= max_tokens:
+        return text
+    budget_bytes = max_tokens * 4 - len(_ELLIPSIS.encode("utf-8"))
+    raw = text.encode("utf-8")
+    head = raw[: budget_bytes // 2].decode("utf-8", "ignore")
+    tail = raw[-(budget_bytes - budget_bytes // 2):].decode("utf-8", "ignore")
+    return head + _ELLIPSIS + tail
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """0.0 for models missing from the price table."""
+    prompt_price, completion_price = PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
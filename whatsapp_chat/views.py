@@ -1,32 +1,56 @@
 import csv
 import json
 import os
+import re
 from datetime import datetime, timedelta
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Sum
 from django.http import HttpResponse
 from django.urls import reverse
 from django.utils.dateparse import parse_datetime
 from django.utils.timezone import make_aware
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
-from rest_framework import generics, permissions
+from rest_framework import generics, permissions, status as http_status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from twilio.rest import Client
-
-from .models import ChatMessage
-from .serializers import ChatMessageSerializer
+from .models import ChatMessage, OutboundMessage
+from .serializers import ChatMessageSerializer, OutboundMessageSerializer
+from . import compact, ingress, outbox, ratelimit, search, shards, tracing, twilio_client
 
 # from .gemini_client import ask_gemini, MODEL_NAME, TEMPERATURE
 from .openai_client import ask_openai, MODEL_NAME, TEMPERATURE
+from .usage import TRUNCATED_REASONS
 
 
+def _filter_by_date(qs, q):
+    """start / end filters (YYYY-MM-DD or ISO datetime)"""
+    start = q.get("start")
+    end = q.get("end")
+    if start:
+        try:
+            dt = parse_datetime(start) or datetime.fromisoformat(start)
+            qs = qs.filter(created_at__gte=make_aware(dt))
+        except Exception:
+            pass
+    if end:
+        try:
+            dt = parse_datetime(end) or datetime.fromisoformat(end)
+            if len(end) == 10:  # if only date provided, include whole day
+                dt = dt + timedelta(days=1)
+            qs = qs.filter(created_at__lt=make_aware(dt))
+        except Exception:
+            pass
+    return qs
+
 
 class ChatMessageListView(generics.ListAPIView):
-    """Read-only list for dashboards/QA with simple filters."""
+    """Read-only list for dashboards/QA with simple filters (?q= for ranked full-text search)."""
     queryset = ChatMessage.objects.all()
     serializer_class = ChatMessageSerializer
     permission_classes = [permissions.AllowAny]  # no auth (dev)
@@ -38,25 +62,13 @@ class ChatMessageListView(generics.ListAPIView):
         if fp := q.get("from_phone"):
             qs = qs.filter(from_phone=fp)
         if tp := q.get("to_phone"):
-            qs = qs.filter(to_phone=tp)
-
-        # start / end filters (YYYY-MM-DD or ISO datetime)
-        start = q.get("start")
-        end = q.get("end")
-        if start:
-            try:
-                dt = parse_datetime(start) or datetime.fromisoformat(start)
-                qs = qs.filter(created_at__gte=make_aware(dt))
-            except Exception:
-                pass
-        if end:
-            try:
-                dt = parse_datetime(end) or datetime.fromisoformat(end)
-                if len(end) == 10:  # if only date provided, include whole day
-                    dt = dt + timedelta(days=1)
-                qs = qs.filter(created_at__lt=make_aware(dt))
-            except Exception:
-                pass
+            qs = qs.filter(compact.value_q(ChatMessage, "to_phone_ref", tp, qs.db))
+
+        qs = _filter_by_date(qs, q)
+
+        # free-text search over user_text/response_text, best matches first
+        if text := (q.get("q") or "").strip():
+            qs = search.search(qs, text)
 
         return qs
 
@@ -74,7 +86,8 @@ class ChatMessageCSVExport(APIView):
         w.writerow([
             "created_at", "from_phone", "to_phone", "user_text",
             "response_text", "latency_ms", "delivery_status",
-            "message_sid", "outbound_message_sid"
+            "message_sid", "outbound_message_sid",
+            "prompt_tokens", "completion_tokens", "finish_reason", "cost_usd",
         ])
         for m in qs:
             w.writerow([
@@ -84,6 +97,7 @@ class ChatMessageCSVExport(APIView):
                 (m.response_text or "").replace("\n", " "),
                 m.latency_ms, m.delivery_status or "",
                 m.message_sid or "", m.outbound_message_sid or "",
+                m.prompt_tokens, m.completion_tokens, m.finish_reason or "", f"{m.cost_usd:.6f}",
             ])
 
         # optional: also save the CSV on disk (dev convenience)
@@ -94,101 +108,202 @@ class ChatMessageCSVExport(APIView):
         return resp
 
 
-@method_decorator(csrf_exempt, name="dispatch")
-class HealthView(APIView):
+class UsageSummaryView(APIView):
+    """
+    GET /usage?group_by=model|sender&start=&end=&limit=
+    Token/cost/latency totals per model or per sender, most expensive first.
+    `truncated` counts replies that stopped at MAX_TOKENS.
+    """
     permission_classes = [permissions.AllowAny]
+    GROUP_FIELDS = {"model": "model_name_ref", "sender": "from_phone"}
+    DEFAULT_LIMIT, MAX_LIMIT = 100, 1000
+
     def get(self, request, *args, **kwargs):
-        return Response({"ok": True})
+        q = request.query_params
+        field = self.GROUP_FIELDS.get(q.get("group_by", "model"))
+        if not field:
+            return Response({"ok": False, "error": "group_by must be one of: model, sender"}, status=400)
+        try:
+            limit = int(q.get("limit") or self.DEFAULT_LIMIT)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({"ok": False, "error": "limit must be a positive integer"}, status=400)
+        limit = min(limit, self.MAX_LIMIT)
+
+        qs = _filter_by_date(ChatMessage.objects.all(), q)
+        rows = (qs.order_by()
+                  .values(key=compact.value_expr(ChatMessage, field))
+                  .annotate(
+                      messages=Count("id"),
+                      total_prompt_tokens=Sum("prompt_tokens"),
+                      total_completion_tokens=Sum("completion_tokens"),
+                      total_cost_usd=Sum("cost_usd"),
+                      avg_latency_ms=Avg("latency_ms"),
+                      avg_completion_tokens=Avg("completion_tokens"),
+                      truncated=Count("id", filter=compact.value_q(ChatMessage, "finish_reason_ref", TRUNCATED_REASONS)),
+                  )
+                  .order_by("-total_cost_usd")[:limit])
+
+        results = []
+        for r in rows:
+            r["truncated_pct"] = round(100 * r["truncated"] / r["messages"], 2) if r["messages"] else 0
+            results.append(r)
+        return Response({"group_by": q.get("group_by", "model"), "results": results})
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class WhatsAppWebhookView(APIView):
-    """Twilio → our server. We answer with Gemini, save, then send reply via REST API."""
-    authentication_classes, permission_classes = [], [permissions.AllowAny]
-
-    def post(self, request, *args, **kwargs):
-        data = request.data
+class HealthView(APIView):
+    permission_classes = [permissions.AllowAny]
+    def get(self, request, *args, **kwargs):
+        return Response({"ok": True, "admission": ratelimit.snapshot()})
 
-        user_text    = (data.get("Body") or "").strip()
-        from_phone   = data.get("From") or ""               # whatsapp:+91xxxx
-        to_phone     = data.get("To") or ""                 # whatsapp:+14xxxx
-        message_sid  = data.get("MessageSid") or data.get("SmsMessageSid") or ""
-        account_sid  = data.get("AccountSid") or ""
-        sms_status   = data.get("SmsStatus") or ""
-        message_type = data.get("MessageType") or ""
-        num_media    = int(data.get("NumMedia") or 0)
-        num_segments = int(data.get("NumSegments") or 1)
-        wa_id        = data.get("WaId") or ""
-        profile_name = data.get("ProfileName") or ""
-        api_version  = data.get("ApiVersion") or ""
-        meta_raw     = data.get("ChannelMetadata")
 
-        try:
-            channel_metadata = json.loads(meta_raw) if meta_raw else None
-        except Exception:
-            channel_metadata = {"raw": meta_raw}
+def ask_llm(user_text):
+    """-> (reply_text, latency_ms, usage)"""
+    # # 1) Ask Gemini
+    # reply_text, latency_ms = ask_gemini(user_text)
+    # 1) Ask OpenAI
+    with tracing.span("llm.openai", {"llm.model": MODEL_NAME}) as sp:
+        reply_text, latency_ms, usage = ask_openai(user_text)
+        sp.set_attribute("llm.usage.prompt_tokens", usage["prompt_tokens"])
+        sp.set_attribute("llm.usage.completion_tokens", usage["completion_tokens"])
+    return reply_text, latency_ms, usage
 
-        # # 1) Ask Gemini
-        # reply_text, latency_ms = ask_gemini(user_text)
-        # 1) Ask OpenAI
-        reply_text, latency_ms = ask_openai(user_text)
 
-        # 2) Persist inbound + our response
+def save_reply(data, answer, status_callback, trace_parent=None, on_begin=None, on_saved=None):
+    """
+    Persist the inbound message + our answer (from ask_llm) with the reply queued in
+    the outbox, all in one transaction, then send it. `on_begin()` and `on_saved(cm)`
+    run inside that transaction, first and last: the sharded workers re-check their
+    claim first (a write, so on SQLite the transaction holds the write lock before it
+    reads anything) and mark their queue row done last.
+    """
+    reply_text, latency_ms, usage = answer
+    meta_raw = data.get("ChannelMetadata")
+    try:
+        channel_metadata = json.loads(meta_raw) if meta_raw else None
+    except Exception:
+        channel_metadata = {"raw": meta_raw}
+    from_phone = data.get("From") or ""
+    # interned up front: a dedup row, harmless if the transaction below rolls back
+    channel_metadata_ref_id = compact.intern_metadata(channel_metadata)
+
+    # 2) Persist inbound + our response, with the reply queued in the outbox (same transaction)
+    with tracing.span("db.insert"), transaction.atomic():
+        if on_begin is not None:
+            on_begin()
         cm = ChatMessage.objects.create(
-            message_sid=message_sid,
-            account_sid=account_sid,
-            sms_status=sms_status,
-            message_type=message_type,
-            num_media=num_media,
-            num_segments=num_segments,
-            wa_id=wa_id,
-            profile_name=profile_name,
-            api_version=api_version,
-            channel_metadata=channel_metadata,
+            message_sid=data.get("MessageSid") or data.get("SmsMessageSid") or "",
+            account_sid_ref=data.get("AccountSid") or "",
+            sms_status_ref=data.get("SmsStatus") or "",
+            message_type_ref=data.get("MessageType") or "",
+            num_media=int(data.get("NumMedia") or 0),
+            num_segments=int(data.get("NumSegments") or 1),
+            wa_id=data.get("WaId") or "",
+            profile_name=data.get("ProfileName") or "",
+            api_version_ref=data.get("ApiVersion") or "",
+            channel_metadata_ref_id=channel_metadata_ref_id,
             from_phone=from_phone,
-            to_phone=to_phone,
-            user_text=user_text,
+            to_phone_ref=data.get("To") or "",
+            user_text=(data.get("Body") or "").strip(),
             response_text=reply_text,
-            model_name=MODEL_NAME,
+            model_name_ref=MODEL_NAME,
             temperature=TEMPERATURE,
             latency_ms=latency_ms,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            finish_reason_ref=usage["finish_reason"],
+            cost_usd=usage["cost_usd"],
+            trace_parent=trace_parent,
         )
+        pending = outbox.enqueue(from_phone, body=reply_text, status_callback=status_callback,
+                                 chat_message=cm, deliver_now=True)
+        if on_saved is not None:
+            on_saved(cm)
+
+    # 3) Send reply via Twilio REST API right away; if that fails the dispatcher retries it
+    outbox.deliver(pending)
+    return cm
+
+
+def reply_to(data, status_callback, trace_parent=None, on_begin=None, on_saved=None):
+    """Answer an already admitted message end to end (process_inbound workers, see shards.py)."""
+    answer = ask_llm((data.get("Body") or "").strip())
+    return save_reply(data, answer, status_callback, trace_parent, on_begin=on_begin, on_saved=on_saved)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class WhatsAppWebhookView(View):
+    """
+    Twilio → our server. We answer with Gemini, save, then send reply via REST API.
+    A plain Django view served by the lean ingress (see ingress.py), not DRF.
+    With INBOUND_SHARDED the message is only queued here and a process_inbound
+    worker answers it, in order with the rest of its conversation (see shards.py).
+    """
+    http_method_names = ["post"]
+
+    def post(self, request, *args, **kwargs):
+        return self.handle(request, ingress.form_data(request))
+
+    @tracing.traced("webhook.inbound")
+    def handle(self, request, data):
+
+        user_text    = (data.get("Body") or "").strip()
+        from_phone   = data.get("From") or ""               # whatsapp:+91xxxx
+        message_sid  = data.get("MessageSid") or data.get("SmsMessageSid") or ""
+        wa_id        = data.get("WaId") or ""
+
+        # 0) Admission control: per-sender rate limit, then a fair slot for the LLM call
+        sender = wa_id or from_phone
+        root = tracing.current()
+        root.set_attribute("messaging.message.id", message_sid)
+        trace_parent = tracing.traceparent()
+        if shards.ENABLED:
+            # queued: the workers bound LLM concurrency, so only the rate limit applies here
+            with tracing.span("webhook.enqueue") as sp:
+                admission = ratelimit.allow(sender)
+                sp.set_attribute("admission", admission)
+                if admission == "ok":
+                    shards.enqueue(sender, data, request.build_absolute_uri(reverse("twilio-status")),
+                                   trace_parent)
+            return ingress.EMPTY_TWIML()
+
+        with tracing.span("webhook.admission") as sp:
+            admission = ratelimit.admit(sender)
+            sp.set_attribute("admission", admission)
+        if admission == "limited":
+            return ingress.EMPTY_TWIML()
+        if admission == "shed":
+            # canned reply straight in the TwiML: no LLM call, no REST send
+            return ingress.SHED_TWIML()
 
-        # 3) Send reply via Twilio REST API (explicit enqueue)
-        status_cb_url = request.build_absolute_uri(reverse("twilio-status"))
         try:
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-            msg = client.messages.create(
-                from_=settings.WHATSAPP_FROM,  # e.g., 'whatsapp:+141xxxxxx'
-                to=from_phone,
-                body=reply_text,
-                status_callback=status_cb_url,
-            )
-            cm.outbound_message_sid = msg.sid
-            cm.delivery_status = "queued"
-            cm.save(update_fields=["outbound_message_sid", "delivery_status"])
-        except Exception as e:
-            cm.delivery_status = "failed"
-            cm.delivery_error_message = f"{type(e).__name__}: {e}"
-            cm.save(update_fields=["delivery_status", "delivery_error_message"])
+            answer = ask_llm(user_text)
+        finally:
+            ratelimit.done(sender)
+
+        save_reply(data, answer, request.build_absolute_uri(reverse("twilio-status")), trace_parent)
 
         # 4) Minimal TwiML response
-        return Response("<Response/>", content_type="application/xml")
+        return ingress.EMPTY_TWIML()
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class StatusCallbackView(APIView):
-    """Twilio delivery status: queued/sent/delivered/failed."""
-    authentication_classes, permission_classes = [], [permissions.AllowAny]
+class StatusCallbackView(View):
+    """Twilio delivery status: queued/sent/delivered/failed. Plain Django view, like the webhook."""
+    http_method_names = ["get", "post"]
+    # the only columns a callback reads or writes (delivery_status: legacy twin of delivery_status_ref)
+    FIELDS = ("id", "trace_parent", "delivery_status_ref", "delivery_status",
+              "delivery_error_code", "delivery_error_message")
 
     def get(self, request, *args, **kwargs):
-        return self._save_status(request)
+        return self.handle(request, ingress.form_data(request))
 
-    def post(self, request, *args, **kwargs):
-        return self._save_status(request)
+    post = get
 
-    def _save_status(self, request):
-        data = request.query_params if request.method == "GET" else request.data
+    @tracing.traced("twilio.status_callback")
+    def handle(self, request, data):
         outbound_sid = data.get("MessageSid") or data.get("SmsSid") or ""
         status       = data.get("MessageStatus") or data.get("SmsStatus") or ""
         to_phone     = data.get("To") or ""
@@ -197,21 +312,57 @@ class StatusCallbackView(APIView):
         error_msg    = data.get("ErrorMessage")
 
         cm = None
-        if outbound_sid:
-            cm = ChatMessage.objects.filter(outbound_message_sid=outbound_sid).first()
-        if not cm:  # fallback by conversation
-            cm = (ChatMessage.objects
-                  .filter(from_phone=from_phone, to_phone=to_phone)
-                  .order_by("-created_at")
-                  .first())
+        messages = ChatMessage.objects.only(*self.FIELDS)
+        with tracing.span("db.lookup"):
+            if outbound_sid:
+                cm = messages.filter(outbound_message_sid=outbound_sid).first()
+            if not cm:  # fallback by conversation
+                cm = (messages
+                      .filter(compact.value_q(ChatMessage, "to_phone_ref", to_phone), from_phone=from_phone)
+                      .order_by("-created_at")
+                      .first())
 
         if cm:
-            cm.delivery_status = status or cm.delivery_status
+            # tie this callback to the trace of the inbound message that produced the reply
+            root = tracing.current()
+            root.add_link(cm.trace_parent)
+            root.set_attribute("messaging.outbound.id", outbound_sid)
+            root.set_attribute("messaging.status", status)
+            cm.delivery_status_ref = status or cm.delivery_status
             cm.delivery_error_code = error_code or cm.delivery_error_code
             cm.delivery_error_message = error_msg or cm.delivery_error_message
-            cm.save(update_fields=["delivery_status", "delivery_error_code", "delivery_error_message"])
+            # undelivered/failed with a transient ErrorCode goes back to the outbox
+            if status in ("failed", "undelivered") and outbound_sid:
+                row = outbox.retry_from_status(outbound_sid, error_code)
+                if row is not None and row.status == OutboundMessage.PENDING:
+                    cm.delivery_status_ref = "retrying"
+            with tracing.span("db.update"):
+                cm.save(update_fields=["delivery_status_ref", "delivery_error_code", "delivery_error_message"])
 
-        return Response("OK")
+        return ingress.OK()
+
+
+class OutboxDeadLetterView(generics.ListAPIView):
+    """
+    GET  /outbox/dead              replies that permanently failed or ran out of retries
+    POST /outbox/dead {"ids": [..]} put them back in the queue (omit ids = all); staff only
+    """
+    serializer_class = OutboundMessageSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def get_permissions(self):
+        if self.request.method == "POST":  # requeueing re-sends messages to customers
+            return [permissions.IsAdminUser()]
+        return super().get_permissions()
+
+    def get_queryset(self):
+        return OutboundMessage.objects.filter(status=OutboundMessage.DEAD)
+
+    def post(self, request, *args, **kwargs):
+        qs = self.get_queryset()
+        if ids := request.data.get("ids"):
+            qs = qs.filter(pk__in=ids)
+        return Response({"ok": True, "requeued": outbox.requeue(qs)}, status=http_status.HTTP_202_ACCEPTED)
 
 
 # ---------- ad-hoc senders (image/pdf by URL) ----------
@@ -227,6 +378,7 @@ class SendImageView(APIView):
     """
     permission_classes = [permissions.AllowAny]
 
+    @tracing.traced("send.image")
     def post(self, request):
         to = request.data.get("to", "")
         image_url = request.data.get("image_url", "")
@@ -235,16 +387,18 @@ class SendImageView(APIView):
         if not (to.startswith("whatsapp:+") and image_url.startswith("https://")):
             return Response({"ok": False, "error": "Provide to=whatsapp:+<number> and a public https image_url"}, status=400)
 
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        client = twilio_client.get_client()
         status_cb = request.build_absolute_uri("/status")
 
-        msg = client.messages.create(
-            from_=settings.WHATSAPP_FROM,
-            to=to,
-            body=caption or None,
-            media_url=[image_url],
-            status_callback=status_cb,
-        )
+        with tracing.span("twilio.send") as sp:
+            msg = client.messages.create(
+                from_=settings.WHATSAPP_FROM,
+                to=to,
+                body=caption or None,
+                media_url=[image_url],
+                status_callback=status_cb,
+            )
+            sp.set_attribute("messaging.outbound.id", msg.sid)
         return Response({"ok": True, "sid": msg.sid})
 
 
@@ -260,6 +414,7 @@ class SendPDFView(APIView):
     """
     permission_classes = [permissions.AllowAny]
 
+    @tracing.traced("send.pdf")
     def post(self, request):
         to = request.data.get("to", "")
         pdf_url = request.data.get("pdf_url", "")
@@ -271,20 +426,20 @@ class SendPDFView(APIView):
                 status=400,
             )
 
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        client = twilio_client.get_client()
         status_cb = request.build_absolute_uri("/status")
 
-        msg = client.messages.create(
-            from_=settings.WHATSAPP_FROM,
-            to=to,
-            body=caption or None,
-            media_url=[pdf_url],
-            status_callback=status_cb,
-        )
+        with tracing.span("twilio.send") as sp:
+            msg = client.messages.create(
+                from_=settings.WHATSAPP_FROM,
+                to=to,
+                body=caption or None,
+                media_url=[pdf_url],
+                status_callback=status_cb,
+            )
+            sp.set_attribute("messaging.outbound.id", msg.sid)
         return Response({"ok": True, "sid": msg.sid})
 
-import re
-import pdfkit
 # map only the emojis you use (add more as needed)
 TWMAP = {
     "🛍️": "1f6cd",            # shopping bags
@@ -334,6 +489,7 @@ class ConvertHtml2PDF(APIView):
     permission_classes = [permissions.AllowAny]
 
     def post(self, request):
+        import pdfkit  # imported on use: only this view needs the PDF stack
         from .one1 import email_content  # your HTML in py string variable (email_content="html content...")
 
         reports_dir = os.path.join(settings.MEDIA_ROOT, "reports")